@@ -1,18 +1,60 @@
-from flask import Flask, request, render_template_string, jsonify
+from flask import Flask, Response, g, request, render_template_string, jsonify, stream_with_context
 from flask_cors import CORS
-import tensorflow as tf
-from PIL import Image
-import numpy as np
-import io
+import json
 import logging
+import threading
+import time
+import config
+from embeddings import SimilarityIndex
+from jobs import JobManager, QueueFull, UploadTooLarge, expand_uploads
+import metrics
+from metrics import trace
+from model_registry import ModelRouter
+from prediction_cache import create_prediction_cache
 
 app = Flask(__name__)
 CORS(app)
 
-# Load model and labels
-model = tf.keras.models.load_model('models/best_cattle_breed_model.h5')
-with open('models/labels.txt', 'r') as f:
-    class_names = [line.strip() for line in f.readlines()]
+# Models and labels are loaded by the router's watcher thread, not at import, so
+# workers start fast and TensorFlow is only imported when a model is needed.
+# New registry versions are loaded and warmed off the request path, then swapped in.
+router = ModelRouter()
+
+# Identical uploads (retries, double submits) are answered from cache
+prediction_cache = create_prediction_cache()
+
+# Reference images for /similar; only loaded when the index has been built
+similarity = SimilarityIndex()
+
+# Bulk uploads run in the background; progress lives in sqlite so any worker can answer polls.
+# Created by start_serving()
+job_manager = None
+start_lock = threading.Lock()
+
+def start_serving(mode=None):
+    """Begin loading per config.STARTUP_MODE ('eager' blocks, 'background' returns at once); runs once"""
+    global job_manager
+    mode = mode or config.STARTUP_MODE
+    if mode not in ('eager', 'background'):
+        raise ValueError(f"Unknown STARTUP_MODE '{mode}', expected 'eager' or 'background'")
+    with start_lock:
+        if job_manager is not None:
+            return
+        if mode == 'eager':
+            router.load()
+            if similarity.available:
+                similarity.load()
+        else:
+            router.start_background_load()
+            if similarity.available:
+                similarity.start_background_load()
+        job_manager = JobManager(router, top_predictions, cache=prediction_cache)
+
+@app.before_request
+def ensure_serving():
+    """Importing app starts nothing; a WSGI server that never called start_serving() gets it here"""
+    if job_manager is None:
+        start_serving()
 
 # Hindi translations
 hindi_names = {
@@ -59,11 +101,6 @@ hindi_names = {
     "Vechur": "वचूर"
 }
 
-def preprocess_image(image_bytes):
-    img = Image.open(io.BytesIO(image_bytes)).convert('RGB').resize((224, 224))
-    arr = np.array(img) / 255.0
-    return arr.reshape((1, 224, 224, 3))
-
 # HTML template
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -229,6 +266,30 @@ predictBtn.addEventListener('click', () => {
 </html>
 '''
 
+def top_predictions(preds, class_names, k=3):
+    """Top-k labels with Hindi names and confidences, as returned by /predict"""
+    top = preds.argsort()[-k:][::-1]
+    return [
+        {'label': class_names[i], 'hindi': hindi_names.get(class_names[i], "---"), 'confidence': float(preds[i])}
+        for i in top
+    ]
+
+metrics.QUEUE_DEPTH.set_function(router.queue_depth)
+metrics.JOBS_PENDING.set_function(lambda: job_manager.pending if job_manager else 0)
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'unmatched'
+    metrics.REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    started = g.get('request_started')
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    return response
+
 @app.route('/', methods=['GET'])
 def index():
     return render_template_string(HTML_TEMPLATE, hindi_names=hindi_names)
@@ -237,18 +298,141 @@ def index():
 def predict():
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
+    # One version per request, weighted by routing.json; the pick is held even if a swap happens mid-request
+    model = router.choose()
+    if model is None or not model.ready:
+        return jsonify({'error': '⏳ Model is loading, please retry. मॉडल लोड हो रहा है'}), 503
     try:
-        img = preprocess_image(request.files['file'].read())
-        preds = model.predict(img)[0]
-        top = preds.argsort()[-3:][::-1]
-        predictions = [
-            {'label': class_names[i], 'hindi': hindi_names.get(class_names[i], "---"), 'confidence': float(preds[i])}
-            for i in top
-        ]
-        return jsonify({'predictions': predictions})
+        with trace('read'):
+            image_bytes = request.files['file'].read()
+        started = time.perf_counter()
+        cache_key = prediction_cache.key(image_bytes, model.version)
+        predictions = prediction_cache.get(cache_key)
+        if predictions is None:
+            predictions = top_predictions(model.predict(image_bytes), model.class_names)
+            prediction_cache.put(cache_key, predictions)
+            # Cache hits skip the model, so only real inferences feed the per-version stats
+            router.record(model, time.perf_counter() - started, predictions[0]['confidence'])
+        with trace('encode'):
+            return jsonify({'predictions': predictions, 'model_version': model.name})
     except Exception as e:
         logging.error("Prediction error", exc_info=True)
         return jsonify({'error': '❌ Failed to process image. कृपया दोबारा कोशिश करें'}), 500
 
+@app.route('/similar', methods=['POST'])
+def similar():
+    """Reference animals closest to the upload in the model's embedding space (?k=<matches>)"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+    if not similarity.available:
+        return jsonify({'error': 'Similarity index not built, run: python embeddings.py build'}), 503
+    if not similarity.ready:
+        return jsonify({'error': '⏳ Similarity index is loading, please retry. कृपया दोबारा कोशिश करें'}), 503
+    k = min(max(request.args.get('k', config.SIMILAR_TOP_K, type=int), 1), 50)
+    try:
+        with trace('read'):
+            image_bytes = request.files['file'].read()
+        with trace('similar'):
+            matches = similarity.query(image_bytes, k)
+        with trace('encode'):
+            return jsonify({'matches': [
+                {**m, 'hindi': hindi_names.get(m['label'], "---")} for m in matches
+            ]})
+    except Exception:
+        logging.error("Similarity search error", exc_info=True)
+        return jsonify({'error': '❌ Failed to process image. कृपया दोबारा कोशिश करें'}), 500
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue several images (any number of 'file'/'files' fields, or zip archives) for background prediction"""
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
+    if not router.ready:
+        return jsonify({'error': '⏳ Model is loading, please retry. मॉडल लोड हो रहा है'}), 503
+    try:
+        images = expand_uploads((f.filename or '', f.read()) for f in uploads)
+    except UploadTooLarge as e:
+        return jsonify({'error': f'❌ {e}'}), 413
+    except Exception:
+        logging.error("Job upload error", exc_info=True)
+        return jsonify({'error': '❌ Could not read the uploaded files'}), 400
+    if not images:
+        return jsonify({'error': 'No images found in upload'}), 400
+    try:
+        job_id = job_manager.submit(images)
+    except QueueFull:
+        response = jsonify({'error': '🚦 Server busy, please retry shortly. कृपया थोड़ी देर बाद कोशिश करें'})
+        response.headers['Retry-After'] = str(config.JOB_RETRY_AFTER)
+        return response, 429
+    return jsonify({
+        'job_id': job_id,
+        'total': len(images),
+        'status_url': f'/jobs/{job_id}',
+        'events_url': f'/jobs/{job_id}/events'
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Job progress and results; pass ?after=<seq> to fetch only results newer than the last poll"""
+    job = job_manager.get(job_id, request.args.get('after', 0, type=int))
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events: one 'result' event per image as it completes, then 'done'"""
+    if job_manager.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    # Reconnecting EventSource clients resume from the last id they saw
+    start = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+
+    def stream():
+        after = start
+        while True:
+            job = job_manager.get(job_id, after)
+            if job is None:
+                return
+            for result in job['results']:
+                after = result['seq']
+                yield f"id: {after}\nevent: result\ndata: {json.dumps(result)}\n\n"
+            if job['status'] == 'done':
+                summary = {k: job[k] for k in ('job_id', 'total', 'completed', 'failed')}
+                yield f"event: done\ndata: {json.dumps(summary)}\n\n"
+                return
+            time.sleep(config.JOB_EVENTS_POLL_S)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and answering"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: every routed model version loaded and warmed up"""
+    status = router.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of this process's counters and histograms"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        **router.status(),
+        'models': router.stats(),
+        'prediction_cache': prediction_cache.stats(),
+        'jobs': job_manager.stats() if job_manager else None,
+        'similarity': similarity.status()
+    })
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
+    start_serving()
+    # No debug reloader: it would run this module, and load every model, in a second process
+    app.run(host="0.0.0.0", port=8000, debug=False, use_reloader=False)
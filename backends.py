@@ -0,0 +1,137 @@
+import os
+import threading
+import numpy as np
+import config
+
+BACKENDS = ('keras', 'savedmodel', 'tflite')
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model_path=None):
+        import tensorflow as tf
+
+        if model_path is None:
+            model_path = config.BEST_MODEL_PATH if os.path.exists(config.BEST_MODEL_PATH) else config.MODEL_PATH
+        self.model_path = model_path
+        self.model = tf.keras.models.load_model(model_path)
+        self.input_size = self.model.input_shape[1]
+
+    def predict(self, batch):
+        """Run one forward pass on a (N, H, W, 3) float batch"""
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class SavedModelBackend:
+    name = 'savedmodel'
+
+    def __init__(self, model_path=None):
+        import tensorflow as tf
+
+        self._tf = tf
+        self.model_path = model_path or config.SAVED_MODEL_DIR
+        self._loaded = tf.saved_model.load(self.model_path)
+        self._fn = self._loaded.signatures['serving_default']
+        _, input_spec = self._fn.structured_input_signature
+        self._input_name, spec = next(iter(input_spec.items()))
+        self._input_dtype = spec.dtype
+        self.input_size = spec.shape[1]
+
+    def predict(self, batch):
+        """Run the serving signature on a (N, H, W, 3) float batch"""
+        x = self._tf.constant(batch, dtype=self._input_dtype)
+        outputs = self._fn(**{self._input_name: x})
+        return next(iter(outputs.values())).numpy()
+
+
+def _tflite_interpreter_class():
+    """Prefer the standalone tflite_runtime package, fall back to full TensorFlow"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, model_path=None, num_threads=None):
+        self.model_path = model_path or config.TFLITE_MODEL_PATH
+        self.num_threads = num_threads if num_threads is not None else config.TFLITE_NUM_THREADS
+        self._interpreter_class = _tflite_interpreter_class()
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self.pool_size = 0
+
+        # Build one interpreter up front so load errors surface at startup
+        state = self._state()
+        self.input_size = state['input']['shape'][1]
+
+    def _state(self):
+        """Interpreter owned by the calling thread, created on first use"""
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            interpreter = self._interpreter_class(model_path=self.model_path, num_threads=self.num_threads)
+            interpreter.allocate_tensors()
+            state = {
+                'interpreter': interpreter,
+                'input': interpreter.get_input_details()[0],
+                'output': interpreter.get_output_details()[0],
+                'batch_size': int(interpreter.get_input_details()[0]['shape'][0]),
+            }
+            self._local.state = state
+            with self._pool_lock:
+                self.pool_size += 1
+        return state
+
+    def predict(self, batch):
+        """Invoke this thread's interpreter on a (N, H, W, 3) float batch"""
+        state = self._state()
+        interpreter = state['interpreter']
+        input_details = state['input']
+
+        # Tensors are only reallocated when the batch size changes
+        n = batch.shape[0]
+        if n != state['batch_size']:
+            interpreter.resize_tensor_input(input_details['index'], [n] + list(input_details['shape'][1:]))
+            interpreter.allocate_tensors()
+            state['input'] = input_details = interpreter.get_input_details()[0]
+            state['output'] = interpreter.get_output_details()[0]
+            state['batch_size'] = n
+
+        interpreter.set_tensor(input_details['index'], quantize(batch, input_details))
+        interpreter.invoke()
+        return dequantize(interpreter.get_tensor(state['output']['index']), state['output'])
+
+
+def quantize(batch, details):
+    """Float input → the tensor's dtype, applying scale/zero-point for integer models"""
+    dtype = details['dtype']
+    scale, zero_point = details['quantization']
+    if np.issubdtype(dtype, np.integer) and scale:
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+    return np.asarray(batch, dtype=dtype)
+
+
+def dequantize(output, details):
+    """Integer model output → float probabilities (always returns a fresh array)"""
+    scale, zero_point = details['quantization']
+    if np.issubdtype(output.dtype, np.integer) and scale:
+        return (output.astype(np.float32) - zero_point) * scale
+    return output.copy()
+
+
+def load_backend(kind=None, model_path=None, num_threads=None):
+    """Create the inference backend selected in config.INFERENCE_BACKEND"""
+    kind = (kind or config.INFERENCE_BACKEND).lower()
+    if kind == 'keras':
+        return KerasBackend(model_path)
+    if kind == 'savedmodel':
+        return SavedModelBackend(model_path)
+    if kind == 'tflite':
+        return TFLiteBackend(model_path, num_threads=num_threads)
+    raise ValueError(f"Unknown inference backend '{kind}', expected one of {BACKENDS}")
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+import config
+from metrics import BATCH_SIZE, QUEUE_WAIT_SECONDS, observe_stage
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=None, max_wait_ms=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size or config.BATCH_MAX_SIZE
+        self.max_wait = (config.BATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        # Stats
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_size_hist = {}
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._inference_total = 0.0
+
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, x):
+        """Queue one preprocessed image (H, W, C) and return a Future of its prediction row"""
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Batcher is stopped")
+            self._pending.append((x, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def predict(self, x, timeout=None):
+        """Blocking helper: submit one image and wait for its prediction"""
+        return self.submit(x).result(timeout=timeout)
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stop(self):
+        """Stop the worker after draining pending requests"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._worker.join()
+
+    def _collect_batch(self):
+        """Wait for the first request, then fill until max size or max wait"""
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if not self._pending:
+                return None
+
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch_size and not self._stopped:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            n = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            waits = [started - enqueued for _, _, enqueued in batch]
+            try:
+                inputs = np.stack([x for x, _, _ in batch])
+                outputs = self.predict_fn(inputs)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - started
+
+            for (_, future, _), row in zip(batch, outputs):
+                future.set_result(row)
+
+            self._record(len(batch), waits, elapsed)
+
+    def _record(self, size, waits, elapsed):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._batch_size_hist[size] = self._batch_size_hist.get(size, 0) + 1
+            self._queue_wait_total += sum(waits)
+            self._queue_wait_max = max(self._queue_wait_max, max(waits))
+            self._inference_total += elapsed
+        BATCH_SIZE.observe(size)
+        for wait in waits:
+            QUEUE_WAIT_SECONDS.observe(wait)
+        observe_stage('batcher', 'inference', elapsed)
+
+    def stats(self):
+        """Achieved batch sizes and queue latency since startup"""
+        with self._stats_lock:
+            batches = max(self._batches, 1)
+            items = max(self._items, 1)
+            return {
+                'batches': self._batches,
+                'items': self._items,
+                'avg_batch_size': self._items / batches,
+                'batch_size_histogram': dict(sorted(self._batch_size_hist.items())),
+                'avg_queue_wait_ms': 1000.0 * self._queue_wait_total / items,
+                'max_queue_wait_ms': 1000.0 * self._queue_wait_max,
+                'avg_inference_ms': 1000.0 * self._inference_total / batches,
+                'queue_depth': self.queue_depth(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': 1000.0 * self.max_wait,
+            }
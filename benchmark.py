@@ -0,0 +1,393 @@
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from PIL import Image
+import config
+from preprocessing import load_image, new_batch_buffer
+
+# Typical upload sizes: phone camera, downscaled phone share, webcam capture
+IMAGE_SIZES = [(4032, 3024), (1920, 1080), (640, 480)]
+
+def synthetic_jpeg(width, height, quality=90, seed=0):
+    """Smooth random image encoded as JPEG (noise would defeat the codec and skew timings)"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, size=(max(height // 64, 2), max(width // 64, 2), 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality)
+    return buf.getvalue()
+
+def legacy_app_preprocess(image_bytes):
+    """app.py preprocess_image before the shared preprocessing module"""
+    img = Image.open(io.BytesIO(image_bytes)).convert('RGB').resize((224, 224))
+    arr = np.array(img) / 255.0
+    return arr.reshape((1, 224, 224, 3))
+
+def legacy_predictor_preprocess(image_bytes):
+    """CattleBreedPredictor.preprocess_image before the shared preprocessing module"""
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img = img.resize((config.IMG_SIZE, config.IMG_SIZE))
+    x = np.asarray(img, dtype=np.float32)
+    x = np.expand_dims(x, axis=0)
+    return x / 255.0
+
+def percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        'mean_ms': statistics.fmean(ordered),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+    }
+
+def time_calls(fn, repeats):
+    fn()  # Warm-up
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(1000.0 * (time.perf_counter() - start))
+    return percentiles(samples)
+
+def decode_candidates(buffer):
+    return {
+        'legacy_app': legacy_app_preprocess,
+        'legacy_predictor': legacy_predictor_preprocess,
+        'preprocessing': lambda data: load_image(data, out=buffer[0]),
+    }
+
+def run_decode_worker(name, path):
+    """Child-process entry: peak RSS growth of one decode, including Pillow's C buffers"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    fn = decode_candidates(new_batch_buffer(1))[name]
+    before = reset_peak_rss()
+    fn(data)
+    peak = window_peak_rss_mb()
+    print('BENCHMARK_RESULT ' + json.dumps({'peak_rss_mb': peak, 'decode_peak_mb': peak - before}))
+
+def benchmark_decode(repeats=20):
+    """Per-image decode latency and peak memory: legacy functions vs preprocessing.load_image
+
+    Memory is measured in a fresh process per candidate and image, since
+    tracemalloc cannot see the decoder's own allocations.
+    """
+    candidates = decode_candidates(new_batch_buffer(1))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height in IMAGE_SIZES:
+            data = synthetic_jpeg(width, height)
+            path = os.path.join(tmp, f"{width}x{height}.jpg")
+            with open(path, 'wb') as f:
+                f.write(data)
+            label = f"{width}x{height}"
+            results[label] = {}
+            print(f"\n📸 {label} JPEG ({len(data) / 1024:.0f} KB)")
+            for name, fn in candidates.items():
+                stats = time_calls(lambda: fn(data), repeats)
+                stats.update(run_child([sys.executable, os.path.abspath(__file__), '--decode-worker', name,
+                                        '--images', path]))
+                results[label][name] = stats
+                peak = f"{stats['decode_peak_mb']:6.1f} MB" if 'decode_peak_mb' in stats else "n/a"
+                print(f"  {name:<18} p50 {stats['p50_ms']:7.2f} ms  p95 {stats['p95_ms']:7.2f} ms  peak +{peak}")
+    return results
+
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def reset_peak_rss():
+    """Restart the Linux high-water mark at the current RSS; returns it in MB
+
+    A spawned child's ru_maxrss starts at its parent's peak, which can hide
+    a whole decode, so decode workers read VmHWM after this instead.
+    """
+    if os.path.exists('/proc/self/clear_refs'):
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    return window_peak_rss_mb()
+
+def window_peak_rss_mb():
+    """Peak RSS since reset_peak_rss() where /proc has VmHWM, else ru_maxrss"""
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    return peak_rss_mb()
+
+def set_thread_budget(threads):
+    """Cap TensorFlow's intra/inter-op pools; must run before TF executes anything"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+def run_concurrently(fn, items, concurrency):
+    """Call fn(item) from `concurrency` threads; returns per-call latencies in ms"""
+    latencies = []
+    lock = threading.Lock()
+    queue = list(items)
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                item = queue.pop()
+            start = time.perf_counter()
+            fn(item)
+            elapsed = 1000.0 * (time.perf_counter() - start)
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+def bench_backend(kind, threads, batch_sizes, repeats, process_start):
+    """Raw backend.predict on preprocessed batches"""
+    if kind != 'tflite':
+        set_thread_budget(threads)
+    from backends import load_backend
+
+    start = time.perf_counter()
+    backend = load_backend(kind, num_threads=threads)
+    load_s = time.perf_counter() - start
+    size = backend.input_size or config.IMG_SIZE
+
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    backend.predict(rng.random((1, size, size, 3), dtype=np.float32))
+    first_s = time.perf_counter() - start
+
+    result = {'load_s': load_s, 'first_predict_s': first_s,
+              'cold_start_s': time.perf_counter() - process_start, 'batches': {}}
+    for batch_size in batch_sizes:
+        batch = rng.random((batch_size, size, size, 3), dtype=np.float32)
+        stats = time_calls(lambda: backend.predict(batch), repeats)
+        stats['images_per_sec'] = 1000.0 * batch_size / stats['p50_ms']
+        result['batches'][str(batch_size)] = stats
+    return result
+
+def bench_predictor(kind, threads, image_paths, repeats, process_start):
+    """CattleBreedPredictor.predict end to end (decode + inference + top-k)"""
+    if kind != 'tflite':
+        set_thread_budget(threads)
+    config.TFLITE_NUM_THREADS = threads
+    from predict import CattleBreedPredictor
+
+    start = time.perf_counter()
+    predictor = CattleBreedPredictor(backend=kind)
+    load_s = time.perf_counter() - start
+    start = time.perf_counter()
+    predictor.predict(image_paths[0])
+    first_s = time.perf_counter() - start
+
+    result = {'load_s': load_s, 'first_predict_s': first_s,
+              'cold_start_s': time.perf_counter() - process_start, 'images': {}}
+    for path in image_paths:
+        label = os.path.splitext(os.path.basename(path))[0]
+        result['images'][label] = time_calls(lambda: predictor.predict(path), repeats)
+
+    start = time.perf_counter()
+    predictor.predict_batch(image_paths * max(1, repeats // len(image_paths)))
+    elapsed = time.perf_counter() - start
+    result['predict_batch_images_per_sec'] = len(image_paths) * max(1, repeats // len(image_paths)) / elapsed
+    return result
+
+def bench_app(kind, threads, payloads, concurrency_levels, repeats, process_start):
+    """POST /predict through the Flask test client (batcher included, cache disabled)"""
+    if kind != 'tflite':
+        set_thread_budget(threads)
+    config.INFERENCE_BACKEND = kind
+    config.TFLITE_NUM_THREADS = threads
+    config.PREDICTION_CACHE_SIZE = 0
+    config.PREDICTION_CACHE_BACKEND = None
+    config.STARTUP_MODE = 'eager'
+
+    start = time.perf_counter()
+    import app as serving
+    serving.start_serving()
+    load_s = time.perf_counter() - start
+    client = serving.app.test_client()
+
+    def post(data):
+        response = client.post('/predict', data={'file': (io.BytesIO(data), 'upload.jpg')},
+                               content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f"/predict returned {response.status_code}")
+
+    start = time.perf_counter()
+    post(payloads[0])
+    first_s = time.perf_counter() - start
+
+    result = {'load_s': load_s, 'first_predict_s': first_s,
+              'cold_start_s': time.perf_counter() - process_start, 'concurrency': {}}
+    for concurrency in concurrency_levels:
+        requests = [payloads[i % len(payloads)] for i in range(max(repeats, concurrency * 4))]
+        start = time.perf_counter()
+        latencies = run_concurrently(post, requests, concurrency)
+        elapsed = time.perf_counter() - start
+        stats = percentiles(latencies)
+        stats['requests_per_sec'] = len(requests) / elapsed
+        result['concurrency'][str(concurrency)] = stats
+    server = serving.router.primary()
+    result['batcher'] = server.batcher.stats()
+    result['warmup_s'] = server.timings.get('warmup_s')
+    return result
+
+def run_worker(args, process_start):
+    """Child-process entry: one target at one thread count, JSON on stdout"""
+    target, kind = args.worker.split(':')
+    batch_sizes = [int(v) for v in args.batch_sizes.split(',')]
+    if target == 'backend':
+        result = bench_backend(kind, args.threads, batch_sizes, args.repeats, process_start)
+    elif target == 'predictor':
+        result = bench_predictor(kind, args.threads, args.images, args.repeats, process_start)
+    else:
+        payloads = []
+        for path in args.images:
+            with open(path, 'rb') as f:
+                payloads.append(f.read())
+        result = bench_app(kind, args.threads, payloads, batch_sizes, args.repeats, process_start)
+    result['peak_rss_mb'] = peak_rss_mb()
+    print('BENCHMARK_RESULT ' + json.dumps(result))
+
+def spawn_worker(target, threads, args, image_paths):
+    """Measure one target in a fresh interpreter so cold start and peak RSS are its own"""
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', target, '--threads', str(threads),
+           '--repeats', str(args.repeats), '--batch-sizes', args.batch_sizes, '--images', *image_paths]
+    return run_child(cmd)
+
+def run_child(cmd):
+    """Run a benchmark child process and parse its BENCHMARK_RESULT line"""
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith('BENCHMARK_RESULT '):
+            return json.loads(line[len('BENCHMARK_RESULT '):])
+    return {'error': (proc.stderr or proc.stdout).strip().splitlines()[-1:] or ['no output']}
+
+def compare_reports(current, baseline, tolerance):
+    """Flag p50 latencies that got slower than baseline by more than `tolerance`"""
+    regressions = []
+
+    def walk(cur, base, path):
+        if isinstance(cur, dict) and isinstance(base, dict):
+            for key in cur:
+                if key in base:
+                    walk(cur[key], base[key], path + [key])
+        elif path and path[-1] == 'p50_ms' and isinstance(cur, (int, float)) and base:
+            if cur > base * (1 + tolerance):
+                regressions.append(('/'.join(path), base, cur))
+
+    walk(current, baseline, [])
+    return regressions
+
+def main():
+    process_start = time.perf_counter()
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing and every serving path")
+    parser.add_argument('--targets', default='backend:keras,backend:savedmodel,backend:tflite,'
+                                             'predictor:tflite,app:tflite',
+                        help="Comma-separated <backend|predictor|app>:<keras|savedmodel|tflite>")
+    parser.add_argument('--batch-sizes', default='1,4,16,32',
+                        help="Batch sizes for backends; concurrent clients for app targets")
+    parser.add_argument('--threads', default=','.join(str(t) for t in sorted({1, max(1, cores // 2), cores})),
+                        help="Thread counts to sweep (1..cores)")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--skip-decode', action='store_true')
+    parser.add_argument('--output', default='benchmark_report.json', help="Machine-readable report")
+    parser.add_argument('--compare', help="Previous report; exit 1 if any p50 regressed")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed p50 slowdown vs --compare")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--decode-worker', help=argparse.SUPPRESS)
+    parser.add_argument('--images', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.decode_worker:
+        run_decode_worker(args.decode_worker, args.images[0])
+        return
+
+    if args.worker:
+        args.threads = int(args.threads)
+        run_worker(args, process_start)
+        return
+
+    from model_registry import default_model_path
+    from prediction_cache import model_version
+    report = {
+        'environment': {
+            'cpu_count': cores,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'model_versions': {kind: model_version(default_model_path(kind))
+                               for kind in ('keras', 'savedmodel', 'tflite')
+                               if os.path.exists(default_model_path(kind))},
+        }
+    }
+    if not args.skip_decode:
+        report['decode'] = benchmark_decode(args.repeats)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_paths = []
+        for width, height in IMAGE_SIZES:
+            path = os.path.join(tmp, f"{width}x{height}.jpg")
+            with open(path, 'wb') as f:
+                f.write(synthetic_jpeg(width, height))
+            image_paths.append(path)
+
+        report['serving'] = {}
+        for target in args.targets.split(','):
+            report['serving'][target] = {}
+            for threads in [int(t) for t in args.threads.split(',')]:
+                print(f"\n⏱️  {target} with {threads} thread(s)...")
+                result = spawn_worker(target, threads, args, image_paths)
+                report['serving'][target][str(threads)] = result
+                if 'error' in result:
+                    print(f"  ⚠️  skipped: {result['error'][0]}")
+                    continue
+                print(f"  cold start {result['cold_start_s']:.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+                for group, label in (('batches', 'batch'), ('images', 'image'), ('concurrency', 'clients')):
+                    for name, stats in result.get(group, {}).items():
+                        rate = stats.get('images_per_sec') or stats.get('requests_per_sec')
+                        extra = f", {rate:.1f}/s" if rate else ''
+                        print(f"  {label} {name}: "
+                              f"p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, "
+                              f"p99 {stats['p99_ms']:.2f} ms{extra}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Report saved: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for path, old, new in regressions:
+            print(f"❌ Regression {path}: {old:.2f} → {new:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ No p50 regressions beyond {args.tolerance:.0%} vs {args.compare}")
+
+if __name__ == "__main__":
+    main()
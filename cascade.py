@@ -0,0 +1,265 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+import config
+from metrics import CASCADE_IMAGES, observe_stage
+from preprocessing import load_batch, new_batch_buffer, parallel_loader
+
+def small_model_path(backend):
+    """The small model artifact matching an inference backend"""
+    if backend == 'keras':
+        return config.CASCADE_MODEL_PATH
+    if backend == 'tflite':
+        return config.CASCADE_TFLITE_MODEL_PATH
+    raise ValueError(f"Cascade mode supports the 'keras' and 'tflite' backends, not '{backend}'")
+
+def choose_threshold(small_probs, full_probs, labels, max_drop=None):
+    """Lowest small-model confidence threshold whose cascade top-1 stays within max_drop of the full model
+
+    Images are sorted by small-model confidence; accepting the top i of
+    them gives accuracy (small hits among the accepted + full hits among
+    the rest) / n, computed for every i at once with cumulative sums.
+    Returns (threshold, escalation rate, cascade accuracy).
+    """
+    max_drop = config.CASCADE_MAX_ACCURACY_DROP if max_drop is None else max_drop
+    labels = np.asarray(labels)
+    confidence = small_probs.max(axis=1)
+    small_ok = small_probs.argmax(axis=1) == labels
+    full_ok = full_probs.argmax(axis=1) == labels
+    n = len(labels)
+
+    order = np.argsort(-confidence, kind='stable')
+    accepted_hits = np.cumsum(small_ok[order])
+    escalated_hits = full_ok.sum() - np.cumsum(full_ok[order])
+    accuracy = (accepted_hits + escalated_hits) / n
+
+    # Only cut between different confidences, so ties are accepted or escalated together
+    sorted_conf = confidence[order]
+    cut = np.append(sorted_conf[1:] < sorted_conf[:-1], True)
+    allowed = np.flatnonzero(cut & (accuracy >= full_ok.mean() - max_drop))
+    if len(allowed) == 0:
+        return 1.0 + 1e-6, 1.0, float(full_ok.mean())
+    i = allowed[-1]
+    return float(sorted_conf[i]), float(1 - (i + 1) / n), float(accuracy[i])
+
+def timed_predict(predict_fn, x):
+    start = time.perf_counter()
+    probs = np.asarray(predict_fn(x))
+    return probs, time.perf_counter() - start
+
+def calibrate(small_predict, full_predict, paths, labels, batch_size=None, report_path=None):
+    """Pick the threshold on the val split and record escalation rate and latency per image
+
+    Both models see the same images, each decoded at its own input size,
+    so the report's end-to-end numbers include decode as well as inference.
+    """
+    batch_size = batch_size or config.BATCH_SIZE
+    report_path = report_path or config.CASCADE_REPORT_PATH
+    small_size, full_size = config.CASCADE_IMG_SIZE, config.IMG_SIZE
+    small_probs, full_probs = [], []
+    seconds = {'small_decode': 0.0, 'small_inference': 0.0, 'full_decode': 0.0, 'full_inference': 0.0}
+
+    print(f"🎚️  Calibrating cascade threshold on {len(paths)} val images...")
+    with parallel_loader() as executor:
+        for start in range(0, len(paths), batch_size):
+            chunk = paths[start:start + batch_size]
+            t = time.perf_counter()
+            x_small = load_batch(chunk, small_size, executor=executor)
+            seconds['small_decode'] += time.perf_counter() - t
+            t = time.perf_counter()
+            x_full = load_batch(chunk, full_size, executor=executor)
+            seconds['full_decode'] += time.perf_counter() - t
+
+            probs, elapsed = timed_predict(small_predict, x_small)
+            small_probs.append(probs)
+            seconds['small_inference'] += elapsed
+            probs, elapsed = timed_predict(full_predict, x_full)
+            full_probs.append(probs)
+            seconds['full_inference'] += elapsed
+
+    small_probs, full_probs = np.concatenate(small_probs), np.concatenate(full_probs)
+    labels = np.asarray(labels)
+    threshold, escalation_rate, cascade_accuracy = choose_threshold(small_probs, full_probs, labels)
+
+    ms = {k: v * 1000 / len(paths) for k, v in seconds.items()}
+    full_ms = ms['full_decode'] + ms['full_inference']
+    cascade_ms = ms['small_decode'] + ms['small_inference'] + escalation_rate * full_ms
+    report = {
+        'threshold': threshold,
+        'alpha': config.CASCADE_ALPHA,
+        'small_img_size': small_size,
+        'full_img_size': full_size,
+        'val_images': len(paths),
+        'full_accuracy': float((full_probs.argmax(axis=1) == labels).mean()),
+        'small_accuracy': float((small_probs.argmax(axis=1) == labels).mean()),
+        'cascade_accuracy': cascade_accuracy,
+        'max_accuracy_drop': config.CASCADE_MAX_ACCURACY_DROP,
+        'escalation_rate': escalation_rate,
+        'ms_per_image': {**ms, 'full_only': full_ms, 'cascade': cascade_ms},
+        'latency_saving': 1 - cascade_ms / full_ms if full_ms else 0.0,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"✅ Threshold {threshold:.3f}: {escalation_rate:.1%} escalated, "
+          f"accuracy {report['cascade_accuracy']:.4f} vs full {report['full_accuracy']:.4f}, "
+          f"{full_ms:.1f} → {cascade_ms:.1f} ms/image ({report['latency_saving']:.0%} saved)")
+    return report
+
+def train_small_model(class_indices):
+    """Train the reduced-width, reduced-resolution MobileNetV2 used as the first cascade stage"""
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
+    from tensorflow.keras.metrics import TopKCategoricalAccuracy
+    from tensorflow.keras.optimizers import Adam
+    from data_pipeline import create_datasets
+    from train_model import configure_precision, create_model, to_float32
+
+    configure_precision()
+    size = config.CASCADE_IMG_SIZE
+    train_ds, val_ds, _ = create_datasets(img_size=size)
+    if config.INPUT_PIPELINE in ('shards', 'image_cache'):
+        # Shards and the image cache hold IMG_SIZE pixels; shrink them on the fly
+        resize = lambda x, y: (tf.image.resize(x, (size, size)), y)
+        train_ds, val_ds = train_ds.map(resize), val_ds.map(resize)
+
+    print(f"\n🐣 Training cascade model: MobileNetV2 alpha={config.CASCADE_ALPHA} at {size}px")
+    model, base_model = create_model(len(class_indices), alpha=config.CASCADE_ALPHA, img_size=size)
+    callbacks = [
+        EarlyStopping(monitor='val_accuracy', patience=config.EARLY_STOPPING_PATIENCE, restore_best_weights=True),
+        ModelCheckpoint(config.CASCADE_MODEL_PATH, monitor='val_accuracy', save_best_only=True),
+    ]
+
+    for learning_rate, epochs in ((config.LEARNING_RATE, config.CASCADE_EPOCHS),
+                                  (config.FINE_TUNE_LR, config.CASCADE_FINE_TUNE_EPOCHS)):
+        model.compile(
+            optimizer=Adam(learning_rate=learning_rate),
+            loss='categorical_crossentropy',
+            metrics=['accuracy', TopKCategoricalAccuracy(k=3)],
+            jit_compile=config.JIT_COMPILE
+        )
+        model.fit(train_ds, epochs=epochs, validation_data=val_ds, callbacks=callbacks)
+
+        # Second round fine-tunes the top of the backbone
+        base_model.trainable = True
+        for layer in base_model.layers[:-config.FINE_TUNE_LAYERS]:
+            layer.trainable = False
+
+    model = tf.keras.models.load_model(config.CASCADE_MODEL_PATH)
+    if config.PRECISION_POLICY != 'float32':
+        model = to_float32(model, len(class_indices), config.CASCADE_ALPHA, size)
+        model.save(config.CASCADE_MODEL_PATH)
+    return model
+
+def train_cascade(class_indices, full_model):
+    """Train and export the small model, then calibrate its threshold against full_model"""
+    from data_pipeline import list_split_files
+    from quantization import convert_dynamic
+
+    small_model = train_small_model(class_indices)
+    try:
+        with open(config.CASCADE_TFLITE_MODEL_PATH, 'wb') as f:
+            f.write(convert_dynamic(small_model))
+        print(f"✅ Cascade TFLite model saved: {config.CASCADE_TFLITE_MODEL_PATH}")
+    except Exception as e:
+        print(f"⚠️  Cascade TFLite conversion failed: {e}")
+
+    paths, labels = list_split_files('val', sorted(class_indices, key=class_indices.get))
+    return calibrate(small_model.predict_on_batch, full_model.predict_on_batch, paths, labels)
+
+def load_threshold(report_path=None):
+    """config.CASCADE_THRESHOLD, else the calibrated one from the cascade report"""
+    if config.CASCADE_THRESHOLD is not None:
+        return config.CASCADE_THRESHOLD
+    report_path = report_path or config.CASCADE_REPORT_PATH
+    if not os.path.exists(report_path):
+        raise FileNotFoundError(f"No cascade calibration at {report_path}; run: python cascade.py calibrate")
+    with open(report_path, 'r') as f:
+        return json.load(f)['threshold']
+
+class Cascade:
+    """Small model first; rows below the confidence threshold go to the full model
+
+    run() takes a batch already decoded at the small model's input size
+    plus the source of each row. Escalated rows are decoded again at the
+    full size, so confident images never pay the full-resolution decode.
+    """
+
+    def __init__(self, small, full, threshold, full_size=None, executor=None):
+        self.small = small
+        self.full = full
+        self.threshold = threshold
+        self.full_size = full_size or config.IMG_SIZE
+        self.executor = executor
+        self._lock = threading.Lock()
+        self.images = 0
+        self.escalated = 0
+        self.seconds = 0.0
+        self.full_seconds = 0.0
+
+    def run(self, batch, sources):
+        """Class probabilities per row; sources[i] is None for rows that must not escalate"""
+        start = time.perf_counter()
+        probs = np.array(self.small.predict(batch))
+        observe_stage('cascade', 'small_inference', time.perf_counter() - start)
+
+        escalate = [i for i in np.flatnonzero(probs.max(axis=1) < self.threshold) if sources[i] is not None]
+        full_seconds = 0.0
+        if escalate:
+            full_start = time.perf_counter()
+            x = new_batch_buffer(len(escalate), self.full_size)
+            load_batch([sources[i] for i in escalate], self.full_size, x, self.executor)
+            probs[escalate] = self.full.predict(x)
+            full_seconds = time.perf_counter() - full_start
+            observe_stage('cascade', 'escalation', full_seconds)
+
+        CASCADE_IMAGES.inc(len(batch) - len(escalate), result='small')
+        CASCADE_IMAGES.inc(len(escalate), result='escalated')
+        with self._lock:
+            self.images += len(batch)
+            self.escalated += len(escalate)
+            self.seconds += time.perf_counter() - start
+            self.full_seconds += full_seconds
+        return probs
+
+    def stats(self, report_path=None):
+        """Escalation rate and time per image, vs the calibrated full-model-only decode + inference"""
+        report_path = report_path or config.CASCADE_REPORT_PATH
+        with self._lock:
+            stats = {
+                'threshold': self.threshold,
+                'images': self.images,
+                'escalated': self.escalated,
+                'escalation_rate': self.escalated / self.images if self.images else 0.0,
+                'ms_per_image': self.seconds * 1000 / self.images if self.images else None,
+            }
+        if os.path.exists(report_path) and stats['ms_per_image'] is not None:
+            # The small-size decode happens before run(); take it from calibration
+            with open(report_path, 'r') as f:
+                ms = json.load(f)['ms_per_image']
+            stats['end_to_end_ms_per_image'] = stats['ms_per_image'] + ms['small_decode']
+            stats['full_only_ms_per_image'] = ms['full_only']
+            stats['latency_saving'] = 1 - stats['end_to_end_ms_per_image'] / ms['full_only']
+        return stats
+
+if __name__ == "__main__":
+    import argparse
+    import tensorflow as tf
+    from data_pipeline import get_class_names, list_split_files
+
+    parser = argparse.ArgumentParser(description="Train and calibrate the small first-stage cascade model")
+    parser.add_argument('command', choices=['train', 'calibrate'],
+                        help="'train' trains, exports and calibrates; 'calibrate' re-picks the threshold only")
+    args = parser.parse_args()
+
+    path = config.BEST_MODEL_PATH if os.path.exists(config.BEST_MODEL_PATH) else config.MODEL_PATH
+    full_model = tf.keras.models.load_model(path)
+    class_names = get_class_names()
+    if args.command == 'train':
+        train_cascade({name: i for i, name in enumerate(class_names)}, full_model)
+    else:
+        small_model = tf.keras.models.load_model(config.CASCADE_MODEL_PATH)
+        paths, labels = list_split_files('val', class_names)
+        calibrate(small_model.predict_on_batch, full_model.predict_on_batch, paths, labels)
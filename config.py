@@ -3,6 +3,7 @@ import os
 # Dataset Configuration
 RAW_DATASET_DIR = "Dataset/raw"  # Put your dataset here
 PROCESSED_DATASET_DIR = "Dataset/processed"
+MANIFEST_PATH = f"{PROCESSED_DATASET_DIR}/manifest.csv"  # path, size, mtime, hash, split per raw image
 
 # Model Configuration
 IMG_SIZE = 224
@@ -12,11 +13,35 @@ FINE_TUNE_EPOCHS = 25
 LEARNING_RATE = 0.001
 FINE_TUNE_LR = 0.0001
 
+# Input Pipeline
+INPUT_PIPELINE = 'tf_data'  # 'tf_data' (parallel decode/augment), 'shards' (packed TFRecords), 'image_cache' (mmap) or 'generator' (legacy)
+TF_DATA_CACHE = 'memory'  # 'memory', a file prefix for an on-disk cache, or '' to disable
+SHUFFLE_BUFFER = 2000  # Decoded images held for shuffling
+SHARD_DIR = "Dataset/shards"  # Pre-resized TFRecord shards written by split_dataset.py --shards
+SHARD_MAX_IMAGES = 1024  # Images per shard (~150 MB at 224px)
+SHARD_READ_PARALLELISM = 4  # Shards read concurrently
+IMAGE_CACHE_DIR = "cache/images"  # Per-split uint8 images pre-resized to IMG_SIZE, read as memory-map slices
+AUGMENTATION = {
+    'rotation_range': 20,
+    'width_shift_range': 0.1,
+    'height_shift_range': 0.1,
+    'shear_range': 0.1,
+    'zoom_range': 0.1,
+    'horizontal_flip': True,
+    'brightness_range': [0.9, 1.1],
+}
+
 # Data Split Configuration
 TRAIN_SPLIT = 0.7
 VAL_SPLIT = 0.15
 TEST_SPLIT = 0.15
 RANDOM_SEED = 42
+SPLIT_WORKERS = os.cpu_count()  # Processes used to validate/hash raw images
+MATERIALIZE_MODE = 'hardlink'  # 'hardlink', 'symlink', 'copy' or 'none' (train straight from the manifest)
+DEDUP_BEFORE_SPLIT = False  # Keep near-identical images (by embedding similarity) in the same split
+DEDUP_THRESHOLD = 0.95  # Cosine similarity at or above which two images count as duplicates
+DEDUP_NEIGHBOURS = 10  # Nearest neighbours compared per image when grouping
+DEDUP_INDEX_DIR = "cache/embeddings/raw"  # Embeddings of raw images, reused across split runs
 
 # Model Architecture
 BASE_MODEL = 'MobileNetV2'
@@ -28,12 +53,125 @@ FINE_TUNE_LAYERS = 50
 EARLY_STOPPING_PATIENCE = 10
 LR_REDUCTION_PATIENCE = 5
 LR_REDUCTION_FACTOR = 0.2
+USE_FEATURE_CACHE = False  # Phase 1 trains the head on cached backbone features
+FEATURE_CACHE_DIR = "cache/features"
+FEATURE_CACHE_VIEWS = 1  # 1 = original images only; >1 adds augmented views per train image
+FEATURE_CACHE_DTYPE = 'float16'
+PRECISION_POLICY = 'float32'  # 'float32', 'mixed_bfloat16' (CPUs with AVX512-BF16/AMX) or 'mixed_float16' (GPU)
+JIT_COMPILE = False  # XLA-compile the training step
+PRECISION_MAX_ACCURACY_DROP = 0.01  # Val accuracy a faster mode may lose vs float32 and still be adopted
+RESUME_TRAINING = True  # Continue an interrupted run from CHECKPOINT_DIR (same data/architecture only)
+CHECKPOINT_EVERY_EPOCHS = 1  # Full training-state checkpoint interval
+CHECKPOINT_KEEP = 2  # Checkpoints kept per phase
+EXPORT_MODELS = True  # SavedModel and TFLite exports after training (sweep trials skip them)
+
+# Distributed Training
+DISTRIBUTED = False  # MultiWorkerMirroredStrategy over the workers in TF_CONFIG (train_model.py --local-workers N to test)
+SCALE_LR_WITH_REPLICAS = False  # Multiply learning rates by the replica count (BATCH_SIZE is per replica)
+
+# Hyperparameter Sweep
+SWEEP_SPACE = {  # Values tried per config constant (python sweep.py run --param NAME=a,b replaces an entry)
+    'LEARNING_RATE': [0.001, 0.0003],
+    'FINE_TUNE_LR': [0.0001, 0.00003],
+    'DENSE_UNITS': [128, 256],
+    'DROPOUT_RATE': [0.3, 0.5],
+}
+SWEEP_SAMPLES = 0  # Random combinations from the grid (0 = every combination)
+SWEEP_PARALLEL_TRIALS = 2  # Trial processes running at once
+SWEEP_THREADS_PER_TRIAL = None  # CPU threads per trial (None = cores // SWEEP_PARALLEL_TRIALS)
+SWEEP_METRIC = 'val_accuracy'  # Per-epoch metric trials are ranked and pruned by (names with 'loss': lower is better)
+SWEEP_MIN_EPOCHS = 2  # First pruning rung; later rungs at MIN * FACTOR^k epochs
+SWEEP_REDUCTION_FACTOR = 3  # Successive halving keeps the top 1/FACTOR of trials at each rung
+SWEEP_INPUT_PIPELINE = 'image_cache'  # Trials read one shared pre-resized dataset instead of each decoding JPEGs
+SWEEP_DB_PATH = "cache/sweeps.sqlite3"  # Sweeps, trials and per-epoch metrics
+
+# Embeddings
+EMBEDDING_DTYPE = 'int8'  # On-disk vectors: 'int8' (per-row scale, 4x smaller than float32) or 'float16'
+EMBEDDING_INDEX_DIR = "cache/embeddings/train"  # Reference images searched by /similar (python embeddings.py build)
+EMBEDDING_SEARCH_CHUNK = 65536  # Index rows scored per matmul
+SIMILAR_TOP_K = 5  # Default matches returned by /similar
+
+# Cascade Inference
+CASCADE_ENABLED = False  # predict.py: small model first, full model only for images below the threshold
+TRAIN_CASCADE_MODEL = False  # train_model.py also trains the small model and calibrates the threshold
+CASCADE_ALPHA = 0.35  # MobileNetV2 width multiplier of the small model
+CASCADE_IMG_SIZE = 128  # Input resolution of the small model
+CASCADE_EPOCHS = 15  # Head training epochs for the small model
+CASCADE_FINE_TUNE_EPOCHS = 10
+CASCADE_MAX_ACCURACY_DROP = 0.005  # Calibration keeps cascade val top-1 within this of the full model
+CASCADE_THRESHOLD = None  # Fixed top-1 confidence threshold instead of the calibrated one
+
+# Knowledge Distillation
+DISTILL_STUDENT = False  # train_model.py also distills a smaller student from the finished model (--distill: only that)
+DISTILL_ALPHA = 0.5  # MobileNetV2 width multiplier of the student (ImageNet weights: 0.35, 0.5, 0.75, 1.0, 1.3, 1.4)
+DISTILL_IMG_SIZE = 160  # Student input resolution (96, 128, 160, 192 or 224)
+DISTILL_DENSE_UNITS = 128  # Student head width
+DISTILL_TEMPERATURE = 4.0  # Softens teacher and student outputs in the soft loss
+DISTILL_SOFT_WEIGHT = 0.7  # Share of the loss from matching the teacher; the rest is cross-entropy on labels
+DISTILL_EPOCHS = 20  # Head training epochs for the student
+DISTILL_FINE_TUNE_EPOCHS = 15
+DISTILL_TEACHER_CACHE = True  # Compute teacher logits once per image instead of running the teacher every step
+DISTILL_TEACHER_CACHE_DIR = "cache/teacher_logits"
+
+# Quantization
+TFLITE_QUANTIZATION = 'dynamic'  # 'dynamic' (weights only) or 'int8' (also build a gated full-integer model)
+QUANT_REPRESENTATIVE_SAMPLES = 300  # Val images used to calibrate int8 activations
+QUANT_MAX_TOP1_DROP = 0.01  # Max absolute top-1 accuracy loss vs the float model
+QUANT_MAX_TOP3_DROP = 0.005  # Max absolute top-3 accuracy loss vs the float model
+
+# Serving Configuration
+BATCH_MAX_SIZE = 32  # Max images coalesced into one forward pass
+BATCH_MAX_WAIT_MS = 10  # Max time the first queued image waits for a batch to fill
+STARTUP_MODE = 'background'  # 'background' (serve /healthz at once, /readyz when warm) or 'eager' (load before serving)
+WARMUP_BATCH_SIZES = [1, BATCH_MAX_SIZE]  # Batch shapes traced/allocated before reporting ready
+WARMUP_ROUNDS = 2
+
+INFERENCE_BACKEND = 'keras'  # 'keras' (h5), 'savedmodel' or 'tflite'
+TFLITE_NUM_THREADS = os.cpu_count()  # Threads per TFLite interpreter
+PREDICT_WORKERS = os.cpu_count()  # Decode threads for batch/directory prediction
+PREDICTION_CACHE_SIZE = 2048  # In-process LRU entries (0 disables caching)
+PREDICTION_CACHE_TTL = 24 * 3600  # Seconds before a cached prediction expires (0 = never)
+PREDICTION_CACHE_BACKEND = None  # None, 'sqlite' or 'file' to share hits between worker processes
+PREDICTION_CACHE_PATH = "cache/predictions.sqlite3"  # sqlite file, or directory for the 'file' backend
+PREDICTION_CACHE_SHARED_SIZE = 100000  # Max entries kept in the shared backend
+
+JOB_WORKERS = 4  # Decode threads per process feeding /jobs images to the batcher
+JOB_MAX_IMAGES = 1000  # Images accepted in one /jobs upload
+JOB_MAX_IMAGE_BYTES = 32 * 1024 * 1024  # Largest single image, also after unpacking from a zip
+JOB_MAX_PENDING_IMAGES = 2000  # Images waiting per process before /jobs answers 429
+JOB_RETRY_AFTER = 5  # Seconds suggested to clients in the 429 Retry-After header
+JOB_EVENTS_POLL_S = 0.25  # How often /jobs/<id>/events checks for new results
+JOB_TTL = 24 * 3600  # Seconds job results are kept
+JOB_DB_PATH = "cache/jobs.sqlite3"  # Shared job store, readable by every worker process
+
+MODEL_REGISTRY_DIR = "models/registry"  # Versioned models + routing.json; while empty, the paths above are served
+MODEL_REGISTRY_POLL_S = 5  # How often servers check the registry for a new version or routing change
+MODEL_RETIRE_GRACE_S = 30  # Seconds a swapped-out version keeps draining before it is stopped
+PUBLISH_TO_REGISTRY = False  # train_model.py publishes each finished model as a new registry version
+
+SERVE_HOST = "0.0.0.0"  # serve.py: multi-process server
+SERVE_PORT = 8000
+SERVE_WORKERS = 0  # Worker processes sharing the port (0 = half the cores)
+SERVE_THREADS_PER_WORKER = None  # Inference threads per worker (None = cores // workers)
+SERVE_BACKEND = 'tflite'  # Backend for serve.py workers without a registry (None = INFERENCE_BACKEND); TFLite files are mapped read-only and shared
 
 # File Paths
 MODEL_DIR = "models"
 MODEL_PATH = f"{MODEL_DIR}/cattle_breed_model.h5"
 BEST_MODEL_PATH = f"{MODEL_DIR}/best_cattle_breed_model.h5"
 TFLITE_MODEL_PATH = f"{MODEL_DIR}/cattle_breed_model.tflite"
+SAVED_MODEL_DIR = f"{MODEL_DIR}/saved_model"
+INT8_TFLITE_MODEL_PATH = f"{MODEL_DIR}/cattle_breed_model_int8.tflite"
+QUANTIZATION_REPORT_PATH = f"{MODEL_DIR}/quantization_report.json"
+TRAINING_REPORT_PATH = f"{MODEL_DIR}/training_report.json"  # Step time and accuracy per precision/XLA mode
+CHECKPOINT_DIR = f"{MODEL_DIR}/checkpoints"  # Model + optimizer + phase/epoch state of the current run
+CASCADE_MODEL_PATH = f"{MODEL_DIR}/cascade_small_model.h5"
+CASCADE_TFLITE_MODEL_PATH = f"{MODEL_DIR}/cascade_small_model.tflite"
+CASCADE_REPORT_PATH = f"{MODEL_DIR}/cascade_report.json"  # Calibrated threshold, escalation rate, ms/image
+STUDENT_MODEL_PATH = f"{MODEL_DIR}/student_model.h5"
+STUDENT_TFLITE_MODEL_PATH = f"{MODEL_DIR}/student_model.tflite"
+DISTILL_REPORT_PATH = f"{MODEL_DIR}/distillation_report.json"  # Teacher vs student accuracy and latency
+SWEEP_DIR = f"{MODEL_DIR}/sweeps"  # One directory of models, checkpoints and reports per sweep trial
 CLASS_INDICES_PATH = f"{MODEL_DIR}/class_indices.json"
 LABELS_PATH = f"{MODEL_DIR}/labels.txt"
 
@@ -0,0 +1,331 @@
+import json
+import math
+import os
+import time
+import numpy as np
+import tensorflow as tf
+import config
+from split_dataset import IMAGE_EXTENSIONS, load_manifest
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+def get_class_names():
+    """Breed names in label-index order (alphabetical, like flow_from_directory)"""
+    if config.MATERIALIZE_MODE == 'none':
+        return sorted({r['breed'] for r in load_manifest() if r['valid']})
+    train_dir = os.path.join(config.PROCESSED_DATASET_DIR, 'train')
+    return sorted(d for d in os.listdir(train_dir) if os.path.isdir(os.path.join(train_dir, d)))
+
+def list_split_files(split, class_names=None):
+    """Image paths and integer labels for one split"""
+    class_names = class_names or get_class_names()
+    class_indices = {name: i for i, name in enumerate(class_names)}
+
+    if config.MATERIALIZE_MODE == 'none':
+        rows = [r for r in load_manifest(split) if r['breed'] in class_indices]
+        return [r['path'] for r in rows], [class_indices[r['breed']] for r in rows]
+
+    paths, labels = [], []
+    split_dir = os.path.join(config.PROCESSED_DATASET_DIR, split)
+    for breed in class_names:
+        breed_dir = os.path.join(split_dir, breed)
+        if not os.path.isdir(breed_dir):
+            continue
+        for file in sorted(os.listdir(breed_dir)):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(breed_dir, file))
+                labels.append(class_indices[breed])
+    return paths, labels
+
+def decode_and_resize(path, img_size=None):
+    """Read one file into a (img_size, img_size, 3) uint8 tensor"""
+    img_size = img_size or config.IMG_SIZE
+    data = tf.io.read_file(path)
+    img = tf.io.decode_image(data, channels=3, expand_animations=False)
+    img = tf.image.resize(img, (img_size, img_size))
+    return tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8)
+
+def augment_batch(images):
+    """Random affine + flip + brightness over a whole (B, H, W, 3) float batch
+
+    Mirrors config.AUGMENTATION (the ImageDataGenerator settings): one
+    projective transform per image combining rotation, shear, zoom and
+    shift, applied in a single vectorized op with nearest fill.
+    """
+    aug = config.AUGMENTATION
+    shape = tf.shape(images)
+    batch, height, width = shape[0], shape[1], shape[2]
+    h = tf.cast(height, tf.float32)
+    w = tf.cast(width, tf.float32)
+
+    def uniform(limit, center=0.0):
+        return tf.random.uniform([batch], center - limit, center + limit)
+
+    theta = uniform(math.radians(aug['rotation_range']))
+    shear = uniform(math.radians(aug['shear_range']))
+    zx = uniform(aug['zoom_range'], 1.0)
+    zy = uniform(aug['zoom_range'], 1.0)
+    tx = uniform(aug['width_shift_range']) * w
+    ty = uniform(aug['height_shift_range']) * h
+
+    # Maps output pixel (x, y) back to input: R(theta) . Shear . Zoom about the centre, then shift
+    cos_t, sin_t = tf.cos(theta), tf.sin(theta)
+    m00 = cos_t * zx
+    m01 = (-sin_t * tf.cos(shear) - cos_t * tf.sin(shear)) * zy
+    m10 = sin_t * zx
+    m11 = (cos_t * tf.cos(shear) - sin_t * tf.sin(shear)) * zy
+    cx, cy = (w - 1) / 2, (h - 1) / 2
+    a2 = cx - m00 * cx - m01 * cy + tx
+    b2 = cy - m10 * cx - m11 * cy + ty
+    zeros = tf.zeros_like(theta)
+    transforms = tf.stack([m00, m01, a2, m10, m11, b2, zeros, zeros], axis=1)
+
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=tf.stack([height, width]),
+        fill_value=0.0,
+        interpolation='BILINEAR',
+        fill_mode='NEAREST'
+    )
+
+    if aug['horizontal_flip']:
+        flip = tf.random.uniform([batch]) < 0.5
+        images = tf.where(flip[:, None, None, None], tf.reverse(images, axis=[2]), images)
+
+    low, high = aug['brightness_range']
+    brightness = tf.random.uniform([batch], low, high)
+    images = tf.clip_by_value(images * brightness[:, None, None, None], 0.0, 1.0)
+    return images
+
+def build_dataset(paths, labels, num_classes, training, batch_size=None, img_size=None, cache=None, shard=None):
+    """Parallel decode → cache → shuffle → batch → augment → prefetch
+
+    shard=(num_shards, index) keeps every num_shards-th file before decoding,
+    so each distributed worker only reads its own part of the split.
+    """
+    img_size = img_size or config.IMG_SIZE
+
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    size = len(paths)
+    if shard:
+        ds = ds.shard(*shard)
+        size = len(paths[shard[1]::shard[0]])
+    ds = ds.map(lambda p, y: (decode_and_resize(p, img_size), y), num_parallel_calls=AUTOTUNE)
+    return finish_dataset(ds, num_classes, training, batch_size, cache, size)
+
+def read_shard_index(split):
+    index_path = os.path.join(config.SHARD_DIR, split, 'index.json')
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"No shards for '{split}'. Run split_dataset.py --shards first!")
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+def build_shard_dataset(split, training, batch_size=None, cache=None, index=None, shard=None):
+    """Stream pre-resized images from TFRecord shards with interleaved parallel reads"""
+    index = index or read_shard_index(split)
+    img_size = index['img_size']
+    if img_size != config.IMG_SIZE:
+        raise ValueError(f"{split} shards are {img_size}px but IMG_SIZE is {config.IMG_SIZE}; "
+                         f"re-run split_dataset.py --shards")
+
+    files = [os.path.join(config.SHARD_DIR, split, s['file']) for s in index['shards']]
+    # Distributed workers split whole files when there are enough, otherwise records
+    shard_files = bool(shard) and len(files) >= shard[0]
+    shard_records = bool(shard) and not shard_files
+    if shard_files:
+        files = files[shard[1]::shard[0]]
+    ds = tf.data.Dataset.from_tensor_slices(files)
+    if training:
+        ds = ds.shuffle(len(files), seed=config.RANDOM_SEED, reshuffle_each_iteration=True)
+
+    # Large sequential reads from several shards at once; order only matters for eval and
+    # for record-level sharding, where every worker must see the same record order
+    ds = ds.interleave(
+        lambda f: tf.data.TFRecordDataset(f, buffer_size=8 << 20),
+        cycle_length=min(len(files), config.SHARD_READ_PARALLELISM) or 1,
+        num_parallel_calls=AUTOTUNE,
+        deterministic=not training or shard_records
+    )
+
+    features = {
+        'image': tf.io.FixedLenFeature([], tf.string),
+        'label': tf.io.FixedLenFeature([], tf.int64),
+    }
+
+    def parse(record):
+        example = tf.io.parse_single_example(record, features)
+        image = tf.reshape(tf.io.decode_raw(example['image'], tf.uint8), (img_size, img_size, 3))
+        return image, tf.cast(example['label'], tf.int32)
+
+    if shard_records:
+        ds = ds.shard(*shard)
+    ds = ds.map(parse, num_parallel_calls=AUTOTUNE)
+    cache = '' if cache is None else cache  # Shards are already cheap to re-read
+    return finish_dataset(ds, len(index['class_names']), training, batch_size, cache, index['total'])
+
+def finish_dataset(ds, num_classes, training, batch_size=None, cache=None, size=None):
+    """Shared tail for (uint8 image, int label) datasets"""
+    batch_size = batch_size or config.BATCH_SIZE
+    cache = config.TF_DATA_CACHE if cache is None else cache
+
+    # Cache decoded uint8 images ('memory', a file prefix, or '' to disable)
+    if cache == 'memory':
+        ds = ds.cache()
+    elif cache:
+        ds = ds.cache(cache)
+
+    if training:
+        ds = ds.shuffle(min(size or config.SHUFFLE_BUFFER, config.SHUFFLE_BUFFER), seed=config.RANDOM_SEED,
+                        reshuffle_each_iteration=True)
+
+    ds = ds.batch(batch_size, num_parallel_calls=AUTOTUNE)
+    return to_model_inputs(ds, num_classes, training)
+
+def to_model_inputs(ds, num_classes, training):
+    """(uint8 batch, int labels) → float [0, 1] images (augmented when training), one-hot labels"""
+    def to_float(x, y):
+        return tf.cast(x, tf.float32) / 255.0, tf.one_hot(y, num_classes)
+
+    ds = ds.map(to_float, num_parallel_calls=AUTOTUNE)
+    if training:
+        ds = ds.map(lambda x, y: (augment_batch(x), y), num_parallel_calls=AUTOTUNE)
+
+    return ds.prefetch(AUTOTUNE)
+
+def build_image_cache_dataset(split, training, batch_size=None, class_names=None, shard=None):
+    """Batches sliced from the split's memory-mapped image cache instead of decoded from JPEGs
+
+    Only row numbers go through shuffle, so training gets a full shuffle of
+    the split at no memory cost; each batch is one gather from the mmap.
+    """
+    from image_cache import load_split_cache
+
+    batch_size = batch_size or config.BATCH_SIZE
+    class_names = class_names or get_class_names()
+    cache, rows, labels = load_split_cache(split, class_names)
+    if shard:
+        rows, labels = rows[shard[1]::shard[0]], labels[shard[1]::shard[0]]
+    images = cache.images()
+    img_size = cache.img_size
+
+    ds = tf.data.Dataset.from_tensor_slices((rows, labels))
+    if training:
+        ds = ds.shuffle(len(rows), seed=config.RANDOM_SEED, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+
+    def gather(batch_rows, y):
+        x = tf.numpy_function(lambda r: images[r], [batch_rows], tf.uint8)
+        return tf.ensure_shape(x, (None, img_size, img_size, 3)), y
+
+    ds = ds.map(gather, num_parallel_calls=AUTOTUNE)
+    return to_model_inputs(ds, len(class_names), training)
+
+def create_datasets(img_size=None):
+    """Create tf.data train/val datasets and class indices"""
+    print("🔄 Creating tf.data pipelines...")
+
+    if config.INPUT_PIPELINE == 'shards':
+        train_index, val_index = read_shard_index('train'), read_shard_index('val')
+        class_names = train_index['class_names']
+        print(f"📦 Reading shards from {config.SHARD_DIR}")
+        print(f"📊 Train: {train_index['total']}, Val: {val_index['total']}")
+        return (build_shard_dataset('train', True, index=train_index),
+                build_shard_dataset('val', False, index=val_index),
+                {name: i for i, name in enumerate(class_names)})
+
+    class_names = get_class_names()
+    class_indices = {name: i for i, name in enumerate(class_names)}
+
+    train_paths, train_labels = list_split_files('train', class_names)
+    val_paths, val_labels = list_split_files('val', class_names)
+
+    if config.INPUT_PIPELINE == 'image_cache':
+        print(f"🗃️  Reading pre-resized images from {config.IMAGE_CACHE_DIR}")
+        train_ds = build_image_cache_dataset('train', True, class_names=class_names)
+        val_ds = build_image_cache_dataset('val', False, class_names=class_names)
+        print(f"✅ Classes: {len(class_names)}")
+        print(f"📊 Train: {len(train_paths)}, Val: {len(val_paths)}")
+        return train_ds, val_ds, class_indices
+
+    cache = config.TF_DATA_CACHE
+    train_ds = build_dataset(train_paths, train_labels, len(class_names), training=True, img_size=img_size,
+                             cache=cache if cache in ('', 'memory') else f"{cache}_train")
+    val_ds = build_dataset(val_paths, val_labels, len(class_names), training=False, img_size=img_size,
+                           cache=cache if cache in ('', 'memory') else f"{cache}_val")
+
+    print(f"✅ Classes: {len(class_names)}")
+    print(f"📊 Train: {len(train_paths)}, Val: {len(val_paths)}")
+
+    return train_ds, val_ds, class_indices
+
+def split_size(split, class_names=None):
+    """Number of images in a split"""
+    if config.INPUT_PIPELINE == 'shards':
+        return read_shard_index(split)['total']
+    return len(list_split_files(split, class_names)[0])
+
+def dataset_class_names():
+    """Class names of the configured input pipeline (the shard index or the processed tree)"""
+    if config.INPUT_PIPELINE == 'shards':
+        return read_shard_index('train')['class_names']
+    return get_class_names()
+
+def create_split_dataset(split, training, batch_size=None, shard=None, class_names=None):
+    """One split as a tf.data dataset, optionally only one worker's shard of it"""
+    if config.INPUT_PIPELINE == 'shards':
+        return build_shard_dataset(split, training, batch_size, shard=shard)
+    if config.INPUT_PIPELINE == 'image_cache':
+        return build_image_cache_dataset(split, training, batch_size, class_names, shard)
+
+    class_names = class_names or get_class_names()
+    paths, labels = list_split_files(split, class_names)
+    cache = config.TF_DATA_CACHE
+    if cache not in ('', 'memory'):
+        cache = f"{cache}_{split}" + (f"_{shard[1]}" if shard else '')
+    return build_dataset(paths, labels, len(class_names), training, batch_size, cache=cache, shard=shard)
+
+def create_eval_dataset(split='test', class_names=None):
+    """Unshuffled, unaugmented dataset for one split plus its class names"""
+    if config.INPUT_PIPELINE == 'shards':
+        index = read_shard_index(split)
+        return build_shard_dataset(split, False, index=index), index['class_names']
+
+    class_names = class_names or get_class_names()
+    if config.INPUT_PIPELINE == 'image_cache':
+        return build_image_cache_dataset(split, False, class_names=class_names), class_names
+    paths, labels = list_split_files(split, class_names)
+    return build_dataset(paths, labels, len(class_names), training=False, cache=''), class_names
+
+def measure_throughput(dataset, num_batches=50):
+    """Images/sec when iterating a dataset or Keras generator"""
+    iterator = iter(dataset)
+    next(iterator)  # Exclude start-up (thread pools, first file open)
+
+    images = 0
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        try:
+            x, _ = next(iterator)
+        except StopIteration:
+            break
+        images += int(np.shape(x)[0])
+    elapsed = time.perf_counter() - start
+    return images / elapsed if elapsed > 0 else 0.0
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare ImageDataGenerator and tf.data input throughput")
+    parser.add_argument('--batches', type=int, default=50)
+    args = parser.parse_args()
+
+    from train_model import create_data_generators
+
+    train_gen, _ = create_data_generators()
+    train_ds, _, _ = create_datasets()
+
+    gen_rate = measure_throughput(train_gen, args.batches)
+    print(f"🐢 ImageDataGenerator: {gen_rate:.1f} images/sec")
+    tfdata_rate = measure_throughput(train_ds, args.batches)
+    print(f"🚀 tf.data: {tfdata_rate:.1f} images/sec ({tfdata_rate / max(gen_rate, 1e-9):.1f}x)")
@@ -0,0 +1,277 @@
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+import config
+from data_pipeline import AUTOTUNE, augment_batch, build_dataset, decode_and_resize, list_split_files
+from evaluate_model import evaluate_stream, iter_labelled_batches
+from feature_cache import FeatureStore, extract_features, image_hashes
+
+def teacher_logits_model(teacher):
+    """The teacher with its final softmax removed, so soft targets can be taken at any temperature
+
+    The logits are rebuilt from the 'predictions' layer, or from the last
+    Dense layer for models whose classifier is named differently.
+    """
+    try:
+        predictions = teacher.get_layer('predictions')
+    except ValueError:
+        dense_layers = [layer for layer in teacher.layers if isinstance(layer, tf.keras.layers.Dense)]
+        if not dense_layers:
+            raise ValueError(f"Teacher '{teacher.name}' has no Dense classifier to take logits from")
+        predictions = dense_layers[-1]
+    logits = tf.keras.layers.Dense(predictions.units, dtype='float32', name='teacher_logits')(predictions.input)
+    model = tf.keras.Model(teacher.input, logits, name='teacher')
+    model.get_layer('teacher_logits').set_weights(predictions.get_weights())
+    model.trainable = False
+    return model
+
+def create_student(num_classes, weights='imagenet'):
+    """Narrower, lower-resolution MobileNetV2 with a smaller head; returns (model, logits model, base)
+
+    Both models share every layer: the logits model is trained, the softmax
+    model is what gets saved and served.
+    """
+    from train_model import build_head
+
+    size = config.DISTILL_IMG_SIZE
+    base_model = tf.keras.applications.MobileNetV2(weights=weights, include_top=False, input_shape=(size, size, 3),
+                                                   alpha=config.DISTILL_ALPHA)
+    base_model.trainable = False
+    x = tf.keras.layers.GlobalAveragePooling2D()(base_model.output)
+    logits = build_head(x, num_classes, dense_units=config.DISTILL_DENSE_UNITS, activation=None)
+    probabilities = tf.keras.layers.Activation('softmax', dtype='float32', name='probabilities')(logits)
+    return (tf.keras.Model(base_model.input, probabilities), tf.keras.Model(base_model.input, logits),
+            base_model)
+
+def distillation_loss(num_classes, temperature=None, soft_weight=None):
+    """Cross-entropy on the labels blended with KL to the teacher's softened distribution
+
+    y_pred is [student logits | teacher logits]. The soft term is scaled by
+    T^2 so its gradients keep the same magnitude as the temperature changes.
+    """
+    temperature = temperature or config.DISTILL_TEMPERATURE
+    soft_weight = config.DISTILL_SOFT_WEIGHT if soft_weight is None else soft_weight
+
+    def loss(y_true, y_pred):
+        student, teacher = y_pred[:, :num_classes], y_pred[:, num_classes:]
+        hard = tf.keras.losses.categorical_crossentropy(y_true, student, from_logits=True)
+        soft_targets = tf.nn.softmax(teacher / temperature)
+        soft = tf.reduce_sum(soft_targets * (tf.math.log(soft_targets + 1e-8)
+                                             - tf.nn.log_softmax(student / temperature)), axis=-1)
+        return (1 - soft_weight) * hard + soft_weight * temperature ** 2 * soft
+
+    return loss
+
+def student_metrics(num_classes):
+    """Top-1 and top-3 accuracy on the student's half of y_pred"""
+    def student_accuracy(y_true, y_pred):
+        return tf.keras.metrics.categorical_accuracy(y_true, y_pred[:, :num_classes])
+
+    def student_top3_accuracy(y_true, y_pred):
+        return tf.keras.metrics.top_k_categorical_accuracy(y_true, y_pred[:, :num_classes], k=3)
+
+    return [student_accuracy, student_top3_accuracy]
+
+def cached_teacher_logits(teacher, teacher_path, split, class_names):
+    """Teacher logits for every image of a split, computed once per teacher and reused after
+
+    The store is keyed by image hash under a directory named after the
+    teacher file's fingerprint, so retraining the teacher starts a new one
+    and only new images are run on later calls. Logits come from the
+    unaugmented image, so they are a cheaper, slightly weaker target than
+    running the teacher on each augmented batch.
+    """
+    from prediction_cache import model_version
+
+    logits_model = teacher_logits_model(teacher)
+    directory = os.path.join(config.DISTILL_TEACHER_CACHE_DIR, f"{model_version(teacher_path)}_{config.IMG_SIZE}px")
+    store = FeatureStore(directory, len(class_names), dtype='float32')
+
+    paths, labels = list_split_files(split, class_names)
+    keys = extract_features(store, logits_model, paths, image_hashes(paths), view=0)
+    print(f"✅ Teacher logits for {len(paths)} {split} images in {directory}")
+    return paths, labels, store.get(keys)
+
+def cached_dataset(paths, labels, logits, num_classes, training):
+    """((student-size image, teacher logits), one-hot label) batches"""
+    size = config.DISTILL_IMG_SIZE
+    ds = tf.data.Dataset.from_tensor_slices((paths, logits, labels))
+    ds = ds.map(lambda p, t, y: (decode_and_resize(p, size), t, y), num_parallel_calls=AUTOTUNE)
+    if config.TF_DATA_CACHE == 'memory':
+        ds = ds.cache()
+    if training:
+        ds = ds.shuffle(min(len(paths), config.SHUFFLE_BUFFER), seed=config.RANDOM_SEED,
+                        reshuffle_each_iteration=True)
+    ds = ds.batch(config.BATCH_SIZE, num_parallel_calls=AUTOTUNE)
+
+    def to_float(x, t, y):
+        x = tf.cast(x, tf.float32) / 255.0
+        return (augment_batch(x) if training else x, t), tf.one_hot(y, num_classes)
+
+    return ds.map(to_float, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+
+def build_training_model(student_logits, teacher, num_classes, cached):
+    """Model whose output is [student logits | teacher logits], for distillation_loss
+
+    Cached: the teacher logits come in as a second input. Online: the
+    teacher runs on the full-size batch and the student sees it resized.
+    """
+    concat = tf.keras.layers.Concatenate(dtype='float32', name='student_and_teacher')
+    student_size = config.DISTILL_IMG_SIZE
+    if cached:
+        images = tf.keras.Input((student_size, student_size, 3))
+        teacher_logits = tf.keras.Input((num_classes,))
+        return tf.keras.Model([images, teacher_logits], concat([student_logits(images), teacher_logits]))
+
+    images = tf.keras.Input((config.IMG_SIZE, config.IMG_SIZE, 3))
+    student_images = images
+    if student_size != config.IMG_SIZE:
+        student_images = tf.keras.layers.Resizing(student_size, student_size)(images)
+    return tf.keras.Model(images, concat([student_logits(student_images), teacher_logits_model(teacher)(images)]))
+
+def train_student(class_indices, teacher, teacher_path):
+    """Distill the teacher into the student: head first, then the top of the student backbone"""
+    from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
+    from tensorflow.keras.optimizers import Adam
+    from data_pipeline import create_datasets
+    from train_model import configure_precision
+
+    class_names = sorted(class_indices, key=class_indices.get)
+    num_classes = len(class_names)
+    cached = config.DISTILL_TEACHER_CACHE
+    if cached:
+        train_ds = cached_dataset(*cached_teacher_logits(teacher, teacher_path, 'train', class_names),
+                                  num_classes, training=True)
+        val_ds = cached_dataset(*cached_teacher_logits(teacher, teacher_path, 'val', class_names),
+                                num_classes, training=False)
+    else:
+        train_ds, val_ds, _ = create_datasets()
+
+    print(f"\n🧑‍🎓 Distilling into MobileNetV2 alpha={config.DISTILL_ALPHA} at {config.DISTILL_IMG_SIZE}px "
+          f"(T={config.DISTILL_TEMPERATURE}, soft weight {config.DISTILL_SOFT_WEIGHT}, "
+          f"teacher {'cached' if cached else 'online'})")
+    # Saving the teacher as float32 reset the global policy; the student trains under the configured one
+    configure_precision()
+    student, student_logits, base_model = create_student(num_classes)
+    training_model = build_training_model(student_logits, teacher, num_classes, cached)
+    checkpoint_path = os.path.join(config.MODEL_DIR, 'student_training.weights.h5')
+    callbacks = [
+        EarlyStopping(monitor='val_student_accuracy', mode='max', patience=config.EARLY_STOPPING_PATIENCE),
+        ModelCheckpoint(checkpoint_path, monitor='val_student_accuracy', mode='max', save_best_only=True,
+                        save_weights_only=True),
+    ]
+
+    for learning_rate, epochs in ((config.LEARNING_RATE, config.DISTILL_EPOCHS),
+                                  (config.FINE_TUNE_LR, config.DISTILL_FINE_TUNE_EPOCHS)):
+        training_model.compile(
+            optimizer=Adam(learning_rate=learning_rate),
+            loss=distillation_loss(num_classes),
+            metrics=student_metrics(num_classes),
+            jit_compile=config.JIT_COMPILE
+        )
+        training_model.fit(train_ds, epochs=epochs, validation_data=val_ds, callbacks=callbacks)
+
+        # Second round fine-tunes the top of the student backbone
+        base_model.trainable = True
+        for layer in base_model.layers[:-config.FINE_TUNE_LAYERS]:
+            layer.trainable = False
+
+    training_model.load_weights(checkpoint_path)
+    os.remove(checkpoint_path)
+    if config.PRECISION_POLICY != 'float32':
+        # Serving and TFLite expect a plain float32 graph
+        tf.keras.mixed_precision.set_global_policy('float32')
+        float_student = create_student(num_classes, weights=None)[0]
+        float_student.set_weights(student.get_weights())
+        student = float_student
+    return student
+
+def single_image_ms(predict_fn, size, repeats=20):
+    """Median latency of a batch-of-one forward pass"""
+    x = np.random.default_rng(0).random((1, size, size, 3), dtype=np.float32)
+    predict_fn(x)  # Warm-up
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict_fn(x)
+        samples.append(1000.0 * (time.perf_counter() - start))
+    return sorted(samples)[len(samples) // 2]
+
+def score_model(model, tflite_path, size, class_names, split='test'):
+    """Accuracy, batch throughput and single-image latency of a Keras model and its TFLite export"""
+    from backends import TFLiteBackend
+
+    predictors = {'keras': model.predict_on_batch}
+    if tflite_path and os.path.exists(tflite_path):
+        predictors['tflite'] = TFLiteBackend(tflite_path).predict
+    paths, labels = list_split_files(split, class_names)
+    ds = build_dataset(paths, labels, len(class_names), training=False, img_size=size, cache='')
+    results, _ = evaluate_stream(predictors, iter_labelled_batches(ds), class_names)
+
+    scores = {'img_size': size, 'params': int(model.count_params())}
+    for name, predict_fn in predictors.items():
+        result = results[name]
+        scores[name] = {
+            'accuracy': result['accuracy'],
+            'top_3_accuracy': result['top_3_accuracy'],
+            'batch_ms_per_image': 1000.0 / result['images_per_sec'] if result['images_per_sec'] else None,
+            'single_image_ms': single_image_ms(predict_fn, size),
+        }
+    if 'tflite' in predictors:
+        scores['tflite']['size_bytes'] = os.path.getsize(tflite_path)
+    return scores
+
+def compare(teacher, student, class_names, report_path=None):
+    """Side-by-side teacher/student accuracy and latency on the test split, written to the report"""
+    report_path = report_path or config.DISTILL_REPORT_PATH
+    print("🧪 Scoring teacher and student on the test split...")
+    report = {
+        'teacher': score_model(teacher, config.TFLITE_MODEL_PATH, config.IMG_SIZE, class_names),
+        'student': score_model(student, config.STUDENT_TFLITE_MODEL_PATH, config.DISTILL_IMG_SIZE, class_names),
+        'alpha': config.DISTILL_ALPHA,
+        'temperature': config.DISTILL_TEMPERATURE,
+        'soft_weight': config.DISTILL_SOFT_WEIGHT,
+        'teacher_cache': config.DISTILL_TEACHER_CACHE,
+    }
+
+    print(f"{'':18s}{'teacher':>12s}{'student':>12s}")
+    print(f"{'parameters':18s}{report['teacher']['params']:>12,}{report['student']['params']:>12,}")
+    for backend in ('keras', 'tflite'):
+        if backend not in report['teacher'] or backend not in report['student']:
+            continue
+        teacher_scores, student_scores = report['teacher'][backend], report['student'][backend]
+        for key, label in (('accuracy', 'top-1'), ('top_3_accuracy', 'top-3')):
+            print(f"{backend + ' ' + label:18s}{teacher_scores[key]:>12.4f}{student_scores[key]:>12.4f}")
+        for key, label in (('batch_ms_per_image', 'ms/img batch'), ('single_image_ms', 'ms single')):
+            if teacher_scores[key] and student_scores[key]:
+                print(f"{backend + ' ' + label:18s}{teacher_scores[key]:>12.2f}{student_scores[key]:>12.2f}")
+        report[f'{backend}_speedup'] = teacher_scores['single_image_ms'] / student_scores['single_image_ms']
+        report[f'{backend}_accuracy_delta'] = student_scores['accuracy'] - teacher_scores['accuracy']
+        print(f"📊 {backend}: student is x{report[f'{backend}_speedup']:.1f} faster per image, "
+              f"top-1 {report[f'{backend}_accuracy_delta']:+.4f}")
+
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def distill(class_indices, teacher=None, teacher_path=None):
+    """Train, export and compare a student distilled from the trained model"""
+    from quantization import convert_dynamic
+
+    teacher_path = teacher_path or (config.BEST_MODEL_PATH if os.path.exists(config.BEST_MODEL_PATH)
+                                    else config.MODEL_PATH)
+    teacher = teacher or tf.keras.models.load_model(teacher_path)
+
+    student = train_student(class_indices, teacher, teacher_path)
+    student.save(config.STUDENT_MODEL_PATH)
+    print(f"✅ Student model saved: {config.STUDENT_MODEL_PATH}")
+    try:
+        with open(config.STUDENT_TFLITE_MODEL_PATH, 'wb') as f:
+            f.write(convert_dynamic(student))
+        print(f"✅ Student TFLite model saved: {config.STUDENT_TFLITE_MODEL_PATH}")
+    except Exception as e:
+        print(f"⚠️  Student TFLite conversion failed: {e}")
+
+    return compare(teacher, student, sorted(class_indices, key=class_indices.get))
@@ -0,0 +1,403 @@
+import fcntl
+import json
+import os
+import threading
+import numpy as np
+import config
+from batcher import MicroBatcher
+from preprocessing import load_batch, load_image, new_batch_buffer, parallel_loader
+
+DTYPES = ('int8', 'float16')
+
+def l2_normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def trained_model_path():
+    """The Keras model /predict would load, or None before the first training run"""
+    for path in (config.BEST_MODEL_PATH, config.MODEL_PATH):
+        if os.path.exists(path):
+            return path
+    return None
+
+def build_embedding_model(model=None, model_path=None):
+    """Trained model cut at its GlobalAveragePooling2D output, plus a version tag
+
+    Without a trained model this falls back to the ImageNet backbone + pooling
+    (the feature cache extractor), so duplicates can be grouped before the
+    first split.
+    """
+    import tensorflow as tf
+    from prediction_cache import model_version
+
+    if model is None:
+        model_path = model_path or trained_model_path()
+        if model_path is None:
+            from feature_cache import build_feature_extractor
+            return build_feature_extractor(), f"imagenet-{config.BASE_MODEL}-{config.IMG_SIZE}px"
+        model = tf.keras.models.load_model(model_path)
+    version = model_version(model_path) if model_path else model.name
+
+    pooling = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)]
+    if not pooling:
+        raise ValueError(f"Model {model.name} has no GlobalAveragePooling2D layer")
+    return tf.keras.Model(model.input, pooling[-1].output), version
+
+class EmbeddingIndex:
+    """Append-only, memory-mapped matrix of L2-normalized embeddings
+
+    'int8' rows store round(v / scale) with one float32 scale per row in
+    scales.bin (4x smaller than float32); 'float16' rows are stored as is.
+    items.jsonl holds one item (key, path, label) per row, appended after
+    the row itself, and meta.json the dim, dtype and embedding model
+    version; a different dim, dtype or model starts the index over.
+    Opening only reads; writes take a lock on the directory and repair
+    leftovers of an interrupted write first.
+    """
+
+    def __init__(self, directory, dim=None, dtype=None, model=None):
+        self.directory = directory
+        self.dtype = np.dtype(dtype or config.EMBEDDING_DTYPE)
+        if self.dtype.name not in DTYPES:
+            raise ValueError(f"Unknown embedding dtype '{self.dtype.name}', expected one of {DTYPES}")
+        self.data_path = os.path.join(directory, 'vectors.bin')
+        self.scales_path = os.path.join(directory, 'scales.bin')
+        self.items_path = os.path.join(directory, 'items.jsonl')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        os.makedirs(directory, exist_ok=True)
+
+        self.items, self.rows, self._log_bytes, self._arrays = [], {}, 0, None
+        self.model = model
+        self.dim = dim
+        self.compatible = False
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            if dim is None and model is None:
+                # Opened for searching only: take the index as it is
+                self.dim, self.model, self.dtype = meta['dim'], meta['model'], np.dtype(meta['dtype'])
+            self.compatible = (meta['dim'], meta['dtype'], meta['model']) == (self.dim, self.dtype.name, self.model)
+        if self.dim is None:
+            raise FileNotFoundError(f"No embedding index in {directory}")
+        self._read_items()
+
+    def _read_items(self):
+        """Pick up items appended since the last read (by this or another process)"""
+        if not self.compatible or not os.path.exists(self.items_path):
+            return
+        with open(self.items_path, 'rb') as f:
+            f.seek(self._log_bytes)
+            data = f.read()
+        # A line without its newline is an interrupted write
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode().splitlines():
+            item = json.loads(line)
+            self.rows[item['key']] = len(self.items)
+            self.items.append(item)
+        self._log_bytes += end
+        self._arrays = None
+
+    def _lock(self):
+        lock = open(os.path.join(self.directory, '.lock'), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _repair(self):
+        """Start over if incompatible and drop anything past the last complete item (lock held)"""
+        if not self.compatible:
+            self.items, self.rows, self._log_bytes = [], {}, 0
+        n = len(self.items)
+        with open(self.items_path, 'ab') as f:
+            f.truncate(self._log_bytes)
+        with open(self.data_path, 'ab') as f:
+            f.truncate(n * self.dim * self.dtype.itemsize)
+        with open(self.scales_path, 'ab') as f:
+            f.truncate(n * 4 if self.dtype.name == 'int8' else 0)
+        if not self.compatible:
+            tmp_path = self.meta_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'dim': self.dim, 'dtype': self.dtype.name, 'model': self.model}, f)
+            os.replace(tmp_path, self.meta_path)
+            self.compatible = True
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def reset(self):
+        with self._lock():
+            self.compatible = False
+            self._repair()
+
+    def append(self, items, vectors):
+        """Normalize, quantize and add rows for keys the index does not have yet"""
+        vectors = l2_normalize(np.reshape(vectors, (len(items), self.dim)))
+        with self._lock():
+            self._read_items()
+            self._repair()
+            new = {}
+            for i, item in enumerate(items):
+                if item['key'] not in self.rows:
+                    new.setdefault(item['key'], i)
+            if not new:
+                return
+            vectors = vectors[list(new.values())]
+            if self.dtype.name == 'int8':
+                scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+                data = np.round(vectors / scales[:, None]).astype(np.int8)
+                with open(self.scales_path, 'ab') as f:
+                    f.write(scales.astype(np.float32).tobytes())
+            else:
+                data = vectors.astype(np.float16)
+            with open(self.data_path, 'ab') as f:
+                f.write(data.tobytes())
+
+            lines = ''.join(json.dumps(items[i]) + '\n' for i in new.values()).encode()
+            with open(self.items_path, 'ab') as f:
+                f.write(lines)
+            for i in new.values():
+                self.rows[items[i]['key']] = len(self.items)
+                self.items.append(items[i])
+            self._log_bytes += len(lines)
+            self._arrays = None
+
+    def _load_arrays(self):
+        if self._arrays is None:
+            n = len(self.items)
+            data = np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=(n, self.dim))
+            scales = None
+            if self.dtype.name == 'int8':
+                scales = np.memmap(self.scales_path, dtype=np.float32, mode='r', shape=(n,))
+            self._arrays = (data, scales)
+        return self._arrays
+
+    def search(self, queries, k=None, chunk_rows=None):
+        """Cosine top-k for a (Q, dim) batch of queries: (scores, rows), best first
+
+        The memory-mapped rows are scored a chunk at a time with one matmul,
+        and each chunk's top-k is merged into the running top-k, so memory
+        stays bounded by the chunk size whatever the index size.
+        """
+        queries = l2_normalize(np.reshape(queries, (-1, self.dim)))
+        k = min(k or config.SIMILAR_TOP_K, len(self.items))
+        chunk_rows = chunk_rows or config.EMBEDDING_SEARCH_CHUNK
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), k), dtype=np.int64)
+        if k == 0:
+            return best_scores, best_rows
+
+        data, scales = self._load_arrays()
+        for start in range(0, len(self.items), chunk_rows):
+            block = np.asarray(data[start:start + chunk_rows], dtype=np.float32)
+            scores = queries @ block.T
+            if scales is not None:
+                scores *= scales[start:start + chunk_rows]
+
+            top = np.argpartition(-scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+            scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            rows = np.concatenate([best_rows, top + start], axis=1)
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def vectors(self, rows):
+        """Dequantized float32 rows"""
+        data, scales = self._load_arrays()
+        vectors = np.asarray(data[rows], dtype=np.float32)
+        if scales is not None:
+            vectors *= scales[rows][:, None]
+        return vectors
+
+    def duplicate_groups(self, threshold=None, neighbours=None, batch_size=1024):
+        """Rows whose cosine similarity reaches threshold, joined transitively
+
+        Each row is compared with its `neighbours` nearest rows; groups are
+        the connected components (union-find), returned as lists of rows.
+        """
+        threshold = config.DEDUP_THRESHOLD if threshold is None else threshold
+        neighbours = neighbours or config.DEDUP_NEIGHBOURS
+        parent = list(range(len(self.items)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for start in range(0, len(self.items), batch_size):
+            rows = np.arange(start, min(start + batch_size, len(self.items)))
+            scores, matches = self.search(self.vectors(rows), neighbours + 1)
+            for row, row_scores, row_matches in zip(rows, scores, matches):
+                for score, match in zip(row_scores, row_matches):
+                    if score >= threshold and match != row:
+                        parent[find(match)] = find(row)
+
+        groups = {}
+        for row in range(len(self.items)):
+            groups.setdefault(find(row), []).append(row)
+        return [rows for rows in groups.values() if len(rows) > 1]
+
+def sync_index(index, embedder, items, batch_size=None):
+    """Make the index hold exactly `items` (dicts with key/path/label), embedding only new keys
+
+    Keys are image content hashes, so unchanged images are never re-embedded;
+    an index holding keys that are no longer wanted is rebuilt from scratch.
+    """
+    batch_size = batch_size or config.BATCH_SIZE
+    wanted = {item['key']: item for item in items}
+    if set(index.rows) - set(wanted):
+        index.reset()
+    todo = [item for key, item in wanted.items() if key not in index.rows]
+    if not todo:
+        return index
+
+    print(f"🧬 Embedding {len(todo)} images...")
+    size = embedder.input_shape[1]
+    buffer = new_batch_buffer(batch_size, size)
+    with parallel_loader() as executor:
+        for start in range(0, len(todo), batch_size):
+            chunk = todo[start:start + batch_size]
+            x = load_batch([item['path'] for item in chunk], size, buffer[:len(chunk)], executor)
+            index.append(chunk, embedder.predict_on_batch(x))
+    return index
+
+def open_index(directory, embedder, version, dtype=None):
+    return EmbeddingIndex(directory, embedder.output_shape[-1], dtype, version)
+
+def build_reference_index(split='train', directory=None, dtype=None, model_path=None):
+    """Index one split's images with their breeds, for /similar"""
+    from data_pipeline import get_class_names, list_split_files
+    from feature_cache import image_hashes
+
+    class_names = get_class_names()
+    paths, labels = list_split_files(split, class_names)
+    embedder, version = build_embedding_model(model_path=model_path)
+    index = open_index(directory or config.EMBEDDING_INDEX_DIR, embedder, version, dtype)
+    items = [{'key': h, 'path': p, 'label': class_names[y]} for p, y, h in zip(paths, labels, image_hashes(paths))]
+    sync_index(index, embedder, items)
+    print(f"✅ Embedding index: {len(index)} images in {index.directory} ({index.dtype.name})")
+    return index
+
+def find_duplicate_groups(rows, threshold=None, directory=None):
+    """Map image hash -> duplicate group id for near-identical manifest rows
+
+    Rows need 'hash', 'path' and 'breed'. Embeddings are kept in
+    DEDUP_INDEX_DIR, so only new images are embedded on later runs.
+    The group id is the smallest hash in the group; images without
+    a near duplicate are left out.
+    """
+    embedder, version = build_embedding_model()
+    index = open_index(directory or config.DEDUP_INDEX_DIR, embedder, version)
+    items = {row['hash']: {'key': row['hash'], 'path': row['path'], 'label': row['breed']} for row in rows}
+    sync_index(index, embedder, list(items.values()))
+
+    groups = {}
+    for group in index.duplicate_groups(threshold):
+        keys = [index.items[row]['key'] for row in group]
+        for key in keys:
+            groups[key] = min(keys)
+    return groups
+
+class SimilarityIndex:
+    """Embedding model + reference index behind /similar
+
+    Like ModelServer, nothing is loaded in the constructor; load() imports
+    TensorFlow, cuts the trained model at its pooling layer and starts a
+    micro-batcher so concurrent queries share forward passes.
+    """
+
+    def __init__(self, directory=None, model_path=None):
+        self.directory = directory or config.EMBEDDING_INDEX_DIR
+        self.model_path = model_path
+        self.index = None
+        self.batcher = None
+        self.input_size = config.IMG_SIZE
+        self.ready = False
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return os.path.exists(os.path.join(self.directory, 'meta.json'))
+
+    def load(self):
+        with self._lock:
+            if self.ready:
+                return self
+            try:
+                self.index = EmbeddingIndex(self.directory)
+                embedder, version = build_embedding_model(model_path=self.model_path)
+                if version != self.index.model:
+                    print(f"⚠️  Embedding index was built with model {self.index.model}, serving {version}; "
+                          f"rebuild it with: python embeddings.py build")
+                self.input_size = embedder.input_shape[1]
+                self.batcher = MicroBatcher(lambda batch: np.asarray(embedder.predict_on_batch(batch)))
+                self.batcher.predict(np.zeros((self.input_size, self.input_size, 3), dtype=np.float32))
+                self.ready = True
+            except Exception as e:
+                self.error = str(e)
+                raise
+        return self
+
+    def start_background_load(self):
+        thread = threading.Thread(target=self._load_quietly, name="similarity-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except Exception:
+            import logging
+            logging.error("Similarity index loading failed", exc_info=True)
+
+    def query(self, image_bytes, k=None):
+        """Nearest reference images to one upload: [{'path', 'label', 'score'}, ...]"""
+        x = load_image(image_bytes, self.input_size)
+        vector = self.batcher.predict(x)
+        scores, rows = self.index.search(vector[None], k)
+        # int8 rounding can push a self-match a hair above 1
+        return [{**self.index.items[row], 'score': min(float(score), 1.0)} for score, row in zip(scores[0], rows[0])]
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'images': len(self.index) if self.index else 0,
+            'dtype': self.index.dtype.name if self.index else None,
+            'error': self.error,
+        }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the /similar embedding index or list near-duplicate images")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="Index a split's images for /similar")
+    build.add_argument('--split', default='train')
+    build.add_argument('--dtype', choices=DTYPES, help="Default: config.EMBEDDING_DTYPE")
+    dupes = sub.add_parser('duplicates', help="Report near-duplicate groups in the raw dataset manifest")
+    dupes.add_argument('--threshold', type=float, help="Default: config.DEDUP_THRESHOLD")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_reference_index(args.split, dtype=args.dtype)
+    else:
+        from split_dataset import load_manifest
+
+        rows = [r for r in load_manifest() if r['valid']]
+        groups = find_duplicate_groups(rows, args.threshold)
+        members = {}
+        for row in rows:
+            if row['hash'] in groups:
+                members.setdefault(groups[row['hash']], []).append(row)
+        for group in members.values():
+            splits = {r['split'] for r in group}
+            flag = "⚠️  spans " + "/".join(sorted(splits)) if len(splits) > 1 else ""
+            print(f"🔁 {len(group)} images {flag}")
+            for row in group:
+                print(f"   {row['split'] or '-':5s} {row['path']}")
+        print(f"📊 {len(members)} duplicate groups covering {sum(len(g) for g in members.values())} images")
@@ -2,66 +2,217 @@ import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.metrics import classification_report, confusion_matrix
+import argparse
 import json
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import config
+from train_model import flow_from_split
+from backends import load_backend
+from data_pipeline import create_eval_dataset
 
-def evaluate_model():
-    """Evaluate trained model"""
+class StreamingMetrics:
+    """Loss, top-1/top-k accuracy and confusion matrix accumulated batch by batch
+
+    Only a (num_classes, num_classes) count matrix and a few sums are kept,
+    so memory does not grow with the size of the test set.
+    """
+    
+    def __init__(self, class_names, k=3):
+        self.class_names = list(class_names)
+        self.k = k
+        num_classes = len(self.class_names)
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.loss_sum = 0.0
+        self.top_k_correct = 0
+        self.count = 0
+        self.seconds = 0.0
+    
+    def update(self, predictions, true_classes, seconds=0.0):
+        """Add one batch of probabilities (N, C) and integer labels (N,)"""
+        true_classes = np.asarray(true_classes, dtype=np.int64)
+        predictions = np.asarray(predictions, dtype=np.float64)
+        rows = np.arange(len(true_classes))
+        
+        self.loss_sum += float(-np.sum(np.log(np.clip(predictions[rows, true_classes], 1e-7, 1.0))))
+        top_k = np.argpartition(predictions, -self.k, axis=1)[:, -self.k:] if predictions.shape[1] > self.k \
+            else np.tile(np.arange(predictions.shape[1]), (len(rows), 1))
+        self.top_k_correct += int(np.sum(np.any(top_k == true_classes[:, None], axis=1)))
+        np.add.at(self.confusion, (true_classes, np.argmax(predictions, axis=1)), 1)
+        self.count += len(true_classes)
+        self.seconds += seconds
+    
+    def classification_report(self):
+        """Per-class precision/recall/F1 in the same layout as sklearn's output_dict"""
+        tp = np.diag(self.confusion).astype(np.float64)
+        support = self.confusion.sum(axis=1).astype(np.float64)
+        predicted = self.confusion.sum(axis=0).astype(np.float64)
+        precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+        recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+        denom = precision + recall
+        f1 = np.divide(2 * precision * recall, denom, out=np.zeros_like(tp), where=denom > 0)
+        
+        report = {
+            name: {'precision': float(precision[i]), 'recall': float(recall[i]),
+                   'f1-score': float(f1[i]), 'support': float(support[i])}
+            for i, name in enumerate(self.class_names)
+        }
+        total = support.sum()
+        weights = support / total if total else np.zeros_like(support)
+        report['accuracy'] = float(tp.sum() / total) if total else 0.0
+        report['macro avg'] = {'precision': float(precision.mean()), 'recall': float(recall.mean()),
+                               'f1-score': float(f1.mean()), 'support': float(total)}
+        report['weighted avg'] = {'precision': float(weights @ precision), 'recall': float(weights @ recall),
+                                  'f1-score': float(weights @ f1), 'support': float(total)}
+        return report
+    
+    def result(self):
+        count = max(self.count, 1)
+        return {
+            'loss': self.loss_sum / count,
+            'accuracy': float(np.trace(self.confusion)) / count,
+            f'top_{self.k}_accuracy': self.top_k_correct / count,
+            'classification_report': self.classification_report(),
+            'confusion_matrix': self.confusion.tolist(),
+            'images': self.count,
+            'inference_seconds': self.seconds,
+            'images_per_sec': self.count / self.seconds if self.seconds > 0 else None
+        }
+
+def compute_metrics(true_classes, predictions, class_names, k=3):
+    """Loss, top-1/top-k accuracy and per-class report from predicted probabilities"""
+    metrics = StreamingMetrics(class_names, k)
+    metrics.update(predictions, true_classes)
+    return metrics.result()
+
+def iter_labelled_batches(source, workers=None):
+    """(images, integer labels) numpy batches from a tf.data dataset or a Keras generator
+
+    tf.data decodes in parallel on its own; generator batches are loaded
+    by a thread pool a few batches ahead of the model.
+    """
+    if isinstance(source, tf.data.Dataset):
+        for x, y in source:
+            yield x.numpy(), np.argmax(y, axis=1)
+        return
+    
+    workers = workers or config.PREDICT_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        next_index = 0
+        while pending or next_index < len(source):
+            while next_index < len(source) and len(pending) < workers:
+                pending.append(pool.submit(source.__getitem__, next_index))
+                next_index += 1
+            x, y = pending.popleft().result()
+            yield x, np.argmax(y, axis=1)
+
+def evaluate_stream(models, batches, class_names, k=3):
+    """One pass over the batches, scoring every model on each batch as it arrives
+    
+    models maps a name to a predict function taking a (N, H, W, 3) float
+    batch; returns {name: metrics} with per-model inference throughput.
+    """
+    results = {name: StreamingMetrics(class_names, k) for name in models}
+    images = 0
+    start = time.perf_counter()
+    for x, true_classes in batches:
+        for name, predict_fn in models.items():
+            started = time.perf_counter()
+            predictions = predict_fn(x)
+            results[name].update(predictions, true_classes, time.perf_counter() - started)
+        images += len(true_classes)
+    elapsed = time.perf_counter() - start
+    
+    pipeline = {'images': images, 'seconds': elapsed, 'images_per_sec': images / elapsed if elapsed > 0 else None}
+    return {name: metrics.result() for name, metrics in results.items()}, pipeline
+
+def available_backends():
+    """Backends with an artifact on disk: the Keras model plus any exported TFLite files"""
+    kinds = ['keras']
+    if os.path.exists(config.TFLITE_MODEL_PATH):
+        kinds.append('tflite')
+    if os.path.exists(config.INT8_TFLITE_MODEL_PATH):
+        kinds.append('tflite_int8')
+    return kinds
+
+def load_eval_backend(kind):
+    if kind == 'tflite_int8':
+        return load_backend('tflite', config.INT8_TFLITE_MODEL_PATH)
+    return load_backend(kind)
+
+def evaluate_model(backends=None):
+    """Evaluate the trained model (and optionally its TFLite exports) in one pass over the test set"""
     print("🧪 Evaluating model...")
     
-    # Load model
-    if os.path.exists(config.BEST_MODEL_PATH):
-        model = tf.keras.models.load_model(config.BEST_MODEL_PATH)
+    backends = backends or available_backends()
+    models = {}
+    for kind in backends:
+        backend = load_eval_backend(kind)
+        if backend.input_size and backend.input_size != config.IMG_SIZE:
+            print(f"⚠️  Skipping {kind}: input size {backend.input_size} != IMG_SIZE {config.IMG_SIZE}")
+            continue
+        models[kind] = backend.predict
+    if not models:
+        print(f"❌ No model matches IMG_SIZE {config.IMG_SIZE}; retrain or export one at this size first!")
+        return None
+    
+    if config.INPUT_PIPELINE == 'generator':
+        # Create test generator
+        test_datagen = ImageDataGenerator(rescale=1./255)
+        test_generator = flow_from_split(test_datagen, 'test', shuffle=False)
+        class_names = list(test_generator.class_indices.keys())
     else:
-        model = tf.keras.models.load_model(config.MODEL_PATH)
-    
-    # Create test generator
-    test_datagen = ImageDataGenerator(rescale=1./255)
-    test_generator = test_datagen.flow_from_directory(
-        os.path.join(config.PROCESSED_DATASET_DIR, 'test'),
-        target_size=(config.IMG_SIZE, config.IMG_SIZE),
-        batch_size=config.BATCH_SIZE,
-        class_mode='categorical',
-        shuffle=False
-    )
-    
-    # Evaluate
-    test_loss, test_accuracy = model.evaluate(test_generator)[:2]
-    print(f"📊 Test Accuracy: {test_accuracy:.4f}")
-    print(f"📊 Test Loss: {test_loss:.4f}")
-    
-    # Get predictions for detailed analysis
-    predictions = model.predict(test_generator)
-    predicted_classes = np.argmax(predictions, axis=1)
-    true_classes = test_generator.classes
-    
-    # Classification report
-    class_names = list(test_generator.class_indices.keys())
-    report = classification_report(true_classes, predicted_classes, 
-                                 target_names=class_names, output_dict=True)
+        # tf.data over files or shards; labels come from the stream
+        test_generator, class_names = create_eval_dataset('test')
+    
+    results, pipeline = evaluate_stream(models, iter_labelled_batches(test_generator), class_names)
+    primary = results[next(iter(models))]
     
+    for name, metrics in results.items():
+        speed = f"{metrics['images_per_sec']:.1f} img/s" if metrics['images_per_sec'] else "n/a"
+        print(f"📊 {name}: accuracy {metrics['accuracy']:.4f}, top-3 {metrics['top_3_accuracy']:.4f}, "
+              f"loss {metrics['loss']:.4f}, {speed}")
+    print(f"⚡ Pipeline: {pipeline['images']} images in {pipeline['seconds']:.1f}s "
+          f"({pipeline['images_per_sec'] or 0:.1f} img/s end to end)")
+    
+    report = primary['classification_report']
     print("\n📈 Per-class Performance (Top 5):")
     class_f1 = [(name, metrics['f1-score']) for name, metrics in report.items() 
                 if name not in ['accuracy', 'macro avg', 'micro avg', 'weighted avg']]
-    class_f1.sort(key=lambda x: x, reverse=True)
+    class_f1.sort(key=lambda x: x[1], reverse=True)
     
     for name, f1 in class_f1[:5]:
         print(f"  {name}: {f1:.3f}")
     
     # Save evaluation results
     eval_results = {
-        'test_accuracy': float(test_accuracy),
-        'test_loss': float(test_loss),
-        'classification_report': report
+        'test_accuracy': primary['accuracy'],
+        'test_loss': primary['loss'],
+        'test_top_3_accuracy': primary['top_3_accuracy'],
+        'classification_report': report,
+        'confusion_matrix': primary['confusion_matrix'],
+        'class_names': class_names,
+        'throughput': pipeline,
+        'models': {
+            name: {key: metrics[key] for key in ('accuracy', 'top_3_accuracy', 'loss', 'images',
+                                                 'inference_seconds', 'images_per_sec')}
+            for name, metrics in results.items()
+        }
     }
     
     with open('evaluation_results.json', 'w') as f:
         json.dump(eval_results, f, indent=2)
     
     print(f"\n✅ Evaluation completed!")
-    return test_accuracy
+    return primary['accuracy']
 
 if __name__ == "__main__":
-    evaluate_model()
+    parser = argparse.ArgumentParser(description="Single-pass evaluation on the test split")
+    parser.add_argument('--backends', nargs='+', choices=['keras', 'savedmodel', 'tflite', 'tflite_int8'],
+                        help="Models to score side by side (default: keras plus any TFLite exports on disk)")
+    args = parser.parse_args()
+    
+    evaluate_model(args.backends)
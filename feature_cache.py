@@ -0,0 +1,241 @@
+import fcntl
+import json
+import os
+import numpy as np
+import tensorflow as tf
+import config
+from split_dataset import file_hash, load_manifest, processed_path
+from data_pipeline import AUTOTUNE, augment_batch, decode_and_resize, get_class_names, list_split_files
+
+class FeatureStore:
+    """Append-only, memory-mapped matrix of backbone features keyed by image hash
+
+    Rows live in a flat binary file that only ever grows; keys.txt holds the
+    '<image hash>:<view>' key of each row, one line per row. A row is
+    written before its key, so an interrupted extraction keeps what it
+    finished. Opening only reads; append() takes a lock on the store and
+    repairs leftovers of an interrupted write, so processes can share it.
+    """
+
+    def __init__(self, directory, dim, dtype=None):
+        self.directory = directory
+        self.dim = dim
+        self.dtype = np.dtype(dtype or config.FEATURE_CACHE_DTYPE)
+        self.row_bytes = dim * self.dtype.itemsize
+        self.data_path = os.path.join(directory, 'features.bin')
+        self.keys_path = os.path.join(directory, 'keys.txt')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        os.makedirs(directory, exist_ok=True)
+
+        self.index, self._log_bytes, self._mmap = {}, 0, None
+        self.compatible = True
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.compatible = json.load(f) == {'dim': dim, 'dtype': self.dtype.name}
+        self._read_keys()
+
+    def _read_keys(self):
+        """Pick up keys appended since the last read (by this or another process)"""
+        if not self.compatible or not os.path.exists(self.keys_path):
+            return
+        with open(self.keys_path, 'rb') as f:
+            f.seek(self._log_bytes)
+            data = f.read()
+        # A line without its newline is an interrupted write
+        end = data.rfind(b'\n') + 1
+        for key in data[:end].decode().splitlines():
+            self.index[key] = len(self.index)
+        self._log_bytes += end
+
+    def _repair(self):
+        """Start over for a different dim/dtype and drop anything past the last complete key (lock held)"""
+        if not self.compatible:
+            print(f"♻️  {self.directory} holds features of another shape, rebuilding")
+        with open(self.keys_path, 'ab') as f:
+            f.truncate(self._log_bytes)
+        with open(self.data_path, 'ab') as f:
+            f.truncate(len(self.index) * self.row_bytes)
+        if not self.compatible or not os.path.exists(self.meta_path):
+            tmp_path = self.meta_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'dim': self.dim, 'dtype': self.dtype.name}, f)
+            os.replace(tmp_path, self.meta_path)
+            self.compatible = True
+
+    def __len__(self):
+        return len(self.index)
+
+    def missing(self, keys):
+        return [k for k in keys if k not in self.index]
+
+    def append(self, keys, vectors):
+        """Add rows for keys the store does not have yet"""
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(len(keys), self.dim)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._read_keys()
+            self._repair()
+            new = {}
+            for i, key in enumerate(keys):
+                if key not in self.index:
+                    new.setdefault(key, i)
+            if new:
+                with open(self.data_path, 'ab') as f:
+                    f.write(vectors[list(new.values())].tobytes())
+                lines = ''.join(f"{key}\n" for key in new).encode()
+                with open(self.keys_path, 'ab') as f:
+                    f.write(lines)
+                for key in new:
+                    self.index[key] = len(self.index)
+                self._log_bytes += len(lines)
+        self._mmap = None
+
+    def get(self, keys):
+        """Gather rows for keys (in order) from the memory map"""
+        if self._mmap is None:
+            self._mmap = np.memmap(self.data_path, dtype=self.dtype, mode='r', shape=(len(self.index), self.dim))
+        rows = np.fromiter((self.index[k] for k in keys), dtype=np.int64, count=len(keys))
+        return np.asarray(self._mmap[rows])
+
+def image_hashes(paths):
+    """Content hash per path, from the split manifest when it covers the file"""
+    known = {}
+    for row in load_manifest():
+        known[row['path']] = row['hash']
+        if row['split']:
+            known[processed_path(row)] = row['hash']
+    return [known.get(p) or file_hash(p) for p in paths]
+
+def build_feature_extractor(base_model=None):
+    """Frozen backbone + global average pooling (the head's input)"""
+    if base_model is None:
+        base_model = tf.keras.applications.MobileNetV2(
+            weights='imagenet',
+            include_top=False,
+            input_shape=(config.IMG_SIZE, config.IMG_SIZE, 3)
+        )
+    features = tf.keras.layers.GlobalAveragePooling2D()(base_model.output)
+    return tf.keras.Model(base_model.input, features)
+
+def store_dir(extractor):
+    """Separate store per backbone/input size/dtype so stale features are never mixed in"""
+    name = f"{config.BASE_MODEL}_{config.IMG_SIZE}px_{extractor.output_shape[-1]}d_{config.FEATURE_CACHE_DTYPE}"
+    return os.path.join(config.FEATURE_CACHE_DIR, name)
+
+def extract_features(store, extractor, paths, hashes, view, batch_size=None):
+    """Compute features for images whose '<hash>:<view>' key is not in the store"""
+    batch_size = batch_size or config.BATCH_SIZE
+    keys = [f"{h}:{view}" for h in hashes]
+    todo = [(p, k) for p, k in zip(paths, keys) if k not in store.index]
+    todo = list({k: (p, k) for p, k in todo}.values())  # Duplicate images share a row
+    if not todo:
+        return keys
+
+    print(f"🧮 Extracting view {view} features for {len(todo)} images...")
+    ds = tf.data.Dataset.from_tensor_slices([p for p, _ in todo])
+    ds = ds.map(decode_and_resize, num_parallel_calls=AUTOTUNE).batch(batch_size)
+    ds = ds.map(lambda x: tf.cast(x, tf.float32) / 255.0, num_parallel_calls=AUTOTUNE)
+    if view > 0:
+        ds = ds.map(augment_batch, num_parallel_calls=AUTOTUNE)
+    ds = ds.prefetch(AUTOTUNE)
+
+    offset = 0
+    for batch in ds:
+        vectors = extractor.predict_on_batch(batch)
+        n = len(vectors)
+        store.append([k for _, k in todo[offset:offset + n]], vectors)
+        offset += n
+    return keys
+
+def load_split_features(split, extractor, store, class_names, views=1):
+    """Features and integer labels for one split, extracting anything missing"""
+    paths, labels = list_split_files(split, class_names)
+    hashes = image_hashes(paths)
+
+    all_keys, all_labels = [], []
+    for view in range(views):
+        all_keys += extract_features(store, extractor, paths, hashes, view)
+        all_labels += labels
+    return store.get(all_keys), np.asarray(all_labels)
+
+def build_head_model(feature_dim, num_classes, dense_units=None, dropout_rate=None):
+    """The classifier head on its own, with layer names matching create_model"""
+    from train_model import build_head
+
+    inputs = tf.keras.Input(shape=(feature_dim,))
+    outputs = build_head(inputs, num_classes, dense_units, dropout_rate)
+    return tf.keras.Model(inputs, outputs)
+
+def features_dataset(features, labels, num_classes, training, batch_size=None):
+    batch_size = batch_size or config.BATCH_SIZE
+    ds = tf.data.Dataset.from_tensor_slices((features, labels))
+    if training:
+        ds = ds.shuffle(len(labels), seed=config.RANDOM_SEED, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    ds = ds.map(lambda x, y: (tf.cast(x, tf.float32), tf.one_hot(y, num_classes)))
+    return ds.prefetch(AUTOTUNE)
+
+def prepare_features(base_model=None, class_names=None, views=None):
+    """Build or top up the feature store for train/val; returns datasets' raw arrays"""
+    class_names = class_names or get_class_names()
+    views = views or config.FEATURE_CACHE_VIEWS
+    extractor = build_feature_extractor(base_model)
+    store = FeatureStore(store_dir(extractor), extractor.output_shape[-1])
+
+    train = load_split_features('train', extractor, store, class_names, views)
+    val = load_split_features('val', extractor, store, class_names, 1)
+    print(f"✅ Feature store: {len(store)} rows in {store.directory}")
+    return train, val
+
+def train_head(train, val, num_classes, callbacks=None, dense_units=None, dropout_rate=None,
+               epochs=None, learning_rate=None, verbose=1):
+    """Fit the Dense/BN/Dropout head on cached features"""
+    from tensorflow.keras.metrics import TopKCategoricalAccuracy
+
+    (x_train, y_train), (x_val, y_val) = train, val
+    head = build_head_model(x_train.shape[1], num_classes, dense_units, dropout_rate)
+    head.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate or config.LEARNING_RATE),
+        loss='categorical_crossentropy',
+        metrics=['accuracy', TopKCategoricalAccuracy(k=3)]
+    )
+    history = head.fit(
+        features_dataset(x_train, y_train, num_classes, training=True),
+        epochs=epochs or config.INITIAL_EPOCHS,
+        validation_data=features_dataset(x_val, y_val, num_classes, training=False),
+        callbacks=callbacks or [],
+        verbose=verbose
+    )
+    return head, history
+
+def copy_head_weights(head, model):
+    """Load trained head weights into the full model's identically named layers"""
+    for layer in head.layers:
+        if layer.weights:
+            model.get_layer(layer.name).set_weights(layer.get_weights())
+
+if __name__ == "__main__":
+    import argparse
+    import itertools
+
+    parser = argparse.ArgumentParser(description="Build the feature cache and sweep head hyperparameters")
+    parser.add_argument('--dense-units', default=str(config.DENSE_UNITS), help="Comma-separated values")
+    parser.add_argument('--dropout', default=str(config.DROPOUT_RATE), help="Comma-separated values")
+    parser.add_argument('--epochs', type=int, default=config.INITIAL_EPOCHS)
+    args = parser.parse_args()
+
+    class_names = get_class_names()
+    train, val = prepare_features(class_names=class_names)
+
+    results = []
+    for units, rate in itertools.product([int(v) for v in args.dense_units.split(',')],
+                                         [float(v) for v in args.dropout.split(',')]):
+        stop = tf.keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=config.EARLY_STOPPING_PATIENCE,
+                                                restore_best_weights=True)
+        _, history = train_head(train, val, len(class_names), [stop], units, rate, args.epochs, verbose=0)
+        best = max(history.history['val_accuracy'])
+        results.append((units, rate, best))
+        print(f"📊 DENSE_UNITS={units} DROPOUT_RATE={rate}: val_accuracy={best:.4f}")
+
+    units, rate, best = max(results, key=lambda r: r[2])
+    print(f"🏆 Best: DENSE_UNITS={units} DROPOUT_RATE={rate} ({best:.4f})")
@@ -0,0 +1,155 @@
+import fcntl
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import config
+from split_dataset import SPLITS, load_resized
+
+class ImageCache:
+    """One split's images pre-resized to IMG_SIZE, as uint8 rows of a memory-mapped file
+
+    images-<generation>.bin holds img_size x img_size x 3 pixels per row and
+    index.json maps each source path to its row, label, size and mtime. A
+    changed source file is decoded again into a new row and a different
+    IMG_SIZE starts the file over. Rows left behind by removed or changed
+    files are compacted into the next generation's file once they
+    outnumber the live ones; the index switches to it in one rename.
+    """
+
+    def __init__(self, split, img_size=None, directory=None):
+        self.split = split
+        self.img_size = img_size or config.IMG_SIZE
+        self.directory = os.path.join(directory or config.IMAGE_CACHE_DIR, split)
+        self.index_path = os.path.join(self.directory, 'index.json')
+        self.row_bytes = self.img_size * self.img_size * 3
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Read the index; never writes, since another process may be inside update()"""
+        self.entries, self.rows, self.generation, self.cached_size = {}, 0, 0, None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            self.generation, self.cached_size = index['generation'], index['img_size']
+            if index['img_size'] == self.img_size:
+                self.entries, self.rows = index['entries'], index['rows']
+
+    def _repair(self):
+        """Start over at a new IMG_SIZE and drop rows written after the last index save (lock held)"""
+        if self.cached_size not in (None, self.img_size):
+            print(f"♻️  {self.split} image cache is {self.cached_size}px, rebuilding at {self.img_size}px")
+        with open(self.data_path, 'ab') as f:
+            f.truncate(self.rows * self.row_bytes)
+        if not self.entries:
+            self._save()
+        self.cached_size = self.img_size
+
+    @property
+    def data_path(self):
+        return os.path.join(self.directory, f'images-{self.generation}.bin')
+
+    def _save(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'split': self.split, 'img_size': self.img_size, 'generation': self.generation,
+                       'rows': self.rows, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def stale(self, paths):
+        """Paths with no row yet or whose file changed since it was cached"""
+        todo = []
+        for path in paths:
+            st = os.stat(path)
+            entry = self.entries.get(path)
+            if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime_ns:
+                todo.append(path)
+        return todo
+
+    def update(self, paths, labels, workers=None):
+        """Decode whatever is missing or stale, in parallel; returns (rows, labels) of readable images
+
+        Holds a lock on the split so several processes (e.g. distributed
+        workers) can call this at once and only one of them decodes.
+        """
+        workers = workers or config.SPLIT_WORKERS
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._load()
+            self._repair()
+            todo = self.stale(paths)
+            if todo:
+                print(f"🖼️  Caching {len(todo)} {self.split} images at {self.img_size}px...")
+                with ProcessPoolExecutor(max_workers=workers) as pool, open(self.data_path, 'ab') as f:
+                    pixels = pool.map(load_resized, todo, [self.img_size] * len(todo), chunksize=32)
+                    for i, (path, data) in enumerate(zip(todo, pixels), 1):
+                        st = os.stat(path)
+                        entry = {'row': -1, 'size': st.st_size, 'mtime': st.st_mtime_ns}
+                        if data is None:
+                            print(f"⚠️  Skipping unreadable image: {path}")
+                        else:
+                            f.write(data)
+                            entry['row'] = self.rows
+                            self.rows += 1
+                        self.entries[path] = entry
+                        # Keep progress if interrupted
+                        if i % 1024 == 0:
+                            f.flush()
+                            self._save()
+
+            for path, label in zip(paths, labels):
+                self.entries[path]['label'] = int(label)
+            live = set(paths)
+            self.entries = {path: entry for path, entry in self.entries.items() if path in live}
+            if self.rows > 2 * len(self.entries):
+                self.compact()
+            self._save()
+
+        kept = [self.entries[path] for path in paths if self.entries[path]['row'] >= 0]
+        return (np.array([e['row'] for e in kept], dtype=np.int64),
+                np.array([e['label'] for e in kept], dtype=np.int32))
+
+    def compact(self):
+        """Copy the rows still referenced by the index into the next generation's file"""
+        images, old_path = self.images(), self.data_path
+        self.generation += 1
+        rows = 0
+        with open(self.data_path, 'wb') as f:
+            for entry in self.entries.values():
+                if entry['row'] >= 0:
+                    f.write(images[entry['row']].tobytes())
+                    entry['row'] = rows
+                    rows += 1
+        del images
+        print(f"🧹 Compacted {self.split} image cache: {self.rows} → {rows} rows")
+        self.rows = rows
+        self._save()
+        # Readers that already mapped the old file keep it until they close it
+        os.remove(old_path)
+
+    def images(self):
+        """(rows, img_size, img_size, 3) uint8 memory map"""
+        if self.rows == 0:
+            return np.zeros((0, self.img_size, self.img_size, 3), dtype=np.uint8)
+        return np.memmap(self.data_path, dtype=np.uint8, mode='r',
+                         shape=(self.rows, self.img_size, self.img_size, 3))
+
+def load_split_cache(split, class_names=None, workers=None):
+    """Bring a split's cache up to date; returns (cache, rows, labels)"""
+    from data_pipeline import list_split_files
+
+    paths, labels = list_split_files(split, class_names)
+    cache = ImageCache(split)
+    rows, labels = cache.update(paths, labels, workers)
+    return cache, rows, labels
+
+def build_image_cache(splits=None, workers=None):
+    """Cache every split up front so the first training epoch does not decode either"""
+    from data_pipeline import get_class_names
+
+    class_names = get_class_names()
+    for split in splits or SPLITS:
+        cache, rows, _ = load_split_cache(split, class_names, workers)
+        size_mb = cache.rows * cache.row_bytes / 2 ** 20
+        print(f"🗃️  {split}: {len(rows)} images cached in {cache.directory} ({size_mb:.0f} MB)")
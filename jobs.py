@@ -0,0 +1,223 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import config
+from metrics import trace
+from predict import IMAGE_EXTENSIONS
+from preprocessing import load_image, new_batch_buffer
+
+class QueueFull(Exception):
+    """Too many images are already waiting; the client should retry later"""
+
+class UploadTooLarge(Exception):
+    """More images, or a larger image, than one job accepts"""
+
+def expand_uploads(files, max_images=None, max_image_bytes=None):
+    """(filename, bytes) pairs from uploaded files, unpacking any zip archives
+
+    Limits are enforced while unpacking, on the bytes actually inflated
+    rather than the sizes the archive claims, so a zip bomb is refused
+    before it fills memory.
+    """
+    max_images = max_images or config.JOB_MAX_IMAGES
+    max_image_bytes = max_image_bytes or config.JOB_MAX_IMAGE_BYTES
+    images = []
+
+    def add(name, data):
+        if len(data) > max_image_bytes:
+            raise UploadTooLarge(f"{name} is larger than {max_image_bytes // 2 ** 20} MB")
+        if len(images) >= max_images:
+            raise UploadTooLarge(f"More than {max_images} images in one job")
+        images.append((name, data))
+
+    for name, data in files:
+        if name.lower().endswith('.zip') or zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    if info.file_size > max_image_bytes:
+                        raise UploadTooLarge(f"{info.filename} is larger than {max_image_bytes // 2 ** 20} MB")
+                    with archive.open(info) as f:
+                        add(info.filename, f.read(max_image_bytes + 1))
+        else:
+            add(name, data)
+    return images
+
+class JobStore:
+    """Job progress and per-image results in sqlite, readable from every worker process"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs "
+                     "(id TEXT PRIMARY KEY, created REAL NOT NULL, total INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS job_results "
+                     "(seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, idx INTEGER NOT NULL, "
+                     "filename TEXT, predictions TEXT, error TEXT, finished REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS job_results_job ON job_results (job_id, seq)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id, total):
+        conn = self._conn()
+        conn.execute("INSERT INTO jobs (id, created, total) VALUES (?, ?, ?)", (job_id, time.time(), total))
+        conn.commit()
+
+    def add_result(self, job_id, index, filename, predictions=None, error=None):
+        conn = self._conn()
+        conn.execute("INSERT INTO job_results (job_id, idx, filename, predictions, error, finished) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     (job_id, index, filename, json.dumps(predictions) if predictions is not None else None,
+                      error, time.time()))
+        conn.commit()
+
+    def get(self, job_id, after=0):
+        """Job summary plus the results completed after sequence number `after`"""
+        conn = self._conn()
+        job = conn.execute("SELECT created, total FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        created, total = job
+        completed, failed = conn.execute(
+            "SELECT COUNT(*), COUNT(error) FROM job_results WHERE job_id = ?", (job_id,)).fetchone()
+        rows = conn.execute("SELECT seq, idx, filename, predictions, error FROM job_results "
+                            "WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after)).fetchall()
+        results = [{
+            'seq': seq,
+            'index': idx,
+            'filename': filename,
+            'predictions': json.loads(predictions) if predictions else None,
+            'error': error
+        } for seq, idx, filename, predictions, error in rows]
+        return {
+            'job_id': job_id,
+            'status': 'done' if completed >= total else ('running' if completed else 'queued'),
+            'total': total,
+            'completed': completed,
+            'failed': failed,
+            'created': created,
+            'results': results
+        }
+
+    def purge(self, ttl):
+        cutoff = time.time() - ttl
+        conn = self._conn()
+        conn.execute("DELETE FROM job_results WHERE job_id IN (SELECT id FROM jobs WHERE created < ?)", (cutoff,))
+        conn.execute("DELETE FROM jobs WHERE created < ?", (cutoff,))
+        conn.commit()
+
+class JobManager:
+    """Runs bulk prediction jobs in the background through the server's micro-batcher
+
+    Decode threads fill one row buffer per image and hand it to the batcher
+    without waiting, so images from a job (and concurrent /predict traffic)
+    are coalesced into full batches. Images still waiting count against
+    max_pending; submit() raises QueueFull beyond it. Each job runs on the
+    model version the router picks for it; images not started when that
+    version is swapped out go to the router's current pick instead.
+    """
+
+    def __init__(self, router, format_fn, store=None, cache=None, workers=None, max_pending=None):
+        self.router = router
+        self.format_fn = format_fn
+        self._store = store
+        self.cache = cache
+        self.max_pending = max_pending or config.JOB_MAX_PENDING_IMAGES
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers or config.JOB_WORKERS,
+                                            thread_name_prefix="job-worker")
+        # Results are written off the batcher thread so sqlite commits never delay a batch
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-writer")
+        self._submitted = 0
+
+    @property
+    def store(self):
+        # Opened on first use, so starting the app writes nothing under cache/
+        if self._store is None:
+            self._store = JobStore(config.JOB_DB_PATH)
+        return self._store
+
+    def submit(self, images):
+        """Queue (filename, bytes) pairs as a new job and return its id"""
+        with self._lock:
+            if self.pending + len(images) > self.max_pending:
+                raise QueueFull(f"{self.pending} images pending, limit {self.max_pending}")
+            self.pending += len(images)
+            self._submitted += 1
+            purge = self._submitted % 100 == 0
+
+        server = self.router.choose()
+        job_id = uuid.uuid4().hex
+        try:
+            self.store.create(job_id, len(images))
+        except Exception:
+            with self._lock:
+                self.pending -= len(images)
+            raise
+        for index, (filename, data) in enumerate(images):
+            self._executor.submit(self._process, server, job_id, index, filename, data)
+        if purge:
+            self.store.purge(config.JOB_TTL)
+        return job_id
+
+    def _process(self, server, job_id, index, filename, data):
+        # A retired server's batcher stops after MODEL_RETIRE_GRACE_S
+        if server not in self.router.servers:
+            server = self.router.choose()
+        try:
+            cache_key = self.cache.key(data, server.version) if self.cache else None
+            predictions = self.cache.get(cache_key) if self.cache else None
+            if predictions is None:
+                x = new_batch_buffer(1, server.input_size)[0]
+                with trace('decode', 'jobs'):
+                    load_image(data, server.input_size, x)
+                future = server.batcher.submit(x)
+        except Exception as e:
+            self._finish(job_id, index, filename, error=f"Failed to process image: {e}")
+            return
+        if predictions is not None:
+            self._finish(job_id, index, filename, predictions)
+            return
+
+        def done(future):
+            try:
+                predictions = self.format_fn(future.result(), server.class_names)
+                if self.cache:
+                    self.cache.put(cache_key, predictions)
+            except Exception as e:
+                self._finish(job_id, index, filename, error=f"Prediction failed: {e}")
+                return
+            self._finish(job_id, index, filename, predictions)
+
+        future.add_done_callback(lambda future: self._writer.submit(done, future))
+
+    def _finish(self, job_id, index, filename, predictions=None, error=None):
+        try:
+            self.store.add_result(job_id, index, filename, predictions, error)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def get(self, job_id, after=0):
+        return self.store.get(job_id, after)
+
+    def stats(self):
+        with self._lock:
+            return {'pending_images': self.pending, 'max_pending_images': self.max_pending}
@@ -0,0 +1,198 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers sub-millisecond decode up to slow cold-start requests
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class Registry:
+    """Collection of metrics rendered together in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _pairs(self, key):
+        return list(zip(self.labelnames, key))
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self._pairs(key))} {_number(value)}"
+
+class Gauge(_Metric):
+    """Value that goes up and down; unlabelled gauges can read a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                yield f"{self.name} {_number(self._function())}"
+            except Exception:
+                pass
+            return
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(self._pairs(key))} {_number(value)}"
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            pairs = self._pairs(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(pairs)} {_number(total)}"
+            yield f"{self.name}_count{_labels(pairs)} {cumulative}"
+
+# Serving and prediction metrics, shared by app.py, batcher.py, model_server.py,
+# prediction_cache.py, predict.py and cascade.py
+REQUESTS = Counter('cattle_http_requests_total', 'HTTP requests by endpoint and status code',
+                   ('endpoint', 'status'))
+REQUEST_SECONDS = Histogram('cattle_http_request_seconds', 'End-to-end request latency', ('endpoint',))
+STAGE_SECONDS = Histogram('cattle_stage_seconds',
+                          'Time per processing stage (read, decode, inference, encode, ...)',
+                          ('component', 'stage'))
+BATCH_SIZE = Histogram('cattle_batch_size', 'Images per micro-batched forward pass',
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+QUEUE_WAIT_SECONDS = Histogram('cattle_batch_queue_wait_seconds', 'Time an image waits in the batcher queue')
+QUEUE_DEPTH = Gauge('cattle_batch_queue_depth', 'Images waiting in the batcher queue')
+CACHE_LOOKUPS = Counter('cattle_prediction_cache_lookups_total', 'Prediction cache lookups by result',
+                        ('result',))
+MODEL_LOAD_SECONDS = Gauge('cattle_model_load_seconds', 'Model startup time by phase (load, warmup)',
+                           ('phase',))
+MODEL_READY = Gauge('cattle_model_ready', '1 once the model is loaded and warmed up')
+VERSION_REQUESTS = Counter('cattle_model_requests_total', '/predict requests answered per model version',
+                           ('version',))
+VERSION_SECONDS = Histogram('cattle_model_request_seconds', '/predict latency per model version', ('version',))
+VERSION_CONFIDENCE = Histogram('cattle_model_top1_confidence', 'Top-1 confidence per model version', ('version',),
+                               buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99))
+CASCADE_IMAGES = Counter('cattle_cascade_images_total',
+                         'Cascade predictions answered by the small model or escalated to the full one', ('result',))
+JOBS_PENDING = Gauge('cattle_jobs_pending_images', 'Images queued by /jobs and not yet finished')
+
+_trace_hooks = []
+
+def add_trace_hook(hook):
+    """Call hook(component, stage, seconds) for every traced stage, e.g. to log slow images"""
+    _trace_hooks.append(hook)
+
+def remove_trace_hook(hook):
+    _trace_hooks.remove(hook)
+
+def observe_stage(component, stage, seconds):
+    STAGE_SECONDS.observe(seconds, component=component, stage=stage)
+    for hook in list(_trace_hooks):
+        hook(component, stage, seconds)
+
+@contextmanager
+def trace(stage, component='server'):
+    """Time a block as one stage: `with trace('decode'): ...`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(component, stage, time.perf_counter() - start)
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,383 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+import numpy as np
+import config
+from metrics import VERSION_CONFIDENCE, VERSION_REQUESTS, VERSION_SECONDS
+from model_server import ModelServer
+
+MANIFEST_NAME = 'manifest.json'
+ROUTING_NAME = 'routing.json'
+
+def file_checksum(path):
+    """sha256 of a model file, or of every file (name + contents) in a SavedModel directory"""
+    h = hashlib.sha256()
+    paths = [path]
+    if os.path.isdir(path):
+        paths = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            paths += [os.path.join(root, name) for name in sorted(files)]
+    for file_path in paths:
+        if file_path != path:
+            h.update(os.path.relpath(file_path, path).encode())
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+def default_model_path(backend):
+    if backend == 'keras':
+        return config.BEST_MODEL_PATH if os.path.exists(config.BEST_MODEL_PATH) else config.MODEL_PATH
+    if backend == 'savedmodel':
+        return config.SAVED_MODEL_DIR
+    if backend == 'tflite':
+        return config.TFLITE_MODEL_PATH
+    raise ValueError(f"Unknown inference backend '{backend}'")
+
+def list_versions(registry_dir=None):
+    """Published versions, oldest first"""
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(name for name in os.listdir(registry_dir)
+                  if os.path.exists(os.path.join(registry_dir, name, MANIFEST_NAME)))
+
+def read_manifest(version, registry_dir=None):
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    with open(os.path.join(registry_dir, version, MANIFEST_NAME), 'r') as f:
+        return json.load(f)
+
+def verify(manifest, registry_dir=None):
+    """Raise if the model on disk does not match the manifest checksum"""
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    path = os.path.join(registry_dir, manifest['version'], manifest['model_file'])
+    if file_checksum(path) != manifest['checksum']:
+        raise ValueError(f"Checksum mismatch for model version {manifest['version']}")
+
+def publish(backend=None, model_path=None, labels_path=None, class_indices_path=None, input_size=None,
+            metrics=None, registry_dir=None, activate=False):
+    """Copy a trained model, its labels and class indices into a new registry version
+
+    Files are staged in a temporary directory and renamed into place, so a
+    watcher never sees a half-written version. Returns the version name.
+    """
+    backend = backend or config.INFERENCE_BACKEND
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    model_path = model_path or default_model_path(backend)
+    labels_path = labels_path or config.LABELS_PATH
+    class_indices_path = class_indices_path or config.CLASS_INDICES_PATH
+    os.makedirs(registry_dir, exist_ok=True)
+
+    staging = os.path.join(registry_dir, f".staging-{uuid.uuid4().hex}")
+    os.makedirs(staging)
+    model_file = os.path.basename(model_path.rstrip('/'))
+    if os.path.isdir(model_path):
+        shutil.copytree(model_path, os.path.join(staging, model_file))
+    else:
+        shutil.copy2(model_path, os.path.join(staging, model_file))
+    shutil.copy2(labels_path, os.path.join(staging, 'labels.txt'))
+    has_indices = os.path.exists(class_indices_path)
+    if has_indices:
+        shutil.copy2(class_indices_path, os.path.join(staging, 'class_indices.json'))
+
+    manifest = {
+        'backend': backend,
+        'model_file': model_file,
+        'labels_file': 'labels.txt',
+        'class_indices_file': 'class_indices.json' if has_indices else None,
+        'input_size': input_size or config.IMG_SIZE,
+        'checksum': file_checksum(os.path.join(staging, model_file)),
+        'created': time.time(),
+        'source': model_path,
+        'metrics': metrics or {},
+    }
+
+    # Claim the next version number; a concurrent publish makes the rename fail and we retry
+    while True:
+        versions = list_versions(registry_dir)
+        version = f"v{int(versions[-1][1:]) + 1 if versions else 1:04d}"
+        manifest['version'] = version
+        with open(os.path.join(staging, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        try:
+            os.rename(staging, os.path.join(registry_dir, version))
+            break
+        except OSError:
+            if not os.path.exists(os.path.join(registry_dir, version)):
+                raise
+
+    print(f"📦 Published model {version} ({backend}) to {registry_dir}")
+    if activate:
+        set_routes({version: 100}, registry_dir)
+    return version
+
+def set_routes(weights, registry_dir=None):
+    """Route traffic between versions, e.g. {'v0003': 90, 'v0004': 10}"""
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    known = set(list_versions(registry_dir))
+    for version, weight in weights.items():
+        if version not in known:
+            raise ValueError(f"Unknown model version '{version}'")
+        if weight < 0:
+            raise ValueError(f"Negative weight for '{version}'")
+    if not any(weights.values()):
+        raise ValueError("At least one version needs a positive weight")
+
+    path = os.path.join(registry_dir, ROUTING_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'weights': weights, 'updated': time.time()}, f, indent=2)
+    os.replace(tmp_path, path)
+
+def read_routes(registry_dir=None):
+    """{version: weight} from routing.json, else 100% on the newest version, else {} (no registry)"""
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    path = os.path.join(registry_dir, ROUTING_NAME)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            weights = json.load(f)['weights']
+        return {version: weight for version, weight in sorted(weights.items()) if weight > 0}
+    versions = list_versions(registry_dir)
+    return {versions[-1]: 100} if versions else {}
+
+def primary_version(registry_dir=None):
+    """The routed version with the largest weight, or None without a registry"""
+    routes = read_routes(registry_dir)
+    return max(routes, key=routes.get) if routes else None
+
+def active_model_paths(registry_dir=None):
+    """Model files of the versions currently receiving traffic"""
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    paths = []
+    for version in read_routes(registry_dir):
+        manifest = read_manifest(version, registry_dir)
+        paths.append((manifest['backend'], os.path.join(registry_dir, version, manifest['model_file'])))
+    return paths
+
+def server_for(version, registry_dir=None):
+    """Unloaded ModelServer for one registry version (checksum verified)"""
+    registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+    manifest = read_manifest(version, registry_dir)
+    verify(manifest, registry_dir)
+    version_dir = os.path.join(registry_dir, version)
+    return ModelServer(
+        backend=manifest['backend'],
+        model_path=os.path.join(version_dir, manifest['model_file']),
+        labels_path=os.path.join(version_dir, manifest['labels_file']),
+        name=version
+    )
+
+class VersionStats:
+    """Request count, recent latency percentiles and confidence for one model version"""
+
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.confidence_total = 0.0
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, confidence):
+        with self._lock:
+            self.requests += 1
+            self.confidence_total += confidence
+            self.latencies.append(seconds)
+
+    def summary(self):
+        with self._lock:
+            latencies = np.asarray(self.latencies)
+            return {
+                'requests': self.requests,
+                'mean_top1_confidence': self.confidence_total / self.requests if self.requests else None,
+                'latency_p50_ms': float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+                'latency_p95_ms': float(np.percentile(latencies, 95) * 1000) if len(latencies) else None,
+            }
+
+class ModelRouter:
+    """Weighted routing over the registry's active versions, with hot swap
+
+    A watcher thread polls the registry; when routing.json or the set of
+    versions changes, new versions are loaded and warmed on that thread,
+    then the (servers, weights) tuple is replaced in a single assignment.
+    Requests already holding the old server finish on it; retired servers
+    stop after MODEL_RETIRE_GRACE_S. With no registry, the router serves
+    the legacy ModelServer() from config paths.
+    """
+
+    def __init__(self, registry_dir=None, poll_s=None):
+        self.registry_dir = registry_dir or config.MODEL_REGISTRY_DIR
+        self.poll_s = config.MODEL_REGISTRY_POLL_S if poll_s is None else poll_s
+        self._active = ((), ())  # (servers, cumulative weights), swapped atomically
+        self._weights = {}
+        self._signature = None
+        self._failed_signature = None
+        self._stats = {}
+        self._reload_lock = threading.Lock()
+        self.error = None
+        self.swaps = 0
+
+    def _current_signature(self):
+        routing = os.path.join(self.registry_dir, ROUTING_NAME)
+        mtime = os.path.getmtime(routing) if os.path.exists(routing) else None
+        return mtime, tuple(list_versions(self.registry_dir))
+
+    def refresh(self):
+        """Load and swap in the routed versions if the registry changed; returns True on swap"""
+        with self._reload_lock:
+            signature = self._current_signature()
+            if signature in (self._signature, self._failed_signature):
+                return False
+            routes = read_routes(self.registry_dir) or {'default': 1}
+            if routes == self._weights:
+                self._signature = signature
+                return False
+
+            loaded = {server.name: server for server in self._active[0]}
+            servers = []
+            try:
+                for version in routes:
+                    server = loaded.get(version)
+                    if server is None:
+                        print(f"🔄 Loading model version {version}...")
+                        server = ModelServer() if version == 'default' else server_for(version, self.registry_dir)
+                        server.load()
+                    servers.append(server)
+            except Exception:
+                # Don't retry until the registry changes again
+                self._failed_signature = signature
+                raise
+
+            cumulative = tuple(np.cumsum([routes[server.name] for server in servers]).tolist())
+            retired = [server for name, server in loaded.items() if name not in routes]
+            self._active = (tuple(servers), cumulative)
+            self._weights = routes
+            self._signature = signature
+            self.error = None
+            self.swaps += 1
+            print(f"✅ Serving {', '.join(f'{v} ({w})' for v, w in routes.items())}")
+
+            for server in retired:
+                timer = threading.Timer(config.MODEL_RETIRE_GRACE_S, server.stop)
+                timer.daemon = True
+                timer.start()
+            return True
+
+    def load(self):
+        """Load the routed versions now (STARTUP_MODE='eager'), then keep watching"""
+        self.refresh()
+        self.start_watcher()
+        return self
+
+    def start_background_load(self):
+        thread = threading.Thread(target=self._watch, args=(True,), name="model-watcher", daemon=True)
+        thread.start()
+        return thread
+
+    def start_watcher(self):
+        thread = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+        thread.start()
+        return thread
+
+    def _watch(self, load_first=False):
+        if not load_first:
+            time.sleep(self.poll_s)
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the current versions; retry on the next poll
+                self.error = str(e)
+                logging.error("Model registry reload failed", exc_info=True)
+            if not self.poll_s:
+                return
+            time.sleep(self.poll_s)
+
+    @property
+    def servers(self):
+        return self._active[0]
+
+    def choose(self):
+        """Pick a server for one request in proportion to its weight"""
+        servers, cumulative = self._active
+        if len(servers) <= 1:
+            return servers[0] if servers else None
+        return servers[bisect.bisect_right(cumulative, random.random() * cumulative[-1])]
+
+    def primary(self):
+        """The server with the largest share of traffic"""
+        servers, _ = self._active
+        if not servers:
+            return None
+        return max(servers, key=lambda server: self._weights.get(server.name, 0))
+
+    @property
+    def ready(self):
+        servers = self._active[0]
+        return bool(servers) and all(server.ready for server in servers)
+
+    def record(self, server, seconds, confidence):
+        stats = self._stats.get(server.name)
+        if stats is None:
+            stats = self._stats.setdefault(server.name, VersionStats())
+        stats.record(seconds, confidence)
+        VERSION_REQUESTS.inc(version=server.name)
+        VERSION_SECONDS.observe(seconds, version=server.name)
+        VERSION_CONFIDENCE.observe(confidence, version=server.name)
+
+    def queue_depth(self):
+        return sum(server.batcher.queue_depth() for server in self.servers if server.batcher)
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'error': self.error,
+            'swaps': self.swaps,
+            'versions': [{**server.status(), 'version': server.name, 'weight': self._weights.get(server.name)}
+                         for server in self.servers],
+        }
+
+    def stats(self):
+        return {
+            server.name: {
+                'weight': self._weights.get(server.name),
+                'model_version': server.version,
+                'batcher': server.batcher.stats() if server.batcher else None,
+                **(self._stats[server.name].summary() if server.name in self._stats else VersionStats().summary()),
+            }
+            for server in self.servers
+        }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Publish model versions and route traffic between them")
+    sub = parser.add_subparsers(dest='command', required=True)
+    pub = sub.add_parser('publish', help="Copy the current trained model into a new version")
+    pub.add_argument('--backend', choices=['keras', 'savedmodel', 'tflite'], help="Default: config.INFERENCE_BACKEND")
+    pub.add_argument('--model', help="Model file or SavedModel directory (default: per backend from config)")
+    pub.add_argument('--activate', action='store_true', help="Send all traffic to the new version")
+    sub.add_parser('list', help="Show versions and current routing")
+    route = sub.add_parser('route', help="Set traffic weights, e.g. v0003=90 v0004=10")
+    route.add_argument('weights', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        publish(args.backend, args.model, activate=args.activate)
+    elif args.command == 'route':
+        set_routes({v: float(w) for v, w in (item.split('=') for item in args.weights)})
+        print(f"🔀 Routing: {read_routes()}")
+    else:
+        routes = read_routes()
+        for version in list_versions():
+            manifest = read_manifest(version)
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(manifest['created']))
+            print(f"{version}  {manifest['backend']:10s} {created}  {manifest['checksum'][:12]}  "
+                  f"weight={routes.get(version, 0)}")
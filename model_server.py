@@ -0,0 +1,120 @@
+import threading
+import time
+import numpy as np
+import config
+from backends import load_backend
+from batcher import MicroBatcher
+from metrics import MODEL_LOAD_SECONDS, MODEL_READY, trace
+from prediction_cache import model_version
+from preprocessing import load_image, new_batch_buffer
+
+class ModelServer:
+    """One loaded model: backend, labels, micro-batcher and readiness state
+
+    Nothing heavy happens in the constructor; load() imports TensorFlow (via
+    the backend), loads weights, starts the batcher and runs warm-up batches
+    so graph tracing and tensor allocation are paid before traffic arrives.
+    """
+
+    def __init__(self, backend=None, model_path=None, labels_path=None, name='default'):
+        self.name = name
+        self.backend = backend or config.INFERENCE_BACKEND
+        self.model_path = model_path
+        self.labels_path = labels_path or config.LABELS_PATH
+        self.model = None
+        self.batcher = None
+        self.class_names = None
+        self.input_size = config.IMG_SIZE
+        self.version = None
+        self.ready = False
+        self.error = None
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load model and labels, then warm up; safe to call from any thread"""
+        with self._lock:
+            if self.ready:
+                return self
+            try:
+                start = time.perf_counter()
+                self.model = load_backend(self.backend, self.model_path)
+                self.input_size = self.model.input_size or config.IMG_SIZE
+                with open(self.labels_path, 'r') as f:
+                    self.class_names = [line.strip() for line in f.readlines()]
+                self.version = f"{self.model.name}-{model_version(self.model.model_path)}"
+                self.timings['load_s'] = time.perf_counter() - start
+                MODEL_LOAD_SECONDS.set(self.timings['load_s'], phase='load')
+
+                # Coalesce concurrent requests into batched forward passes
+                self.batcher = MicroBatcher(
+                    self.model.predict,
+                    max_batch_size=config.BATCH_MAX_SIZE,
+                    max_wait_ms=config.BATCH_MAX_WAIT_MS
+                )
+
+                start = time.perf_counter()
+                self.warm_up()
+                self.timings['warmup_s'] = time.perf_counter() - start
+                MODEL_LOAD_SECONDS.set(self.timings['warmup_s'], phase='warmup')
+                self.ready = True
+                MODEL_READY.set(1)
+            except Exception as e:
+                self.error = str(e)
+                raise
+        return self
+
+    def start_background_load(self):
+        """Load on a daemon thread; readiness is reported through self.ready"""
+        thread = threading.Thread(target=self._load_quietly, name="model-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except Exception:
+            import logging
+            logging.error("Model loading failed", exc_info=True)
+
+    def warm_up(self):
+        """Push zero images through the batcher at each configured batch size
+
+        Going through the batcher (not the backend directly) warms the
+        thread that actually serves traffic, which matters for per-thread
+        TFLite interpreters.
+        """
+        blank = np.zeros((self.input_size, self.input_size, 3), dtype=np.float32)
+        for _ in range(config.WARMUP_ROUNDS):
+            for batch_size in config.WARMUP_BATCH_SIZES:
+                futures = [self.batcher.submit(blank) for _ in range(batch_size)]
+                for future in futures:
+                    future.result()
+
+    def preprocess(self, image_bytes):
+        x = new_batch_buffer(1, self.input_size)
+        load_image(image_bytes, self.input_size, x[0])
+        return x
+
+    def predict(self, image_bytes):
+        """Class probabilities for one uploaded image"""
+        with trace('decode'):
+            x = self.preprocess(image_bytes)
+        # Includes time queued in the batcher; the forward pass alone is stage 'inference' of component 'batcher'
+        with trace('inference'):
+            return self.batcher.predict(x[0])
+
+    def stop(self):
+        """Drain and stop the batcher once no request routes here any more"""
+        self.ready = False
+        if self.batcher:
+            self.batcher.stop()
+
+    def status(self):
+        return {
+            'ready': self.ready,
+            'backend': self.backend,
+            'model_version': self.version,
+            'error': self.error,
+            'timings': self.timings,
+        }
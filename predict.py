@@ -1,59 +1,156 @@
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
 import numpy as np
+import argparse
+import csv
 import json
 import os
-from PIL import Image
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import config
+from backends import BACKENDS, load_backend
+from metrics import trace
+from preprocessing import load_image, new_batch_buffer
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+def iter_image_paths(directory):
+    """Yield image paths under a directory in a stable order, without listing it all up front"""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+def load_scored_paths(output_path, output_format):
+    """Paths already written to an output file, so interrupted jobs can resume"""
+    scored = set()
+    if not os.path.exists(output_path):
+        return scored
+    
+    with open(output_path, 'r', newline='') as f:
+        if output_format == 'csv':
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if row:
+                    scored.add(row[0])
+        else:
+            for line in f:
+                try:
+                    scored.add(json.loads(line)['path'])
+                except (ValueError, KeyError):
+                    # Partial last line from a killed run
+                    continue
+    return scored
 
 class CattleBreedPredictor:
-    def __init__(self):
+    def __init__(self, backend=None, model_path=None, version=None, cascade=None):
+        self.backend = backend or config.INFERENCE_BACKEND
+        self.model_path = model_path
+        self.labels_path = config.LABELS_PATH
+        self.class_indices_path = config.CLASS_INDICES_PATH
+        self.version = None
+        if model_path is None:
+            self.use_registry_version(version, backend)
         self.model = None
         self.class_names = None
+        self.cascade = None
         self.load_model()
+        if config.CASCADE_ENABLED if cascade is None else cascade:
+            self.enable_cascade()
+    
+    def use_registry_version(self, version=None, backend=None):
+        """Point at a registry version (default: the one taking most traffic) instead of config paths"""
+        from model_registry import primary_version, read_manifest
+        
+        requested = version
+        version = version or primary_version()
+        if version is None:
+            return
+        manifest = read_manifest(version)
+        if backend and backend != manifest['backend']:
+            if requested:
+                raise ValueError(f"Registry version {version} is a '{manifest['backend']}' model, not '{backend}'")
+            return
+        version_dir = os.path.join(config.MODEL_REGISTRY_DIR, version)
+        self.version = version
+        self.backend = manifest['backend']
+        self.model_path = os.path.join(version_dir, manifest['model_file'])
+        self.labels_path = os.path.join(version_dir, manifest['labels_file'])
+        if manifest['class_indices_file']:
+            self.class_indices_path = os.path.join(version_dir, manifest['class_indices_file'])
     
     def load_model(self):
         """Load trained model and class names"""
         try:
-            # Load model
-            if os.path.exists(config.BEST_MODEL_PATH):
-                self.model = tf.keras.models.load_model(config.BEST_MODEL_PATH)
-            else:
-                self.model = tf.keras.models.load_model(config.MODEL_PATH)
+            # Load model through the selected backend (keras / savedmodel / tflite)
+            self.model = load_backend(self.backend, self.model_path)
+            self.input_size = self.model.input_size or config.IMG_SIZE
             
             # Load class names
-            if os.path.exists(config.CLASS_INDICES_PATH):
-                with open(config.CLASS_INDICES_PATH, 'r') as f:
+            if os.path.exists(self.class_indices_path):
+                with open(self.class_indices_path, 'r') as f:
                     class_indices = json.load(f)
                 self.class_names = {v: k for k, v in class_indices.items()}
                 self.class_names = [self.class_names[i] for i in range(len(self.class_names))]
             else:
-                with open(config.LABELS_PATH, 'r') as f:
+                with open(self.labels_path, 'r') as f:
                     self.class_names = [line.strip() for line in f.readlines()]
             
-            print(f"✅ Model loaded with {len(self.class_names)} classes")
+            source = f", registry version {self.version}" if self.version else ""
+            print(f"✅ Model loaded with {len(self.class_names)} classes ({self.model.name} backend{source})")
             
         except Exception as e:
             print(f"❌ Error loading model: {e}")
             raise
     
+    def enable_cascade(self):
+        """Decode at the small model's size and escalate only low-confidence images to the full model"""
+        from cascade import Cascade, load_threshold, small_model_path
+        from preprocessing import parallel_loader
+        
+        small = load_backend(self.backend, small_model_path(self.backend))
+        self.cascade = Cascade(small, self.model, load_threshold(), full_size=self.input_size,
+                               executor=parallel_loader())
+        self.input_size = small.input_size or config.CASCADE_IMG_SIZE
+        print(f"🪜 Cascade: {self.input_size}px small model first, full model below "
+              f"{self.cascade.threshold:.3f} confidence")
+    
+    def forward(self, batch, sources):
+        """Class probabilities for a decoded batch (through the cascade when enabled)"""
+        if self.cascade is None:
+            return self.model.predict(batch)
+        return self.cascade.run(batch, sources)
+    
+    def load_image(self, img_path, out=None):
+        """Decode and resize one image to a (H, W, 3) float32 array in [0, 1]"""
+        with trace('decode', 'predictor'):
+            return load_image(img_path, self.input_size, out)
+    
     def preprocess_image(self, img_path):
         """Preprocess image for prediction"""
         try:
-            img = Image.open(img_path)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            img = img.resize((config.IMG_SIZE, config.IMG_SIZE))
-            x = image.img_to_array(img)
-            x = np.expand_dims(x, axis=0)
-            x = x / 255.0
-            
+            x = new_batch_buffer(1, self.input_size)
+            self.load_image(img_path, x[0])
             return x
         except Exception as e:
             print(f"❌ Error preprocessing image: {e}")
             raise
     
+    def decode_predictions(self, predictions, top_k=5):
+        """Turn one row of class probabilities into the top K breeds"""
+        top_indices = np.argsort(predictions)[-top_k:][::-1]
+        
+        results = []
+        for idx in top_indices:
+            results.append({
+                'breed': self.class_names[idx],
+                'confidence': float(predictions[idx]),
+                'confidence_percent': float(predictions[idx] * 100)
+            })
+        
+        return results
+    
     def predict(self, img_path, top_k=5):
         """Predict breed from image"""
         try:
@@ -61,33 +158,186 @@ class CattleBreedPredictor:
             processed_img = self.preprocess_image(img_path)
             
             # Predict
-            predictions = self.model.predict(processed_img, verbose=0)
+            with trace('inference', 'predictor'):
+                predictions = self.forward(processed_img, [img_path])[0]
             
             # Get top K predictions
-            top_indices = np.argsort(predictions)[-top_k:][::-1]
-            
-            results = []
-            for idx in top_indices:
-                results.append({
-                    'breed': self.class_names[idx],
-                    'confidence': float(predictions[idx]),
-                    'confidence_percent': float(predictions[idx] * 100)
-                })
-            
-            return results
+            return self.decode_predictions(predictions, top_k)
         except Exception as e:
             print(f"❌ Prediction error: {e}")
             return None
+    
+    def predict_batch(self, img_paths, top_k=5, executor=None):
+        """Predict breeds for a list of images with one forward pass
+        
+        Returns one dict per input path, with 'predictions' or 'error'.
+        """
+        img_paths = list(img_paths)
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=config.PREDICT_WORKERS) as pool:
+                return self.predict_batch(img_paths, top_k, executor=pool)
+        
+        buffer = new_batch_buffer(len(img_paths), self.input_size)
+        decoded = [executor.submit(self.load_image, path, buffer[i]) for i, path in enumerate(img_paths)]
+        return self._predict_decoded(img_paths, decoded, buffer, top_k)
+    
+    def _predict_decoded(self, img_paths, decoded, buffer, top_k):
+        """Run the model on a batch buffer filled by decode futures, keeping per-image errors"""
+        errors = {}
+        for i, future in enumerate(decoded):
+            try:
+                future.result()
+            except Exception as e:
+                errors[i] = str(e)
+                buffer[i] = 0.0
+        
+        predictions = None
+        if len(errors) < len(img_paths):
+            with trace('inference', 'predictor'):
+                predictions = self.forward(buffer, [None if i in errors else path for i, path in enumerate(img_paths)])
+        
+        results = []
+        for i, path in enumerate(img_paths):
+            if i in errors:
+                results.append({'path': path, 'error': errors[i]})
+            else:
+                results.append({'path': path, 'predictions': self.decode_predictions(predictions[i], top_k)})
+        return results
+    
+    def iter_predictions(self, img_paths, top_k=5, batch_size=None, workers=None):
+        """Stream predictions for an iterable of paths
+        
+        Paths are consumed lazily and decoded in a thread pool while the
+        previous batch runs through the model, so memory stays bounded by
+        a couple of batches regardless of how many images there are.
+        Images are decoded straight into a ring of two batch buffers.
+        """
+        batch_size = batch_size or config.BATCH_SIZE
+        workers = workers or config.PREDICT_WORKERS
+        ring = new_batch_buffer(2 * batch_size, self.input_size)
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            paths = iter(img_paths)
+            exhausted = False
+            submitted = 0
+            
+            while True:
+                # Keep up to two batches of decodes in flight
+                while not exhausted and len(pending) < 2 * batch_size:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                        break
+                    slot = submitted % len(ring)
+                    pending.append((slot, path, pool.submit(self.load_image, path, ring[slot])))
+                    submitted += 1
+                
+                if not pending:
+                    return
+                
+                # A chunk always occupies contiguous slots in one half of the ring
+                chunk = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+                start = chunk[0][0]
+                yield from self._predict_decoded([p for _, p, _ in chunk], [f for _, _, f in chunk],
+                                                 ring[start:start + len(chunk)], top_k)
+    
+    def predict_directory(self, directory, output_path, output_format=None, top_k=5,
+                          batch_size=None, workers=None, resume=True):
+        """Classify every image under a directory, appending results as JSONL or CSV
+        
+        With resume=True, images already present in output_path are skipped.
+        """
+        if output_format is None:
+            output_format = 'csv' if output_path.lower().endswith('.csv') else 'jsonl'
+        
+        scored = load_scored_paths(output_path, output_format) if resume else set()
+        if scored:
+            print(f"⏭️  Skipping {len(scored)} already scored images")
+        
+        paths = (p for p in iter_image_paths(directory) if p not in scored)
+        mode = 'a' if resume else 'w'
+        is_empty = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        write_header = output_format == 'csv' and (mode == 'w' or is_empty)
+        
+        # A killed run can leave a partial last line; start on a fresh one
+        if mode == 'a' and not is_empty:
+            with open(output_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+            if needs_newline:
+                with open(output_path, 'a', newline='') as f:
+                    f.write('\n')
+        
+        count, errors = 0, 0
+        start = time.time()
+        with open(output_path, mode, newline='') as f:
+            writer = csv.writer(f) if output_format == 'csv' else None
+            if write_header:
+                header = ['path', 'error']
+                for i in range(1, top_k + 1):
+                    header += [f'breed_{i}', f'confidence_{i}']
+                writer.writerow(header)
+            
+            for i, result in enumerate(self.iter_predictions(paths, top_k, batch_size, workers), 1):
+                if output_format == 'csv':
+                    row = [result['path'], result.get('error', '')]
+                    for p in result.get('predictions', []):
+                        row += [p['breed'], f"{p['confidence']:.6f}"]
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(result) + '\n')
+                
+                count += 1
+                errors += 'error' in result
+                if i % (batch_size or config.BATCH_SIZE) == 0:
+                    f.flush()
+                if i % 1000 == 0:
+                    print(f"📊 {i} images scored ({i / (time.time() - start):.1f} img/s)")
+        
+        elapsed = time.time() - start
+        print(f"✅ Scored {count} images ({errors} errors) in {elapsed:.1f}s → {output_path}")
+        if self.cascade:
+            stats = self.cascade.stats()
+            saving = ''
+            if 'latency_saving' in stats:
+                saving = (f", {stats['end_to_end_ms_per_image']:.1f} vs {stats['full_only_ms_per_image']:.1f} ms/image "
+                          f"for the full model alone")
+            print(f"🪜 Cascade escalated {stats['escalated']}/{stats['images']} images "
+                  f"({stats['escalation_rate']:.1%}){saving}")
+        return count
 
 def main():
     """Test prediction"""
-    predictor = CattleBreedPredictor()
+    parser = argparse.ArgumentParser(description="Predict cattle breeds")
+    parser.add_argument('image', nargs='?', default="test_image.jpg", help="Image to classify")
+    parser.add_argument('--dir', help="Classify every image under this directory")
+    parser.add_argument('--output', default="predictions.jsonl", help="Output file for --dir (.jsonl or .csv)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="Output format (default: from extension)")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=config.BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=config.PREDICT_WORKERS, help="Decode threads")
+    parser.add_argument('--no-resume', action='store_true', help="Overwrite output instead of skipping scored files")
+    parser.add_argument('--backend', choices=BACKENDS, help="Inference backend")
+    parser.add_argument('--model-version', help="Registry version (default: the one taking most traffic)")
+    parser.add_argument('--cascade', action='store_true', default=None,
+                        help="Small model first, full model only when unsure (default: config.CASCADE_ENABLED)")
+    args = parser.parse_args()
+    
+    predictor = CattleBreedPredictor(backend=args.backend, version=args.model_version, cascade=args.cascade)
+    
+    if args.dir:
+        predictor.predict_directory(
+            args.dir, args.output, output_format=args.format, top_k=args.top_k,
+            batch_size=args.batch_size, workers=args.workers, resume=not args.no_resume
+        )
+        return
     
     # Test with an image
-    test_image = "test_image.jpg"  # Replace with your test image path
+    test_image = args.image
     
     if os.path.exists(test_image):
-        results = predictor.predict(test_image)
+        results = predictor.predict(test_image, top_k=args.top_k)
         
         print(f"\n📸 Predictions for: {test_image}")
         print("=" * 50)
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import config
+from metrics import CACHE_LOOKUPS
+
+def model_version(path):
+    """Short content fingerprint of a model file or SavedModel directory"""
+    h = hashlib.sha1()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                st = os.stat(file_path)
+                h.update(f"{os.path.relpath(file_path, path)}|{st.st_size}|{st.st_mtime_ns}".encode())
+    else:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()[:12]
+
+class SqliteCacheBackend:
+    """Shared cache in a local sqlite file, usable by several worker processes"""
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS predictions "
+                     "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS predictions_created ON predictions (created)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, ttl):
+        row = self._conn().execute("SELECT value, created FROM predictions WHERE key = ?", (key,)).fetchone()
+        if row is None or (ttl and time.time() - row[1] > ttl):
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)",
+                     (key, json.dumps(value), time.time()))
+        # Trim to size every so often rather than on every write
+        self._writes += 1
+        if self._writes % 100 == 0:
+            conn.execute("DELETE FROM predictions WHERE key IN (SELECT key FROM predictions "
+                         "ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        conn.commit()
+
+class FileCacheBackend:
+    """Shared cache as one small JSON file per key in a local directory"""
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key.replace(':', '_') + '.json')
+
+    def get(self, key, ttl):
+        file_path = self._file(key)
+        try:
+            if ttl and time.time() - os.path.getmtime(file_path) > ttl:
+                return None
+            with open(file_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        file_path = self._file(key)
+        tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, file_path)
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._trim()
+
+    def _trim(self):
+        """Remove the oldest files beyond max_entries"""
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.path, name)), name))
+                except OSError:
+                    continue
+        entries.sort(reverse=True)
+        for _, name in entries[self.max_entries:]:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+class PredictionCache:
+    """In-process LRU of predictions keyed by upload content hash + model version
+
+    Lookups fall through to an optional shared backend (sqlite or file) so
+    worker processes can reuse each other's results.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, backend=None):
+        self.max_entries = config.PREDICTION_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = config.PREDICTION_CACHE_TTL if ttl is None else ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image_bytes, version):
+        return f"{hashlib.sha256(image_bytes).hexdigest()}:{version}"
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self.ttl or now - created <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc(result='hit')
+                    return value
+                del self._entries[key]
+
+        value = self.backend.get(key, self.ttl) if self.backend else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(result='miss')
+                return None
+            self.shared_hits += 1
+            CACHE_LOOKUPS.inc(result='shared_hit')
+        self._store(key, value, now)
+        return value
+
+    def put(self, key, value):
+        self._store(key, value, time.time())
+        if self.backend:
+            self.backend.put(key, value)
+
+    def _store(self, key, value, created):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'backend': type(self.backend).__name__ if self.backend else None,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+def create_prediction_cache():
+    """PredictionCache configured from config.PREDICTION_CACHE_*"""
+    kind = config.PREDICTION_CACHE_BACKEND
+    shared_size = config.PREDICTION_CACHE_SHARED_SIZE
+    if kind == 'sqlite':
+        backend = SqliteCacheBackend(config.PREDICTION_CACHE_PATH, shared_size)
+    elif kind == 'file':
+        backend = FileCacheBackend(config.PREDICTION_CACHE_PATH, shared_size)
+    elif kind:
+        raise ValueError(f"Unknown prediction cache backend '{kind}', expected 'sqlite', 'file' or None")
+    else:
+        backend = None
+    return PredictionCache(backend=backend)
@@ -0,0 +1,100 @@
+import json
+import os
+import random
+import tensorflow as tf
+import config
+from backends import TFLiteBackend
+from data_pipeline import create_eval_dataset, get_class_names, list_split_files
+from evaluate_model import evaluate_stream, iter_labelled_batches
+from preprocessing import load_image, new_batch_buffer
+
+def representative_dataset(num_samples=None):
+    """Yield single-image batches from the val split for int8 calibration"""
+    num_samples = num_samples or config.QUANT_REPRESENTATIVE_SAMPLES
+    paths, _ = list_split_files('val')
+    rng = random.Random(config.RANDOM_SEED)
+    paths = rng.sample(paths, min(num_samples, len(paths)))
+
+    def generator():
+        x = new_batch_buffer(1)
+        for path in paths:
+            load_image(path, out=x[0])
+            yield [x]
+
+    return generator
+
+def convert_dynamic(model):
+    """Dynamic-range quantization (int8 weights, float activations)"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    return converter.convert()
+
+def convert_int8(model):
+    """Full-integer quantization calibrated on the val split"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset()
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    return converter.convert()
+
+def quantize_with_gate(model, output_path=None):
+    """Build the int8 model, score it on the test split and publish only if accuracy holds
+
+    The candidate is compared with the float Keras model on the same test
+    batches; it replaces output_path only when the top-1 and top-3 drops
+    are within QUANT_MAX_TOP1_DROP / QUANT_MAX_TOP3_DROP. On rejection any
+    int8 model left from an earlier float model is removed as well.
+    """
+    output_path = output_path or config.INT8_TFLITE_MODEL_PATH
+    candidate_path = output_path + '.candidate'
+
+    print("🔢 Converting to full-integer (int8) TFLite...")
+    with open(candidate_path, 'wb') as f:
+        f.write(convert_int8(model))
+
+    test_ds, class_names = create_eval_dataset('test', get_class_names())
+
+    print("🧪 Scoring float and int8 models on the test split...")
+    backend = TFLiteBackend(candidate_path)
+    results, _ = evaluate_stream({'float': model.predict_on_batch, 'int8': backend.predict},
+                                 iter_labelled_batches(test_ds), class_names)
+    baseline, quantized = results['float'], results['int8']
+
+    top1_drop = baseline['accuracy'] - quantized['accuracy']
+    top3_drop = baseline['top_3_accuracy'] - quantized['top_3_accuracy']
+    passed = top1_drop <= config.QUANT_MAX_TOP1_DROP and top3_drop <= config.QUANT_MAX_TOP3_DROP
+
+    report = {
+        'float': {k: baseline[k] for k in ('loss', 'accuracy', 'top_3_accuracy')},
+        'int8': {k: quantized[k] for k in ('loss', 'accuracy', 'top_3_accuracy')},
+        'top1_drop': top1_drop,
+        'top3_drop': top3_drop,
+        'max_top1_drop': config.QUANT_MAX_TOP1_DROP,
+        'max_top3_drop': config.QUANT_MAX_TOP3_DROP,
+        'int8_size_bytes': os.path.getsize(candidate_path),
+        'published': passed,
+        'path': output_path
+    }
+
+    if passed:
+        os.replace(candidate_path, output_path)
+        print(f"✅ int8 model published: {output_path} "
+              f"(top-1 drop {top1_drop:+.4f}, top-3 drop {top3_drop:+.4f})")
+    else:
+        os.remove(candidate_path)
+        print(f"❌ int8 model rejected: top-1 drop {top1_drop:+.4f} (max {config.QUANT_MAX_TOP1_DROP}), "
+              f"top-3 drop {top3_drop:+.4f} (max {config.QUANT_MAX_TOP3_DROP})")
+        if os.path.exists(output_path):
+            # Built from an earlier float model; evaluation and serving would keep picking it up
+            os.remove(output_path)
+            print(f"🗑️  Removed the int8 model published for the previous float model: {output_path}")
+
+    with open(config.QUANTIZATION_REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+    return passed
+
+if __name__ == "__main__":
+    path = config.BEST_MODEL_PATH if os.path.exists(config.BEST_MODEL_PATH) else config.MODEL_PATH
+    quantize_with_gate(tf.keras.models.load_model(path))
@@ -0,0 +1,132 @@
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+import config
+
+def thread_budget(workers, threads_per_worker=None):
+    """Intra-op threads per worker so workers x threads never exceeds the cores"""
+    if threads_per_worker:
+        return threads_per_worker
+    return max(1, (os.cpu_count() or 1) // workers)
+
+def run_worker(sock, threads, host, port, backend=None):
+    """Child process: cap thread pools, load + warm the model, serve on the shared socket"""
+    # The master's shutdown handlers came along with the fork
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    # Must be set before TensorFlow is imported
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    config.TFLITE_NUM_THREADS = threads
+    config.STARTUP_MODE = 'eager'
+    if backend:
+        config.INFERENCE_BACKEND = backend
+
+    from werkzeug.serving import make_server
+    import app as serving
+
+    serving.start_serving()
+    server = make_server(host, port, serving.app, threaded=True, fd=sock.fileno())
+    print(f"👷 Worker {os.getpid()} ready ({threads} inference thread(s))", flush=True)
+    server.serve_forever()
+
+def serve(host=None, port=None, workers=None, threads_per_worker=None):
+    """Pre-fork master: one listening socket, N worker processes, restart on crash"""
+    if not hasattr(os, 'fork'):
+        print("❌ Multi-process serving needs os.fork (Linux/macOS). Use `python app.py` instead.")
+        return False
+
+    host = host or config.SERVE_HOST
+    port = port or config.SERVE_PORT
+    workers = workers or config.SERVE_WORKERS or max(1, (os.cpu_count() or 1) // 2)
+    threads = thread_budget(workers, threads_per_worker or config.SERVE_THREADS_PER_WORKER)
+
+    from model_registry import active_model_paths, default_model_path
+
+    backend = None
+    models = active_model_paths()
+    if not models:
+        backend = config.SERVE_BACKEND or config.INFERENCE_BACKEND
+        if not os.path.exists(default_model_path(backend)):
+            print(f"⚠️  No {backend} model at {default_model_path(backend)}; "
+                  f"workers use INFERENCE_BACKEND='{config.INFERENCE_BACKEND}'")
+            backend = config.INFERENCE_BACKEND
+        models = [(backend, default_model_path(backend))]
+    for kind, path in models:
+        if kind == 'tflite':
+            print(f"📦 {path}: mapped read-only by every worker, so its pages are in memory once")
+        else:
+            print(f"⚠️  '{kind}' backend: each worker loads its own copy of {path} "
+                  f"(TensorFlow is not fork-safe); TFLite models are shared")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    print(f"🚀 Serving on http://{host}:{port} with {workers} workers x {threads} thread(s)")
+
+    children = {}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, threads, host, port, backend)
+            finally:
+                os._exit(0)
+        children[pid] = time.time()
+
+    for _ in range(workers):
+        spawn()
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        print(f"⚠️  Worker {pid} exited (status {status}); restarting")
+        if time.time() - started < 5:
+            time.sleep(1)  # Don't spin if workers crash at startup
+        spawn()
+
+    sock.close()
+    print("👋 Server stopped")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-process breed recognition server")
+    parser.add_argument('--host', default=config.SERVE_HOST)
+    parser.add_argument('--port', type=int, default=config.SERVE_PORT)
+    parser.add_argument('--workers', type=int, default=config.SERVE_WORKERS,
+                        help="Worker processes (default: half the cores)")
+    parser.add_argument('--threads-per-worker', type=int, default=config.SERVE_THREADS_PER_WORKER,
+                        help="Inference threads per worker (default: cores // workers)")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers, args.threads_per_worker)
@@ -2,9 +2,16 @@ import os
 import shutil
 import random
 import json
+import csv
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 import config
 
+SPLITS = ["train", "val", "test"]
+MANIFEST_FIELDS = ['path', 'breed', 'filename', 'size', 'mtime', 'hash', 'valid', 'split', 'group']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
 def validate_image(image_path):
     """Validate if image file is readable"""
     try:
@@ -14,86 +21,402 @@ def validate_image(image_path):
     except Exception:
         return False
 
-def split_dataset():
+def file_hash(image_path, chunk_size=1 << 20):
+    """SHA-1 of the file contents"""
+    h = hashlib.sha1()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def inspect_image(image_path):
+    """Hash and validate one image (runs in a worker process)"""
+    try:
+        digest = file_hash(image_path)
+    except OSError:
+        return image_path, '', False
+    return image_path, digest, validate_image(image_path)
+
+def load_manifest(split=None, manifest_path=None):
+    """Read manifest rows, optionally only the valid images of one split"""
+    manifest_path = manifest_path or config.MANIFEST_PATH
+    if not os.path.exists(manifest_path):
+        return []
+
+    with open(manifest_path, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    for row in rows:
+        row['size'] = int(row['size'])
+        row['mtime'] = float(row['mtime'])
+        row['valid'] = row['valid'] == '1'
+        row['group'] = row.get('group') or ''  # Manifests written before duplicate grouping
+
+    if split is not None:
+        rows = [r for r in rows if r['valid'] and r['split'] == split]
+    return rows
+
+def save_manifest(rows, manifest_path=None):
+    """Write the manifest atomically so an interrupted run keeps the old one"""
+    manifest_path = manifest_path or config.MANIFEST_PATH
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for row in sorted(rows, key=lambda r: r['path']):
+            writer.writerow({**row, 'valid': '1' if row['valid'] else '0'})
+    os.replace(tmp_path, manifest_path)
+
+def scan_raw_dataset(breed_folders):
+    """List image files with size and mtime, without opening them"""
+    entries = []
+    for breed in sorted(breed_folders):
+        breed_dir = os.path.join(config.RAW_DATASET_DIR, breed)
+        for file in sorted(os.listdir(breed_dir)):
+            if not file.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(breed_dir, file)
+            st = os.stat(path)
+            entries.append({
+                'path': path,
+                'breed': breed,
+                'filename': file,
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+            })
+    return entries
+
+def materialize(src, dst, mode):
+    """Place one image in the processed tree as a hardlink, symlink or copy"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            # Cross-device or unsupported filesystem
+            pass
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+        return
+    shutil.copy2(src, dst)
+
+def processed_path(row):
+    return os.path.join(config.PROCESSED_DATASET_DIR, row['split'], row['breed'], row['filename'])
+
+def resolve_group_splits(rows):
+    """Move duplicate-group members into one split so no group straddles train/val/test
+
+    Returns copies of the moved rows as they were, so their old processed
+    files can be removed. The group keeps its most common split.
+    """
+    groups = {}
+    for row in rows:
+        if row['valid'] and row['group'] and row['split']:
+            groups.setdefault(row['group'], []).append(row)
+
+    moved = []
+    for members in groups.values():
+        splits = [row['split'] for row in members]
+        target = max(SPLITS, key=splits.count)
+        for row in members:
+            if row['split'] != target:
+                moved.append(dict(row))
+                row['split'] = target
+    return moved
+
+def assign_splits(rows):
+    """Assign a split to valid rows that have none, keeping existing assignments
+
+    On a fresh dataset this is the usual seeded shuffle + ratio split per breed.
+    On re-runs only new files are shuffled, and they fill whichever splits are
+    below their target share. Rows sharing a duplicate group follow the split
+    of the first member assigned, even across breeds.
+    """
+    by_breed = {}
+    group_splits = {}
+    for row in rows:
+        if row['valid']:
+            by_breed.setdefault(row['breed'], []).append(row)
+            if row['group'] and row['split']:
+                group_splits[row['group']] = row['split']
+
+    for breed in sorted(by_breed):
+        breed_rows = by_breed[breed]
+        n_total = len(breed_rows)
+        n_train = int(n_total * config.TRAIN_SPLIT)
+        n_val = int(n_total * config.VAL_SPLIT)
+        targets = {'train': n_train, 'val': n_val, 'test': n_total - n_train - n_val}
+
+        counts = {split: 0 for split in SPLITS}
+        new_rows = []
+        for row in breed_rows:
+            if row['split'] in counts:
+                counts[row['split']] += 1
+            else:
+                new_rows.append(row)
+
+        random.shuffle(new_rows)
+        for row in new_rows:
+            if row['group'] in group_splits:
+                split = group_splits[row['group']]
+            else:
+                for split in SPLITS:
+                    if counts[split] < targets[split]:
+                        break
+                else:
+                    split = 'train'
+            row['split'] = split
+            counts[split] += 1
+            if row['group']:
+                group_splits[row['group']] = split
+
+def group_duplicates(rows, threshold=None):
+    """Tag valid rows with a duplicate group id (exact or near-identical images)
+
+    Near duplicates come from embedding similarity (embeddings.py); files
+    with identical content share a hash and so a group. Images with no
+    duplicate get an empty group.
+    """
+    from embeddings import find_duplicate_groups
+
+    valid = [row for row in rows if row['valid']]
+    groups = find_duplicate_groups(valid, threshold)
+    sizes = {}
+    for row in valid:
+        row['group'] = groups.get(row['hash'], row['hash'])
+        sizes[row['group']] = sizes.get(row['group'], 0) + 1
+    for row in rows:
+        if not row['valid'] or sizes.get(row['group'], 0) < 2:
+            row['group'] = ''
+
+    n_groups = sum(1 for size in sizes.values() if size > 1)
+    n_images = sum(size for size in sizes.values() if size > 1)
+    print(f"🔁 {n_groups} duplicate groups covering {n_images} images")
+    return n_groups
+
+def split_dataset(materialize_mode=None, workers=None, dedup=None):
     """Split dataset into train/val/test"""
     print("🚀 Starting dataset split...")
-    
+
     if not os.path.exists(config.RAW_DATASET_DIR):
         print(f"❌ Dataset directory not found: {config.RAW_DATASET_DIR}")
         print("Please put your dataset in the 'Dataset/raw' folder")
         return False
-    
+
+    materialize_mode = materialize_mode or config.MATERIALIZE_MODE
+    workers = workers or config.SPLIT_WORKERS
+    dedup = config.DEDUP_BEFORE_SPLIT if dedup is None else dedup
     random.seed(config.RANDOM_SEED)
-    
-    # Create output directories
-    for split in ["train", "val", "test"]:
-        os.makedirs(os.path.join(config.PROCESSED_DATASET_DIR, split), exist_ok=True)
-    
-    breed_stats = {}
-    total_images = 0
-    
+
     # Process each breed folder
-    breed_folders = [f for f in os.listdir(config.RAW_DATASET_DIR) 
+    breed_folders = [f for f in os.listdir(config.RAW_DATASET_DIR)
                     if os.path.isdir(os.path.join(config.RAW_DATASET_DIR, f))]
-    
+
     print(f"📁 Found {len(breed_folders)} breed folders")
-    
+
+    # Reuse hash/validity/split for files unchanged since the last run
+    previous = {row['path']: row for row in load_manifest()}
+    entries = scan_raw_dataset(breed_folders)
+
+    rows, to_inspect = [], []
+    for entry in entries:
+        old = previous.pop(entry['path'], None)
+        if old and old['size'] == entry['size'] and old['mtime'] == entry['mtime']:
+            rows.append(old)
+        else:
+            # Changed files keep their split so they don't hop between train and test
+            row = {**entry, 'hash': '', 'valid': False, 'split': old['split'] if old else '',
+                   'group': old['group'] if old else ''}
+            rows.append(row)
+            to_inspect.append(row)
+
+    print(f"🔍 {len(rows) - len(to_inspect)} unchanged, {len(to_inspect)} new/changed, "
+          f"{len(previous)} removed")
+
+    # Validate new/changed images in parallel
+    if to_inspect:
+        by_path = {row['path']: row for row in to_inspect}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(to_inspect) // (workers * 8))
+            for path, digest, valid in pool.map(inspect_image, list(by_path), chunksize=chunksize):
+                by_path[path]['hash'] = digest
+                by_path[path]['valid'] = valid
+
+    # Images that no longer decode lose their split
+    stale = list(previous.values())
+    for row in to_inspect:
+        if not row['valid'] and row['split']:
+            stale.append(dict(row))
+            row['split'] = ''
+
+    # Keep near-identical images in one split so they can't leak between train and test
+    moved = []
+    if dedup:
+        group_duplicates(rows)
+        moved = resolve_group_splits(rows)
+        stale += moved
+        if moved:
+            print(f"🔀 Moved {len(moved)} images to join their duplicate group's split")
+
+    assign_splits(rows)
+
+    # Materialize the processed tree
+    if materialize_mode != 'none':
+        for split in SPLITS:
+            os.makedirs(os.path.join(config.PROCESSED_DATASET_DIR, split), exist_ok=True)
+
+        # Drop files whose source disappeared or became invalid
+        for old in stale:
+            if old['split'] and os.path.lexists(processed_path(old)):
+                os.remove(processed_path(old))
+
+        inspected = {row['path'] for row in to_inspect + moved}
+        for row in rows:
+            if not row['valid']:
+                continue
+            dst = processed_path(row)
+            if row['path'] not in inspected and os.path.lexists(dst):
+                continue
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            materialize(row['path'], dst, materialize_mode)
+
+    save_manifest(rows)
+
+    # Statistics
+    breed_stats = {}
+    total_images = 0
     for breed in sorted(breed_folders):
-        breed_dir = os.path.join(config.RAW_DATASET_DIR, breed)
-        
-        # Get valid images
-        all_files = os.listdir(breed_dir)
-        valid_images = []
-        
-        for file in all_files:
-            file_path = os.path.join(breed_dir, file)
-            if file.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
-                if validate_image(file_path):
-                    valid_images.append(file)
-        
-        if len(valid_images) < 10:
-            print(f"⚠️  Warning: {breed} has only {len(valid_images)} valid images")
-        
-        # Shuffle and split
-        random.shuffle(valid_images)
-        n_total = len(valid_images)
-        n_train = int(n_total * config.TRAIN_SPLIT)
-        n_val = int(n_total * config.VAL_SPLIT)
-        
-        train_imgs = valid_images[:n_train]
-        val_imgs = valid_images[n_train:n_train + n_val]
-        test_imgs = valid_images[n_train + n_val:]
-        
-        # Copy images
-        for split, split_imgs in zip(["train", "val", "test"], [train_imgs, val_imgs, test_imgs]):
-            split_breed_dir = os.path.join(config.PROCESSED_DATASET_DIR, split, breed)
-            os.makedirs(split_breed_dir, exist_ok=True)
-            
-            for img in split_imgs:
-                src = os.path.join(breed_dir, img)
-                dst = os.path.join(split_breed_dir, img)
-                shutil.copy2(src, dst)
-        
-        breed_stats[breed] = {
-            'total': n_total,
-            'train': len(train_imgs),
-            'val': len(val_imgs),
-            'test': len(test_imgs)
-        }
-        
+        breed_rows = [r for r in rows if r['breed'] == breed and r['valid']]
+        n_total = len(breed_rows)
+        counts = {split: sum(r['split'] == split for r in breed_rows) for split in SPLITS}
+
+        if n_total < 10:
+            print(f"⚠️  Warning: {breed} has only {n_total} valid images")
+
+        breed_stats[breed] = {'total': n_total, **counts}
         total_images += n_total
-        print(f"✅ {breed}: {n_total} images → {len(train_imgs)} train, {len(val_imgs)} val, {len(test_imgs)} test")
-    
+        print(f"✅ {breed}: {n_total} images → {counts['train']} train, {counts['val']} val, {counts['test']} test")
+
     # Save statistics
     with open('dataset_stats.json', 'w') as f:
         json.dump({
             'total_breeds': len(breed_folders),
             'total_images': total_images,
+            'materialize_mode': materialize_mode,
+            'duplicate_groups': len({r['group'] for r in rows if r['valid'] and r['group']}),
             'breed_stats': breed_stats
         }, f, indent=2)
-    
+
     print(f"🎉 Dataset split completed! {len(breed_folders)} breeds, {total_images} images")
+    print(f"📝 Manifest: {config.MANIFEST_PATH}")
     return True
 
+def load_resized(image_path, img_size):
+    """Decode and resize one image to raw uint8 RGB bytes (runs in a worker process)"""
+    try:
+        with Image.open(image_path) as img:
+            img = img.convert('RGB').resize((img_size, img_size), Image.BILINEAR)
+            return img.tobytes()
+    except Exception:
+        return None
+
+def write_shards(splits=None, workers=None, img_size=None):
+    """Pack each split into pre-resized TFRecord shards plus an index.json
+
+    Every record holds raw img_size x img_size x 3 uint8 pixels and the
+    label, so readers do sequential reads and no JPEG decode or resize.
+    A split is skipped when its file list and IMG_SIZE match the index.
+    """
+    import tensorflow as tf
+    from data_pipeline import get_class_names, list_split_files
+
+    splits = splits or SPLITS
+    workers = workers or config.SPLIT_WORKERS
+    img_size = img_size or config.IMG_SIZE
+    class_names = get_class_names()
+
+    for split in splits:
+        paths, labels = list_split_files(split, class_names)
+        split_dir = os.path.join(config.SHARD_DIR, split)
+        index_path = os.path.join(split_dir, 'index.json')
+
+        signature = hashlib.sha1()
+        for path in paths:
+            st = os.stat(path)
+            signature.update(f"{path}|{st.st_size}|{st.st_mtime}\n".encode())
+        signature = signature.hexdigest()
+
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('signature') == signature and index.get('img_size') == img_size:
+                print(f"⏭️  {split} shards up to date ({index['total']} images)")
+                continue
+
+        os.makedirs(split_dir, exist_ok=True)
+        for old in os.listdir(split_dir):
+            if old.endswith('.tfrecord'):
+                os.remove(os.path.join(split_dir, old))
+
+        shards, writer, count, total = [], None, 0, 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pixels = pool.map(load_resized, paths, [img_size] * len(paths), chunksize=32)
+            for path, label, data in zip(paths, labels, pixels):
+                if data is None:
+                    print(f"⚠️  Skipping unreadable image: {path}")
+                    continue
+                if writer is None or count >= config.SHARD_MAX_IMAGES:
+                    if writer is not None:
+                        writer.close()
+                        shards[-1]['count'] = count
+                    name = f"{split}-{len(shards):05d}.tfrecord"
+                    writer = tf.io.TFRecordWriter(os.path.join(split_dir, name))
+                    shards.append({'file': name, 'count': 0})
+                    count = 0
+
+                example = tf.train.Example(features=tf.train.Features(feature={
+                    'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[data])),
+                    'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+                    'path': tf.train.Feature(bytes_list=tf.train.BytesList(value=[path.encode()])),
+                }))
+                writer.write(example.SerializeToString())
+                count += 1
+                total += 1
+
+        if writer is not None:
+            writer.close()
+            shards[-1]['count'] = count
+
+        with open(index_path, 'w') as f:
+            json.dump({
+                'split': split,
+                'img_size': img_size,
+                'class_names': class_names,
+                'total': total,
+                'signature': signature,
+                'shards': shards
+            }, f, indent=2)
+        print(f"📦 {split}: {total} images → {len(shards)} shards in {split_dir}")
+
 if __name__ == "__main__":
-    split_dataset()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Split raw dataset into train/val/test")
+    parser.add_argument('--mode', choices=['hardlink', 'symlink', 'copy', 'none'],
+                        help="How to place images in the processed tree (default: config.MATERIALIZE_MODE)")
+    parser.add_argument('--workers', type=int, help="Validation processes (default: config.SPLIT_WORKERS)")
+    parser.add_argument('--shards', action='store_true', help="Also pack splits into pre-resized TFRecord shards")
+    parser.add_argument('--image-cache', action='store_true',
+                        help="Also build the memory-mapped pre-resized image cache (INPUT_PIPELINE = 'image_cache')")
+    parser.add_argument('--dedup', action='store_true', default=None,
+                        help="Group near-duplicate images into one split (default: config.DEDUP_BEFORE_SPLIT)")
+    args = parser.parse_args()
+
+    if split_dataset(materialize_mode=args.mode, workers=args.workers, dedup=args.dedup):
+        if args.shards:
+            write_shards(workers=args.workers)
+        if args.image_cache:
+            from image_cache import build_image_cache
+            build_image_cache(workers=args.workers)
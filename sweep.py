@@ -0,0 +1,414 @@
+import argparse
+import ast
+import itertools
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import config
+
+class TrialPruned(Exception):
+    """Raised from the reporting callback to stop a trial that fell behind at a rung"""
+
+def parse_value(text):
+    """Python literal from the command line ('0.001', '256', 'True'), else the plain string"""
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+def check_names(names):
+    for name in names:
+        if not name.isupper() or not hasattr(config, name):
+            raise ValueError(f"Unknown config constant '{name}'")
+
+def expand_space(space, samples=0):
+    """Trial parameter sets: every combination of the grid, or `samples` random ones"""
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+    if samples and samples < len(grid):
+        grid = random.Random(config.RANDOM_SEED).sample(grid, samples)
+    return grid
+
+def rung_epochs(max_epochs, min_epochs, factor):
+    """Epochs at which a trial is compared with the others: MIN, MIN * FACTOR, ... below max_epochs"""
+    rungs, epochs = [], min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= factor
+    return rungs
+
+class SweepStore:
+    """Sweeps, trials and per-epoch metrics in sqlite, shared by the runner and every trial process"""
+
+    def __init__(self, path=None):
+        self.path = path or config.SWEEP_DB_PATH
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS sweeps "
+                     "(id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, settings TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS trials "
+                     "(id INTEGER PRIMARY KEY AUTOINCREMENT, sweep_id INTEGER NOT NULL, params TEXT NOT NULL, "
+                     "status TEXT NOT NULL, started REAL, finished REAL, epochs INTEGER NOT NULL DEFAULT 0, "
+                     "best REAL, result TEXT, error TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS trial_epochs "
+                     "(trial_id INTEGER NOT NULL, epoch INTEGER NOT NULL, value REAL, logs TEXT, "
+                     "PRIMARY KEY (trial_id, epoch))")
+        conn.execute("CREATE INDEX IF NOT EXISTS trials_sweep ON trials (sweep_id)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def create_sweep(self, settings, param_sets):
+        conn = self._conn()
+        sweep_id = conn.execute("INSERT INTO sweeps (created, settings) VALUES (?, ?)",
+                                (time.time(), json.dumps(settings))).lastrowid
+        conn.executemany("INSERT INTO trials (sweep_id, params, status) VALUES (?, ?, 'pending')",
+                         [(sweep_id, json.dumps(params)) for params in param_sets])
+        conn.commit()
+        return sweep_id
+
+    def sweep(self, sweep_id=None):
+        """One sweep (default: the latest) with its settings decoded"""
+        conn = self._conn()
+        if sweep_id is None:
+            row = conn.execute("SELECT * FROM sweeps ORDER BY id DESC LIMIT 1").fetchone()
+        else:
+            row = conn.execute("SELECT * FROM sweeps WHERE id = ?", (sweep_id,)).fetchone()
+        if row is None:
+            return None
+        return {'id': row['id'], 'created': row['created'], 'settings': json.loads(row['settings'])}
+
+    @staticmethod
+    def _trial(row):
+        trial = dict(row)
+        trial['params'] = json.loads(trial['params'])
+        trial['result'] = json.loads(trial['result']) if trial['result'] else None
+        return trial
+
+    def trial(self, trial_id):
+        row = self._conn().execute("SELECT * FROM trials WHERE id = ?", (trial_id,)).fetchone()
+        return self._trial(row) if row else None
+
+    def trials(self, sweep_id):
+        rows = self._conn().execute("SELECT * FROM trials WHERE sweep_id = ? ORDER BY id", (sweep_id,)).fetchall()
+        return [self._trial(row) for row in rows]
+
+    def update_trial(self, trial_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        conn = self._conn()
+        conn.execute(f"UPDATE trials SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                     (*fields.values(), trial_id))
+        conn.commit()
+
+    def reset_unfinished(self, sweep_id):
+        """Send trials that were running when the runner stopped back to the queue"""
+        conn = self._conn()
+        conn.execute("DELETE FROM trial_epochs WHERE trial_id IN "
+                     "(SELECT id FROM trials WHERE sweep_id = ? AND status = 'running')", (sweep_id,))
+        conn.execute("UPDATE trials SET status = 'pending', started = NULL, epochs = 0, best = NULL "
+                     "WHERE sweep_id = ? AND status = 'running'", (sweep_id,))
+        conn.commit()
+
+    def record_epoch(self, trial_id, epoch, value, logs, lower_is_better=False):
+        best = 'MIN' if lower_is_better else 'MAX'
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO trial_epochs (trial_id, epoch, value, logs) VALUES (?, ?, ?, ?)",
+                     (trial_id, epoch, value, json.dumps(logs)))
+        conn.execute(f"UPDATE trials SET epochs = ?, best = (SELECT {best}(value) FROM trial_epochs "
+                     f"WHERE trial_id = ?) WHERE id = ?", (epoch, trial_id, trial_id))
+        conn.commit()
+
+    def keep_going(self, sweep_id, trial_id, rung, factor, lower_is_better=False):
+        """Asynchronous successive halving: continue only if in the top 1/factor at this rung
+
+        Each trial that reached the rung is scored by its best value up to
+        it. A trial is judged against the ones that got there before it, so
+        early trials are never held back waiting for slower ones.
+        """
+        best = 'MIN' if lower_is_better else 'MAX'
+        rows = self._conn().execute(
+            f"SELECT e.trial_id, {best}(e.value) FROM trial_epochs e JOIN trials t ON t.id = e.trial_id "
+            f"WHERE t.sweep_id = ? AND e.epoch <= ? GROUP BY e.trial_id HAVING MAX(e.epoch) >= ?",
+            (sweep_id, rung, rung)).fetchall()
+        scores = dict(rows)
+        if scores.get(trial_id) is None:
+            return False
+        ranked = sorted((value for value in scores.values() if value is not None), reverse=not lower_is_better)
+        cutoff = ranked[max(1, len(ranked) // factor) - 1]
+        # Ties with the cutoff carry on
+        return scores[trial_id] <= cutoff if lower_is_better else scores[trial_id] >= cutoff
+
+def trial_dir(trial):
+    return os.path.join(config.SWEEP_DIR, f"sweep_{trial['sweep_id']}", f"trial_{trial['id']}")
+
+def trial_overrides(sweep, trial):
+    """Config for one trial: sweep-wide settings, then the trial's own parameters"""
+    overrides = {
+        'RESUME_TRAINING': False,
+        'EXPORT_MODELS': False,
+        'PUBLISH_TO_REGISTRY': False,
+        'TRAIN_CASCADE_MODEL': False,
+        'DISTILL_STUDENT': False,
+        'TFLITE_QUANTIZATION': 'dynamic',
+        'DISTRIBUTED': False,
+    }
+    overrides.update(sweep['settings']['fixed'])
+    overrides.update(trial['params'])
+    return overrides
+
+def apply_overrides(overrides, model_dir=None):
+    """Set config constants in this process; model_dir moves every path under MODEL_DIR into it"""
+    check_names(overrides)
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    if model_dir:
+        prefix = config.MODEL_DIR + '/'
+        for name, value in list(vars(config).items()):
+            if name.isupper() and not name.startswith('SWEEP_') and isinstance(value, str) \
+                    and value.startswith(prefix):
+                setattr(config, name, os.path.join(model_dir, value[len(prefix):]))
+        config.MODEL_DIR = model_dir
+        os.makedirs(model_dir, exist_ok=True)
+
+def create_reporter(store, sweep, trial):
+    """Keras callback recording the sweep metric per epoch and pruning the trial at losing rungs"""
+    from tensorflow.keras.callbacks import Callback
+
+    settings = sweep['settings']
+    metric = settings['metric']
+    lower_is_better = 'loss' in metric
+    rungs = rung_epochs(config.INITIAL_EPOCHS + config.FINE_TUNE_EPOCHS,
+                        settings['min_epochs'], settings['factor'])
+
+    class SweepReporter(Callback):
+        def __init__(self):
+            super().__init__()
+            # Counts across both training phases
+            self.epochs = 0
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.epochs += 1
+            logs = {name: float(value) for name, value in (logs or {}).items()}
+            store.record_epoch(trial['id'], self.epochs, logs.get(metric), logs, lower_is_better)
+            if self.epochs in rungs and not store.keep_going(sweep['id'], trial['id'], self.epochs,
+                                                             settings['factor'], lower_is_better):
+                raise TrialPruned(f"{metric} {logs.get(metric)} outside the top 1/{settings['factor']} "
+                                  f"at epoch {self.epochs}")
+
+    return SweepReporter()
+
+def run_trial(trial_id, threads=None):
+    """Train one trial in this process with its overrides (runs as a subprocess of the sweep)"""
+    store = SweepStore()
+    trial = store.trial(trial_id)
+    sweep = store.sweep(trial['sweep_id'])
+    apply_overrides(trial_overrides(sweep, trial), trial_dir(trial))
+    if threads:
+        config.SPLIT_WORKERS = config.PREDICT_WORKERS = threads
+
+    import tensorflow as tf
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    from train_model import precision_mode, train_model
+
+    store.update_trial(trial_id, status='running', started=time.time())
+    print(f"🧪 Trial {trial_id}: {trial['params']}")
+    try:
+        ok = train_model(extra_callbacks=[create_reporter(store, sweep, trial)])
+    except TrialPruned as e:
+        print(f"✂️  Trial {trial_id} pruned: {e}")
+        store.update_trial(trial_id, status='pruned', finished=time.time(), error=str(e))
+        return True
+    except Exception as e:
+        store.update_trial(trial_id, status='failed', finished=time.time(), error=repr(e))
+        raise
+    if not ok:
+        store.update_trial(trial_id, status='failed', finished=time.time(), error="train_model() returned False")
+        return False
+
+    with open(config.TRAINING_REPORT_PATH, 'r') as f:
+        run = json.load(f)['runs'][precision_mode()]
+    result = {'val_accuracy': run['val_accuracy'], 'val_top_3_accuracy': run['val_top_3_accuracy'],
+              'model_path': config.MODEL_PATH}
+    store.update_trial(trial_id, status='completed', finished=time.time(), result=result)
+    return True
+
+def prepare_shared_caches(sweep, trials, workers):
+    """Build the image/feature caches trials read, once per distinct setting, before any trial starts
+
+    Trials then only read them; the feature store in particular must not
+    be appended to by several trial processes at once.
+    """
+    settings = {}
+    for trial in trials:
+        overrides = trial_overrides(sweep, trial)
+        needed = {name: overrides.get(name, getattr(config, name))
+                  for name in ('IMG_SIZE', 'INPUT_PIPELINE', 'USE_FEATURE_CACHE', 'FEATURE_CACHE_VIEWS')}
+        if needed['INPUT_PIPELINE'] == 'image_cache' or needed['USE_FEATURE_CACHE']:
+            settings[json.dumps(needed, sort_keys=True)] = needed
+
+    for needed in settings.values():
+        command = [sys.executable, os.path.abspath(__file__), 'prepare', json.dumps(needed), '--workers', str(workers)]
+        if subprocess.run(command).returncode != 0:
+            raise RuntimeError(f"Preparing shared caches failed for {needed}")
+
+def prepare(overrides, workers=None):
+    apply_overrides(overrides)
+    if config.INPUT_PIPELINE == 'image_cache':
+        from image_cache import build_image_cache
+        build_image_cache(['train', 'val'], workers)
+    if config.USE_FEATURE_CACHE:
+        from feature_cache import prepare_features
+        prepare_features()
+
+def launch_trial(trial, threads):
+    directory = trial_dir(trial)
+    os.makedirs(directory, exist_ok=True)
+    env = dict(os.environ, TF_NUM_INTRAOP_THREADS=str(threads), TF_NUM_INTEROP_THREADS='1',
+               OMP_NUM_THREADS=str(threads))
+    log = open(os.path.join(directory, 'train.log'), 'w')
+    command = [sys.executable, os.path.abspath(__file__), 'trial', str(trial['id']), '--threads', str(threads)]
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return process
+
+def format_trial(trial, metric):
+    best = f"{metric} {trial['best']:.4f}" if trial['best'] is not None else "no metric"
+    params = ', '.join(f"{name}={value}" for name, value in trial['params'].items())
+    return f"trial {trial['id']} {trial['status']} after {trial['epochs']} epoch(s), best {best} ({params})"
+
+def run_sweep(sweep_id, parallel=None, threads=None):
+    """Run a sweep's pending trials, `parallel` processes at a time, each limited to `threads` CPU threads"""
+    store = SweepStore()
+    sweep = store.sweep(sweep_id)
+    metric = sweep['settings']['metric']
+    parallel = parallel or config.SWEEP_PARALLEL_TRIALS
+    threads = threads or config.SWEEP_THREADS_PER_TRIAL or max(1, (os.cpu_count() or 1) // parallel)
+
+    store.reset_unfinished(sweep_id)
+    trials = store.trials(sweep_id)
+    pending = [trial for trial in trials if trial['status'] == 'pending']
+    print(f"🧪 Sweep {sweep_id}: {len(pending)} trial(s) to run, {parallel} at a time, {threads} thread(s) each")
+    prepare_shared_caches(sweep, pending, parallel * threads)
+
+    running = {}
+    try:
+        while pending or running:
+            while pending and len(running) < parallel:
+                trial = pending.pop(0)
+                running[trial['id']] = launch_trial(trial, threads)
+                print(f"🚀 Trial {trial['id']} started (log: {os.path.join(trial_dir(trial), 'train.log')})")
+            time.sleep(1)
+            for trial_id, process in list(running.items()):
+                if process.poll() is None:
+                    continue
+                del running[trial_id]
+                if store.trial(trial_id)['status'] in ('pending', 'running'):
+                    store.update_trial(trial_id, status='failed', finished=time.time(),
+                                       error=f"Trial process exited with code {process.returncode}")
+                trial = store.trial(trial_id)
+                icon = {'completed': '✅', 'pruned': '✂️ '}.get(trial['status'], '❌')
+                print(f"{icon} {format_trial(trial, metric)}")
+    except KeyboardInterrupt:
+        for process in running.values():
+            process.terminate()
+        for process in running.values():
+            process.wait()
+        print(f"\n⏹️  Sweep interrupted; continue with: python sweep.py resume {sweep_id}")
+        return False
+
+    show_sweep(sweep_id)
+    return True
+
+def show_sweep(sweep_id=None):
+    """Trials ranked by their best metric, with the winning settings as config lines"""
+    store = SweepStore()
+    sweep = store.sweep(sweep_id)
+    if sweep is None:
+        print("❌ No sweeps yet. Run: python sweep.py run")
+        return None
+    metric = sweep['settings']['metric']
+    lower_is_better = 'loss' in metric
+    trials = store.trials(sweep['id'])
+    ranked = sorted((t for t in trials if t['best'] is not None),
+                    key=lambda t: t['best'], reverse=not lower_is_better)
+
+    counts = {}
+    for trial in trials:
+        counts[trial['status']] = counts.get(trial['status'], 0) + 1
+    print(f"\n📋 Sweep {sweep['id']} ({metric}): " + ', '.join(f"{n} {status}" for status, n in sorted(counts.items())))
+    for trial in ranked + [t for t in trials if t['best'] is None]:
+        print(f"  {format_trial(trial, metric)}")
+
+    completed = [t for t in ranked if t['status'] == 'completed']
+    if completed:
+        print("🏆 Best completed trial:")
+        for name, value in completed[0]['params'].items():
+            print(f"  {name} = {value!r}")
+    return sweep
+
+def main():
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep over config constants with early pruning")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help="Start a new sweep over config.SWEEP_SPACE")
+    run.add_argument('--param', action='append', default=[], metavar='NAME=V1,V2',
+                     help="Values to try for a config constant (replaces its SWEEP_SPACE entry)")
+    run.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                     help="Fixed override for every trial, e.g. INITIAL_EPOCHS=10")
+    run.add_argument('--samples', type=int, default=config.SWEEP_SAMPLES,
+                     help="Random combinations to try (0 = the full grid)")
+    resume = sub.add_parser('resume', help="Run the unfinished trials of an interrupted sweep")
+    resume.add_argument('sweep_id', type=int)
+    for command in (run, resume):
+        command.add_argument('--parallel', type=int, help="Trial processes at once (default: SWEEP_PARALLEL_TRIALS)")
+        command.add_argument('--threads', type=int, help="CPU threads per trial (default: cores / parallel)")
+    show = sub.add_parser('show', help="Rank the trials of a sweep (default: the latest)")
+    show.add_argument('sweep_id', type=int, nargs='?')
+    trial = sub.add_parser('trial', help=argparse.SUPPRESS)
+    trial.add_argument('trial_id', type=int)
+    trial.add_argument('--threads', type=int)
+    prep = sub.add_parser('prepare', help=argparse.SUPPRESS)
+    prep.add_argument('overrides')
+    prep.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        space = dict(config.SWEEP_SPACE)
+        for item in args.param:
+            name, values = item.split('=', 1)
+            space[name] = [parse_value(v) for v in values.split(',')]
+        fixed = {'INPUT_PIPELINE': config.SWEEP_INPUT_PIPELINE}
+        fixed.update((name, parse_value(value)) for name, value in (item.split('=', 1) for item in args.set))
+        check_names(list(space) + list(fixed))
+
+        param_sets = expand_space(space, args.samples)
+        settings = {'metric': config.SWEEP_METRIC, 'min_epochs': config.SWEEP_MIN_EPOCHS,
+                    'factor': config.SWEEP_REDUCTION_FACTOR, 'space': space, 'fixed': fixed}
+        sweep_id = SweepStore().create_sweep(settings, param_sets)
+        return 0 if run_sweep(sweep_id, args.parallel, args.threads) else 1
+    if args.command == 'resume':
+        return 0 if run_sweep(args.sweep_id, args.parallel, args.threads) else 1
+    if args.command == 'show':
+        return 0 if show_sweep(args.sweep_id) else 1
+    if args.command == 'trial':
+        return 0 if run_trial(args.trial_id, args.threads) else 1
+    prepare(json.loads(args.overrides), args.workers)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,13 +3,46 @@ from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import MobileNetV2
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, BatchNormalization
 from tensorflow.keras.models import Model
-from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
+from tensorflow.keras.callbacks import Callback, EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.metrics import TopKCategoricalAccuracy
+import argparse
+import hashlib
 import json
 import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
 import matplotlib.pyplot as plt
+import pandas as pd
 import config
+from split_dataset import load_manifest
+
+def dataset_ready():
+    """Whether split_dataset.py has produced a usable train split"""
+    if config.MATERIALIZE_MODE == 'none':
+        return bool(load_manifest('train'))
+    return os.path.exists(os.path.join(config.PROCESSED_DATASET_DIR, 'train'))
+
+def flow_from_split(datagen, split, shuffle):
+    """Iterate one split, from the processed tree or straight from the manifest"""
+    common = dict(
+        target_size=(config.IMG_SIZE, config.IMG_SIZE),
+        batch_size=config.BATCH_SIZE,
+        class_mode='categorical',
+        shuffle=shuffle
+    )
+    
+    if config.MATERIALIZE_MODE == 'none':
+        rows = load_manifest(split)
+        df = pd.DataFrame({'filename': [r['path'] for r in rows], 'class': [r['breed'] for r in rows]})
+        classes = sorted({r['breed'] for r in load_manifest() if r['valid']})
+        return datagen.flow_from_dataframe(df, x_col='filename', y_col='class', classes=classes, **common)
+    
+    return datagen.flow_from_directory(os.path.join(config.PROCESSED_DATASET_DIR, split), **common)
 
 def create_data_generators():
     """Create data generators"""
@@ -17,47 +50,390 @@ def create_data_generators():
     
     train_datagen = ImageDataGenerator(
         rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.1,
-        height_shift_range=0.1,
-        shear_range=0.1,
-        zoom_range=0.1,
-        horizontal_flip=True,
-        brightness_range=[0.9, 1.1],
-        fill_mode='nearest'
+        fill_mode='nearest',
+        **config.AUGMENTATION
     )
     
     val_datagen = ImageDataGenerator(rescale=1./255)
     
-    train_generator = train_datagen.flow_from_directory(
-        os.path.join(config.PROCESSED_DATASET_DIR, 'train'),
-        target_size=(config.IMG_SIZE, config.IMG_SIZE),
-        batch_size=config.BATCH_SIZE,
-        class_mode='categorical',
-        shuffle=True
-    )
-    
-    val_generator = val_datagen.flow_from_directory(
-        os.path.join(config.PROCESSED_DATASET_DIR, 'val'),
-        target_size=(config.IMG_SIZE, config.IMG_SIZE),
-        batch_size=config.BATCH_SIZE,
-        class_mode='categorical',
-        shuffle=False
-    )
+    train_generator = flow_from_split(train_datagen, 'train', shuffle=True)
+    val_generator = flow_from_split(val_datagen, 'val', shuffle=False)
     
     print(f"✅ Classes: {train_generator.num_classes}")
     print(f"📊 Train: {train_generator.samples}, Val: {val_generator.samples}")
     
     return train_generator, val_generator
 
-def create_model(num_classes):
-    """Create model with MobileNetV2"""
+def create_input_pipeline():
+    """Train/val inputs from the pipeline selected in config.INPUT_PIPELINE"""
+    if config.INPUT_PIPELINE == 'generator':
+        train_gen, val_gen = create_data_generators()
+        return train_gen, val_gen, train_gen.class_indices
+    
+    from data_pipeline import create_datasets
+    return create_datasets()
+
+class ThroughputLogger(Callback):
+    """Report training images/sec at the end of every epoch and keep step times"""
+    
+    def __init__(self, batch_size):
+        super().__init__()
+        self.batch_size = batch_size
+        self.reset()
+    
+    def reset(self):
+        self.history = []
+        self.step_times = []
+    
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+        self._steps = 0
+    
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+    
+    def on_train_batch_end(self, batch, logs=None):
+        self._steps += 1
+        self.step_times.append(time.perf_counter() - self._step_start)
+    
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._start
+        rate = self._steps * self.batch_size / elapsed if elapsed > 0 else 0.0
+        self.history.append(rate)
+        print(f"⏱️  Epoch {epoch + 1}: ~{rate:.1f} images/sec ({config.INPUT_PIPELINE})")
+    
+    def summary(self):
+        """Median step time, ignoring the first step (graph tracing / XLA compilation)"""
+        steps = sorted(self.step_times[1:] or self.step_times)
+        return {
+            'epochs': len(self.history),
+            'steps': len(self.step_times),
+            'median_step_ms': 1000.0 * steps[len(steps) // 2] if steps else None,
+            'first_step_ms': 1000.0 * self.step_times[0] if self.step_times else None,
+            'images_per_sec': max(self.history) if self.history else None
+        }
+
+def precision_mode():
+    """Name of the configured precision/compilation mode, e.g. 'mixed_bfloat16+xla'"""
+    return config.PRECISION_POLICY + ('+xla' if config.JIT_COMPILE else '')
+
+def cpu_supports_bf16():
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return None
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def configure_precision():
+    """Apply config.PRECISION_POLICY globally; must run before the model is built"""
+    policy = config.PRECISION_POLICY
+    if policy == 'mixed_bfloat16' and cpu_supports_bf16() is False and not tf.config.list_physical_devices('GPU'):
+        print("⚠️  This CPU has no native bfloat16 (AVX512-BF16/AMX); mixed_bfloat16 will likely be slower")
+    tf.keras.mixed_precision.set_global_policy(policy)
+    print(f"🧮 Precision: {policy}, XLA: {'on' if config.JIT_COMPILE else 'off'}")
+
+def to_float32(model, num_classes, alpha=1.0, img_size=None):
+    """Float32 copy of a mixed-precision model for saving, export and serving"""
+    tf.keras.mixed_precision.set_global_policy('float32')
+    float_model, _ = create_model(num_classes, weights=None, alpha=alpha, img_size=img_size)
+    float_model.set_weights(model.get_weights())
+    float_model.compile(
+        optimizer=Adam(learning_rate=config.FINE_TUNE_LR),
+        loss='categorical_crossentropy',
+        metrics=['accuracy', TopKCategoricalAccuracy(k=3)]
+    )
+    return float_model
+
+def write_training_report(phases, val_acc, val_top3):
+    """Record this run under its precision mode and compare it with the float32 baseline"""
+    report = {}
+    if os.path.exists(config.TRAINING_REPORT_PATH):
+        with open(config.TRAINING_REPORT_PATH, 'r') as f:
+            report = json.load(f)
+    
+    runs = report.setdefault('runs', {})
+    mode = precision_mode()
+    runs[mode] = {
+        'precision_policy': config.PRECISION_POLICY,
+        'jit_compile': config.JIT_COMPILE,
+        'batch_size': config.BATCH_SIZE,
+        'phases': phases,
+        'val_accuracy': float(val_acc),
+        'val_top_3_accuracy': float(val_top3),
+        'finished': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    
+    baseline = runs.get('float32')
+    if baseline and mode != 'float32':
+        step = runs[mode]['phases']['phase2']['median_step_ms']
+        base_step = baseline['phases']['phase2']['median_step_ms']
+        speedup = base_step / step if step and base_step else None
+        accuracy_delta = runs[mode]['val_accuracy'] - baseline['val_accuracy']
+        report['comparison'] = {
+            'mode': mode,
+            'baseline': 'float32',
+            'phase2_step_speedup': speedup,
+            'val_accuracy_delta': accuracy_delta,
+            'wins': bool(speedup and speedup > 1.0 and accuracy_delta >= -config.PRECISION_MAX_ACCURACY_DROP)
+        }
+        verdict = "✅ faster at equal accuracy" if report['comparison']['wins'] else "❌ keep float32"
+        print(f"📊 {mode} vs float32: step speedup x{speedup or 0:.2f}, "
+              f"val accuracy {accuracy_delta:+.4f} ({verdict})")
+    
+    with open(config.TRAINING_REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+
+class TrainingState(Callback):
+    """Full training-state checkpoints so an interrupted run resumes in the right phase and epoch
+    
+    Every CHECKPOINT_EVERY_EPOCHS epochs the model and optimizer (including a
+    learning rate lowered by ReduceLROnPlateau) are written with
+    tf.train.Checkpoint, and phase, epoch, data seed and the early-stopping,
+    LR-plateau and best-model counters go to state.json next to them.
+    
+    In multi-worker training every worker must take part in saving, but
+    only the chief's files are kept; the others write to a scratch directory
+    (scratch_directory, or a new temporary one) that finish() removes.
+    """
+    
+    TRACKED_ATTRS = ('wait', 'best', 'cooldown_counter', 'stopped_epoch')
+    
+    def __init__(self, signature, tracked_callbacks, directory=None, chief=True, scratch_directory=None):
+        super().__init__()
+        self.directory = directory or config.CHECKPOINT_DIR
+        self.signature = signature
+        self.tracked = tracked_callbacks
+        self.chief = chief
+        if chief:
+            self.write_directory = self.directory
+        else:
+            self.write_directory = scratch_directory or tempfile.mkdtemp(prefix='training_state_')
+        self.state_path = os.path.join(self.directory, 'state.json')
+        self.state = self._load()
+        self._resuming = False
+        self._trained = set()
+    
+    def _fresh(self):
+        return {'signature': self.signature, 'phase': 1, 'epoch': 0, 'completed_phases': [], 'callbacks': {}}
+    
+    def _load(self):
+        if not os.path.exists(self.state_path):
+            return self._fresh()
+        if not config.RESUME_TRAINING:
+            if self.chief:
+                shutil.rmtree(self.directory, ignore_errors=True)
+            return self._fresh()
+        with open(self.state_path, 'r') as f:
+            state = json.load(f)
+        if state.get('signature') != self.signature:
+            print("⚠️  Checkpoints belong to a different dataset or architecture; starting fresh")
+            if self.chief:
+                shutil.rmtree(self.directory, ignore_errors=True)
+            return self._fresh()
+        print(f"♻️  Found training state: phase {state['phase']}, {state['epoch']} epoch(s) done")
+        return state
+    
+    def phase_done(self, phase):
+        return phase in self.state['completed_phases']
+    
+    def _manager(self, model, phase):
+        self._model = model
+        # A model whose head was trained from the feature cache is not compiled yet
+        self._optimizer = getattr(model, 'optimizer', None)
+        objects = {'model': model}
+        if self._optimizer is not None:
+            objects['optimizer'] = self._optimizer
+        checkpoint = tf.train.Checkpoint(**objects)
+        directory = os.path.join(self.write_directory, f'phase{phase}')
+        return checkpoint, tf.train.CheckpointManager(checkpoint, directory, max_to_keep=config.CHECKPOINT_KEEP)
+    
+    def begin_phase(self, model, phase):
+        """Restore model/optimizer for a compiled phase; returns the epoch to continue from"""
+        self.phase = phase
+        self._checkpoint, self._checkpoints = self._manager(model, phase)
+        latest = tf.train.latest_checkpoint(os.path.join(self.directory, f'phase{phase}'))
+        self._resuming = self.state['phase'] == phase and latest is not None
+        
+        if self._resuming:
+            self._checkpoint.restore(latest).expect_partial()
+            print(f"♻️  Resuming phase {phase} after epoch {self.state['epoch']}")
+        else:
+            # Weights only: the new phase starts with its own fresh optimizer. Not needed
+            # when the previous phase just ran in this process.
+            previous = self._weights_path(phase - 1)
+            if phase - 1 not in self._trained and os.path.exists(previous):
+                model.load_weights(previous)
+                print(f"♻️  Starting phase {phase} from the phase {phase - 1} weights")
+            self.state.update(phase=phase, epoch=0)
+        
+        # Fresh augmentation/shuffle randomness after a resume instead of replaying epoch 1
+        self.state['data_seed'] = config.RANDOM_SEED + 1000 * phase + self.state['epoch']
+        tf.random.set_seed(self.state['data_seed'])
+        self._trained.add(phase)
+        return self.state['epoch']
+    
+    def complete_phase(self, model, phase):
+        """Mark a phase trained outside fit() (e.g. from the feature cache) as done"""
+        self.phase = phase
+        self._checkpoint, self._checkpoints = self._manager(model, phase)
+        self.state.update(phase=phase, epoch=0)
+        self._trained.add(phase)
+        self._save(completed=True)
+    
+    def _weights_path(self, phase, directory=None):
+        return os.path.join(directory or self.directory, f'phase{phase}.weights.h5')
+    
+    def on_train_begin(self, logs=None):
+        # Runs after the tracked callbacks reset themselves in their own on_train_begin
+        saved = self.state['callbacks']
+        for callback in self.tracked:
+            name = type(callback).__name__
+            # The best-model threshold carries over between phases; the rest only within a phase
+            if name in saved and (self._resuming or isinstance(callback, ModelCheckpoint)):
+                for attr, value in saved[name].items():
+                    if value is not None:
+                        setattr(callback, attr, value)
+    
+    def on_epoch_end(self, epoch, logs=None):
+        self.state['epoch'] = epoch + 1
+        if (epoch + 1) % config.CHECKPOINT_EVERY_EPOCHS == 0:
+            self._save()
+    
+    def on_train_end(self, logs=None):
+        self._save(completed=True)
+    
+    def _save(self, completed=False):
+        self._checkpoints.save(checkpoint_number=self.state['epoch'])
+        if completed:
+            self._model.save_weights(self._weights_path(self.phase, self.write_directory))
+        if not self.chief:
+            return
+        self.state['callbacks'] = {
+            type(callback).__name__: {
+                attr: self._attr_value(callback, attr)
+                for attr in self.TRACKED_ATTRS if hasattr(callback, attr)
+            }
+            for callback in self.tracked
+        }
+        if self._optimizer is not None:
+            self.state['learning_rate'] = float(tf.keras.backend.get_value(self._optimizer.learning_rate))
+        if completed and self.phase not in self.state['completed_phases']:
+            self.state['completed_phases'].append(self.phase)
+        
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+    
+    @staticmethod
+    def _attr_value(callback, attr):
+        # Callbacks that have not run fit() yet have best=None
+        value = getattr(callback, attr)
+        if value is None:
+            return None
+        return float(value) if attr == 'best' else int(value)
+    
+    def finish(self):
+        """Training completed; the next run starts from scratch"""
+        shutil.rmtree(self.write_directory, ignore_errors=True)
+
+def create_strategy():
+    """MultiWorkerMirroredStrategy over the cluster in TF_CONFIG, or the default single-process strategy"""
+    if not config.DISTRIBUTED:
+        return tf.distribute.get_strategy()
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    cluster = json.loads(os.environ.get('TF_CONFIG', '{}')).get('cluster', {})
+    workers = sum(len(tasks) for tasks in cluster.values()) or 1
+    print(f"🌐 MultiWorkerMirroredStrategy: {workers} worker(s), {strategy.num_replicas_in_sync} replica(s)")
+    return strategy
+
+def is_chief():
+    """Whether this process writes models, labels and reports (the chief, or worker 0 without one)"""
+    tf_config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    task = tf_config.get('task', {})
+    if 'type' not in task or task['type'] == 'chief':
+        return True
+    return task['type'] == 'worker' and task.get('index', 0) == 0 and 'chief' not in tf_config.get('cluster', {})
+
+def create_distributed_input_pipeline(strategy):
+    """Per-worker sharded train/val inputs with the global batch split across replicas
+    
+    Each worker decodes only its own files, and every split repeats so all
+    workers run the same number of steps (uneven shards would stall the
+    collective ops); fit() gets steps_per_epoch / validation_steps.
+    """
+    from data_pipeline import create_split_dataset, dataset_class_names, split_size
+    
+    class_names = dataset_class_names()
+    global_batch = config.BATCH_SIZE * strategy.num_replicas_in_sync
+    
+    def distributed(split, training):
+        def dataset_fn(context):
+            ds = create_split_dataset(split, training, context.get_per_replica_batch_size(global_batch),
+                                      shard=(context.num_input_pipelines, context.input_pipeline_id),
+                                      class_names=class_names)
+            return ds.repeat()
+        return strategy.distribute_datasets_from_function(dataset_fn)
+    
+    steps = {
+        'steps_per_epoch': max(1, split_size('train', class_names) // global_batch),
+        'validation_steps': max(1, split_size('val', class_names) // global_batch)
+    }
+    print(f"📊 Global batch {global_batch} ({config.BATCH_SIZE} per replica), "
+          f"{steps['steps_per_epoch']} steps/epoch")
+    return distributed('train', True), distributed('val', False), \
+        {name: i for i, name in enumerate(class_names)}, steps
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def launch_local_workers(num_workers, args=()):
+    """Run train_model.py as a local N-process MultiWorkerMirroredStrategy cluster (for testing)"""
+    cluster = {'worker': [f"localhost:{free_port()}" for _ in range(num_workers)]}
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ,
+                   TF_CONFIG=json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}}),
+                   TF_NUM_INTRAOP_THREADS=str(threads), TF_NUM_INTEROP_THREADS='1')
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), '--distributed', *args],
+                                          env=env))
+    print(f"🚀 Launched {num_workers} local workers ({threads} thread(s) each)")
+    codes = [process.wait() for process in processes]
+    return max(codes)
+
+def run_signature(class_indices):
+    """Fingerprint of what a checkpoint depends on, so stale state is never resumed"""
+    key = json.dumps([class_indices, config.BASE_MODEL, config.IMG_SIZE, config.DENSE_UNITS,
+                      config.FINE_TUNE_LAYERS, config.PRECISION_POLICY], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+def build_head(x, num_classes, dense_units=None, dropout_rate=None, activation='softmax'):
+    """Classifier head on pooled features (named so weights can move between models)"""
+    dense_units = dense_units or config.DENSE_UNITS
+    dropout_rate = config.DROPOUT_RATE if dropout_rate is None else dropout_rate
+    
+    x = BatchNormalization(name='head_bn_1')(x)
+    x = Dropout(dropout_rate, name='head_dropout_1')(x)
+    x = Dense(dense_units, activation='relu', name='head_dense')(x)
+    x = BatchNormalization(name='head_bn_2')(x)
+    x = Dropout(dropout_rate, name='head_dropout_2')(x)
+    # Softmax in float32 even under mixed precision, for numerically stable probabilities and loss
+    return Dense(num_classes, activation=activation, dtype='float32', name='predictions')(x)
+
+def create_model(num_classes, weights='imagenet', alpha=1.0, img_size=None):
+    """Create model with MobileNetV2 (alpha/img_size shrink it, e.g. for the cascade's first stage)"""
     print("🏗️  Building model...")
+    img_size = img_size or config.IMG_SIZE
     
     base_model = MobileNetV2(
-        weights='imagenet',
+        weights=weights,
         include_top=False,
-        input_shape=(config.IMG_SIZE, config.IMG_SIZE, 3)
+        input_shape=(img_size, img_size, 3),
+        alpha=alpha
     )
     
     base_model.trainable = False
@@ -65,32 +441,74 @@ def create_model(num_classes):
     # Add custom layers
     x = base_model.output
     x = GlobalAveragePooling2D()(x)
-    x = BatchNormalization()(x)
-    x = Dropout(config.DROPOUT_RATE)(x)
-    x = Dense(config.DENSE_UNITS, activation='relu')(x)
-    x = BatchNormalization()(x)
-    x = Dropout(config.DROPOUT_RATE)(x)
-    predictions = Dense(num_classes, activation='softmax')(x)
+    predictions = build_head(x, num_classes)
     
     model = Model(inputs=base_model.input, outputs=predictions)
     
     print(f"✅ Model created: {model.count_params():,} parameters")
     return model, base_model
 
-def train_model():
-    """Main training function"""
+def train_head_from_cache(model, base_model, class_indices, extra_callbacks=()):
+    """Phase 1 on precomputed backbone features instead of full forward passes"""
+    from feature_cache import copy_head_weights, prepare_features, train_head
+    
+    class_names = sorted(class_indices, key=class_indices.get)
+    train, val = prepare_features(base_model, class_names)
+    
+    head_callbacks = [
+        EarlyStopping(
+            monitor='val_accuracy',
+            patience=config.EARLY_STOPPING_PATIENCE,
+            restore_best_weights=True
+        ),
+        ReduceLROnPlateau(
+            monitor='val_loss',
+            factor=config.LR_REDUCTION_FACTOR,
+            patience=config.LR_REDUCTION_PATIENCE
+        ),
+        *extra_callbacks
+    ]
+    head, history = train_head(train, val, len(class_names), head_callbacks)
+    
+    copy_head_weights(head, model)
+    model.save(config.BEST_MODEL_PATH)
+    return history
+
+def train_model(extra_callbacks=()):
+    """Main training function (extra_callbacks also see every epoch, e.g. sweep reporting)"""
     print("🚀 Starting training...")
     
     # Check dataset
-    if not os.path.exists(os.path.join(config.PROCESSED_DATASET_DIR, 'train')):
+    if not dataset_ready():
         print("❌ Processed dataset not found. Run split_dataset.py first!")
         return False
     
-    # Create generators
-    train_gen, val_gen = create_data_generators()
+    # Must exist before any other TensorFlow op
+    strategy = create_strategy()
+    chief = is_chief()
+    fit_steps = {}
+    
+    # Create input pipeline
+    if config.DISTRIBUTED:
+        if config.INPUT_PIPELINE == 'generator':
+            print("❌ Distributed training needs INPUT_PIPELINE = 'tf_data', 'shards' or 'image_cache'")
+            return False
+        train_gen, val_gen, class_indices, fit_steps = create_distributed_input_pipeline(strategy)
+    else:
+        train_gen, val_gen, class_indices = create_input_pipeline()
+    
+    configure_precision()
+    
+    # Linear scaling rule for the larger global batch
+    lr_scale = strategy.num_replicas_in_sync if config.SCALE_LR_WITH_REPLICAS else 1
     
-    # Create model
-    model, base_model = create_model(train_gen.num_classes)
+    # Create model (variables mirrored across replicas)
+    with strategy.scope():
+        model, base_model = create_model(len(class_indices))
+    
+    # Every worker runs the callbacks, but only the chief writes the real best model
+    scratch = None if chief else tempfile.mkdtemp(prefix='training_state_')
+    best_model_path = config.BEST_MODEL_PATH if chief else os.path.join(scratch, 'best_model.h5')
     
     # Callbacks
     callbacks = [
@@ -100,7 +518,7 @@ def train_model():
             restore_best_weights=True
         ),
         ModelCheckpoint(
-            config.BEST_MODEL_PATH,
+            best_model_path,
             monitor='val_accuracy',
             save_best_only=True
         ),
@@ -108,23 +526,44 @@ def train_model():
             monitor='val_loss',
             factor=config.LR_REDUCTION_FACTOR,
             patience=config.LR_REDUCTION_PATIENCE
-        )
+        ),
     ]
+    throughput = ThroughputLogger(config.BATCH_SIZE * strategy.num_replicas_in_sync)
+    callbacks.append(throughput)
+    callbacks.extend(extra_callbacks)
+    
+    # Must come last: it restores callback counters after they reset at train begin
+    training_state = TrainingState(run_signature(class_indices), callbacks[:3], chief=chief,
+                                   scratch_directory=scratch)
+    callbacks.append(training_state)
     
     # Phase 1: Train classifier
     print("\n🎯 Phase 1: Training classifier layers")
-    model.compile(
-        optimizer=Adam(learning_rate=config.LEARNING_RATE),
-        loss='categorical_crossentropy',
-        metrics=['accuracy', TopKCategoricalAccuracy(k=3)]
-    )
+    if training_state.phase_done(1):
+        print("⏭️  Phase 1 already completed")
+    elif config.USE_FEATURE_CACHE and not config.DISTRIBUTED:
+        history1 = train_head_from_cache(model, base_model, class_indices, extra_callbacks)
+        training_state.complete_phase(model, 1)
+    else:
+        with strategy.scope():
+            model.compile(
+                optimizer=Adam(learning_rate=config.LEARNING_RATE * lr_scale),
+                loss='categorical_crossentropy',
+                metrics=['accuracy', TopKCategoricalAccuracy(k=3)],
+                jit_compile=config.JIT_COMPILE
+            )
+        
+        history1 = model.fit(
+            train_gen,
+            epochs=config.INITIAL_EPOCHS,
+            initial_epoch=training_state.begin_phase(model, 1),
+            validation_data=val_gen,
+            callbacks=callbacks,
+            **fit_steps
+        )
     
-    history1 = model.fit(
-        train_gen,
-        epochs=config.INITIAL_EPOCHS,
-        validation_data=val_gen,
-        callbacks=callbacks
-    )
+    phases = {'phase1': throughput.summary()}
+    throughput.reset()
     
     # Phase 2: Fine-tuning
     print("\n🔥 Phase 2: Fine-tuning")
@@ -134,44 +573,98 @@ def train_model():
     for layer in base_model.layers[:-config.FINE_TUNE_LAYERS]:
         layer.trainable = False
     
-    model.compile(
-        optimizer=Adam(learning_rate=config.FINE_TUNE_LR),
-        loss='categorical_crossentropy',
-        metrics=['accuracy', TopKCategoricalAccuracy(k=3)]
-    )
+    with strategy.scope():
+        model.compile(
+            optimizer=Adam(learning_rate=config.FINE_TUNE_LR * lr_scale),
+            loss='categorical_crossentropy',
+            metrics=['accuracy', TopKCategoricalAccuracy(k=3)],
+            jit_compile=config.JIT_COMPILE
+        )
     
     history2 = model.fit(
         train_gen,
         epochs=config.FINE_TUNE_EPOCHS,
+        initial_epoch=training_state.begin_phase(model, 2),
         validation_data=val_gen,
-        callbacks=callbacks
+        callbacks=callbacks,
+        **fit_steps
     )
     
+    phases['phase2'] = throughput.summary()
+    
+    # Only the chief writes models, labels, exports and reports
+    if not chief:
+        training_state.finish()
+        print("✅ Worker finished")
+        return True
+    if config.DISTRIBUTED:
+        from data_pipeline import create_split_dataset
+        val_gen = create_split_dataset('val', False, class_names=sorted(class_indices, key=class_indices.get))
+    
     # Load best model and save
     model = tf.keras.models.load_model(config.BEST_MODEL_PATH)
+    if config.PRECISION_POLICY != 'float32':
+        # Serving, SavedModel and TFLite expect a plain float32 graph
+        model = to_float32(model, len(class_indices))
+        model.save(config.BEST_MODEL_PATH)
     model.save(config.MODEL_PATH)
     
     # Save class indices
     with open(config.CLASS_INDICES_PATH, 'w') as f:
-        json.dump(train_gen.class_indices, f, indent=2)
+        json.dump(class_indices, f, indent=2)
     
     # Save labels
-    labels = {v: k for k, v in train_gen.class_indices.items()}
+    labels = {v: k for k, v in class_indices.items()}
     with open(config.LABELS_PATH, 'w') as f:
         for i in range(len(labels)):
             f.write(labels[i] + '\n')
     
-    # Convert to TFLite
-    try:
-        converter = tf.lite.TFLiteConverter.from_keras_model(model)
-        converter.optimizations = [tf.lite.Optimize.DEFAULT]
-        tflite_model = converter.convert()
+    # Sweep trials only need the trained weights and metrics
+    if config.EXPORT_MODELS:
+        # Export SavedModel for the 'savedmodel' serving backend
+        try:
+            if hasattr(model, 'export'):
+                model.export(config.SAVED_MODEL_DIR)
+            else:
+                tf.saved_model.save(model, config.SAVED_MODEL_DIR)
+            print(f"✅ SavedModel exported: {config.SAVED_MODEL_DIR}")
+        except Exception as e:
+            print(f"⚠️  SavedModel export failed: {e}")
         
-        with open(config.TFLITE_MODEL_PATH, 'wb') as f:
-            f.write(tflite_model)
-        print(f"✅ TFLite model saved: {config.TFLITE_MODEL_PATH}")
-    except Exception as e:
-        print(f"⚠️  TFLite conversion failed: {e}")
+        # Convert to TFLite
+        try:
+            from quantization import convert_dynamic
+            tflite_model = convert_dynamic(model)
+            
+            with open(config.TFLITE_MODEL_PATH, 'wb') as f:
+                f.write(tflite_model)
+            print(f"✅ TFLite model saved: {config.TFLITE_MODEL_PATH}")
+        except Exception as e:
+            print(f"⚠️  TFLite conversion failed: {e}")
+    
+    # Full-integer model, published only if it passes the accuracy gate
+    if config.TFLITE_QUANTIZATION == 'int8':
+        try:
+            from quantization import quantize_with_gate
+            quantize_with_gate(model)
+        except Exception as e:
+            print(f"⚠️  int8 quantization failed: {e}")
+    
+    # Small first-stage model for cascade inference, calibrated against this one
+    if config.TRAIN_CASCADE_MODEL:
+        try:
+            from cascade import train_cascade
+            train_cascade(class_indices, model)
+        except Exception as e:
+            print(f"⚠️  Cascade model training failed: {e}")
+    
+    # Smaller student trained to match this model's outputs
+    if config.DISTILL_STUDENT:
+        try:
+            from distillation import distill
+            distill(class_indices, model, config.MODEL_PATH)
+        except Exception as e:
+            print(f"⚠️  Distillation failed: {e}")
     
     # Final evaluation
     val_loss, val_acc, val_top3 = model.evaluate(val_gen, verbose=0)
@@ -179,6 +672,26 @@ def train_model():
     print(f"📊 Final Validation Accuracy: {val_acc:.4f}")
     print(f"📊 Final Top-3 Accuracy: {val_top3:.4f}")
     
+    write_training_report(phases, val_acc, val_top3)
+    training_state.finish()
+    
+    # Running servers pick the new version up from the registry without a restart
+    if config.PUBLISH_TO_REGISTRY:
+        from model_registry import publish
+        publish(metrics={'val_accuracy': float(val_acc), 'val_top3_accuracy': float(val_top3)})
+    
+    return True
+
+def distill_trained_model():
+    """Distill a student from the model a previous run saved, without retraining it"""
+    if not os.path.exists(config.CLASS_INDICES_PATH):
+        print("❌ No trained model found. Run train_model.py first!")
+        return False
+    with open(config.CLASS_INDICES_PATH, 'r') as f:
+        class_indices = json.load(f)
+    
+    from distillation import distill
+    distill(class_indices)
     return True
 
 if __name__ == "__main__":
@@ -192,4 +705,23 @@ if __name__ == "__main__":
         except:
             pass
     
+    parser = argparse.ArgumentParser(description="Train the breed classifier")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Ignore checkpoints of an interrupted run and start from scratch")
+    parser.add_argument('--distributed', action='store_true',
+                        help="Train with MultiWorkerMirroredStrategy using the cluster in TF_CONFIG")
+    parser.add_argument('--local-workers', type=int, default=0,
+                        help="Launch this many local processes as one distributed cluster (testing)")
+    parser.add_argument('--distill', action='store_true',
+                        help="Only distill a smaller student from the already trained model")
+    args = parser.parse_args()
+    if args.no_resume:
+        config.RESUME_TRAINING = False
+    if args.distributed:
+        config.DISTRIBUTED = True
+    
+    if args.local_workers:
+        sys.exit(launch_local_workers(args.local_workers, ['--no-resume'] if args.no_resume else []))
+    if args.distill:
+        sys.exit(0 if distill_trained_model() else 1)
     train_model()